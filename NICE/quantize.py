@@ -12,19 +12,23 @@ eps = 1e-5
 
 
 def my_mean(x):
-    size = x.size()
-    size_tensor = torch.Tensor([s for s in size])
-    elements = torch.prod(size_tensor)
-    return torch.sum(x) / elements
+    return torch.sum(x) / x.numel()
 
 
 def my_std(x):
-    size = x.size()
-    size_tensor = torch.Tensor([s for s in size])
-    elements = torch.FloatTensor([torch.prod(size_tensor)])
-    x_min_mean_sq = (x - my_mean(x)) * (x - my_mean(x))
-    std = torch.sqrt(torch.sum(x_min_mean_sq) / (elements - 1))
-    return std[0]
+    x_min_mean = x - my_mean(x)
+    return torch.sqrt(torch.sum(x_min_mean * x_min_mean) / (x.numel() - 1))
+
+
+# mean & std of x in a single pass over x, as 0-dim tensors of x dtype on x device, i.e. without host syncs
+# sums are accumulated in double precision, therefore statistics do not depend on the device (or its reduction order)
+def mean_std(x):
+    n = x.numel()
+    x_sum = torch.sum(x, dtype=torch.float64)
+    x_sq_sum = torch.sum(x * x, dtype=torch.float64)
+    mean = x_sum / n
+    var = (x_sq_sum - x_sum * mean).clamp(min=0.) / max(n - 1, 1)
+    return mean.to(x.dtype), var.sqrt().to(x.dtype)
 
 
 def norm_cdf(x, mean, std):
@@ -70,6 +74,40 @@ class quantize(object):
         self.weight_max_int = 2 ** (weight_bitwidth - 1) - 1 if not self.improvment_to_bin else 2 ** weight_bitwidth - 1
         self.act_max_int = 2 ** act_bitwidth - 1  # for example for 7 bit in can be 255, int is [0,...,255]
         self.quant_error = {}
+        # generator for seeded noise, None means global RNG
+        self.noise_generator = None
+
+    # seeded mode, noise is drawn from a CPU generator, therefore it is reproducible on every device
+    # cost: noise tensor of weights size is drawn on CPU & copied to op device on every call (torch 1.0 has no device generators)
+    # seed=None turns seeded mode off
+    def set_noise_seed(self, seed):
+        self.noise_generator = None
+        if seed is not None:
+            self.noise_generator = torch.Generator()
+            self.noise_generator.manual_seed(seed)
+
+    def uniform_like(self, x):
+        if self.noise_generator is None:
+            return torch.rand_like(x)
+
+        return torch.rand(x.size(), generator=self.noise_generator).to(x.device)
+
+    # adds noise to x in-place, x is replaced by:
+    # mask * uni_icdf(clamp(uni_cdf(x) + noise, 0, 1)) + (1 - mask) * quant_func_(x)
+    # a single uniform tensor r is drawn, mask is (r < noise_mask), and given mask, r / noise_mask is uniform as well, i.e. the noise
+    def fused_uni_noise_(self, x, min_value, max_value, noise_step, quant_func_):
+        # empty mask, x is quantized only
+        if self.noise_mask <= 0:
+            quant_func_(x)
+            return x
+
+        r = self.uniform_like(x)
+        mask = r < self.noise_mask
+        # noisy values are computed in r, clamp in uni_cdf domain to [0,1] is clamp to [min_value, max_value]
+        r.mul_(2. / self.noise_mask).sub_(1.).mul_(noise_step * (max_value - min_value)).add_(x).clamp_(min_value, max_value)
+        quant_func_(x)
+        x.masked_scatter_(mask, r.masked_select(mask))
+        return x
 
     def add_improved_uni_noise(self, modules):
         for m in modules:
@@ -77,46 +115,20 @@ class quantize(object):
                 weight_quant_step = None
                 for p in m._parameters:
                     if m._parameters[p] is not None:
-                        d = m._parameters[p].device
                         if p == 'weight':
                             weight_quant_step = self.quant_step(m)
-                            min_value = -self.weight_max_int * weight_quant_step  # .to(d)
-                            max_value = self.weight_max_int * weight_quant_step  # .to(d)
-                            y_p = uni_cdf(m._parameters[p].data, min_value, max_value)
+                            max_value = self.weight_max_int * weight_quant_step
                             noise_step = 1. / (
                                     2 ** (self.weight_bitwidth + 1) - 2) if self.improvment_to_bin else 1. / (2 ** (
                                     self.weight_bitwidth + 1) - 4)  # if not high_noise else 1. / (2 ** (bitwidth))
-                            noise = y_p.clone().uniform_(-noise_step, noise_step)
-                            y_out_p = uni_icdf(torch.clamp(y_p + noise, 0, 1), min_value, max_value)
-
-                            # noise mask
-                            p_noise_mask = self.noise_mask
-                            mask = torch.bernoulli(
-                                m._parameters[p].data.new(m._parameters[p].data.size()).fill_(p_noise_mask))
-                            unmask = 1 - mask
-                            quant_value, _ = self.quant_weight_wrpn_improved(m._parameters[p].data, m)
-                            result = mask * y_out_p + unmask * quant_value
-                            m._parameters[p].data = result.to(d)
+                            self.fused_uni_noise_(m._parameters[p].data, -max_value, max_value, noise_step,
+                                                  lambda x: self.quant_weight_wrpn_improved_(x, m))
 
                         if p == 'bias' and self.bias_quantization:
-                            d = m._parameters[p].device
-                            bias_max_value = self.get_bias_max_value(weight_quant_step)
-                            min_value = -bias_max_value  # .to(d)
-                            max_value = bias_max_value  # .to(d)
-                            y_p = uni_cdf(m._parameters[p].data, min_value, max_value)
-                            num_of_bits_in_after_conv_add = self.num_of_bits_in_after_conv_add
-                            noise_step = 1. / (2 ** (num_of_bits_in_after_conv_add + 1))
-                            noise = y_p.clone().uniform_(-noise_step, noise_step)
-                            y_out_p = uni_icdf(torch.clamp(y_p + noise, 0, 1), min_value, max_value)
-
-                            # dropout
-                            p_noise_mask = self.noise_mask
-                            mask = torch.bernoulli(
-                                m._parameters[p].data.new(m._parameters[p].data.size()).fill_(p_noise_mask))
-                            unmask = 1 - mask
-                            quant_value = self.quant_bias_wrpn_improved(m._parameters[p].data, weight_quant_step)
-                            result = mask * y_out_p + unmask * quant_value
-                            m._parameters[p].data = result.to(d)
+                            max_value = float(self.get_bias_max_value(weight_quant_step))
+                            noise_step = 1. / (2 ** (self.num_of_bits_in_after_conv_add + 1))
+                            self.fused_uni_noise_(m._parameters[p].data, -max_value, max_value, noise_step,
+                                                  lambda x: x.copy_(self.quant_bias_wrpn_improved(x, weight_quant_step)))
 
     def calc_b(self, wanted_clamp, layer_basis):
         b = wanted_clamp / wanted_clamp.new_tensor(layer_basis * self.weight_max_int)
@@ -125,11 +137,10 @@ class quantize(object):
         return b
 
     def basic_clamp(self, x):
-        mean_p = x.mean()
-        std_p = x.std()
-        std_clamp = (mean_p > 0).float() * (mean_p + self.std_weight_clamp * std_p) + \
-                    (mean_p < 0).float() * (mean_p - self.std_weight_clamp * std_p)
-        clamp_value = abs(std_clamp).view(1)
+        mean_p, std_p = mean_std(x)
+        # mean + std_weight_clamp * std away from zero, 0 if mean is 0
+        std_clamp = mean_p + mean_p.sign() * (self.std_weight_clamp * std_p)
+        clamp_value = std_clamp.abs().view(1)
         return clamp_value
 
     def get_weight_clamp_value(self, m):
@@ -300,6 +311,18 @@ class quantize(object):
 
         return quantized_x.to(x.device), weight_max_value / self.weight_max_int
 
+    # in-place version of quant_weight_wrpn_improved()
+    def quant_weight_wrpn_improved_(self, x, m):
+        weight_max_value = self.get_weight_max_value(m)
+        weight_scale = self.weight_max_int / weight_max_value
+        x.clamp_(-weight_max_value, weight_max_value).mul_(weight_scale)
+        if self.improvment_to_bin:
+            x.div_(2).floor_().mul_(2).add_(1)
+        else:
+            x.round_()
+
+        return x.mul_(1 / weight_scale)
+
     def round_to_int(self, x):
         if self.improvment_to_bin:
             return 2 * torch.floor(x / 2) + 1
@@ -1,27 +1,76 @@
+import torch
 import torch.nn as nn
-from UNIQ.quantize import act_quantize, act_noise, check_quantization
+from UNIQ.quantize import act_quantize, act_quantize_lut, act_quantize_range_tables, act_noise, check_quantization, mean_std
 import torch.nn.functional as F
 
 
 class ActQuant(nn.Module):
 
     def __init__(self, quatize_during_training=False, noise_during_training=False, quant=False, noise=False,
-                 bitwidth=32):
+                 bitwidth=32, lut=False, momentum=0.1):
         super(ActQuant, self).__init__()
         self.quant = quant
         self.noise = noise
         self.bitwidth = bitwidth
         self.quatize_during_training = quatize_during_training
         self.noise_during_training = noise_during_training
+        # quantize by lookup table instead of erf & erfinv per element
+        self.lut = False
+        # momentum of activations range running statistics, in lookup table mode
+        self.momentum = momentum
+        if lut:
+            self.enable_lut()
+
+    # lookup table mode, training quantizes by batch range (like act_quantize) & tracks running range
+    # evaluation quantizes by running range, its tables are cached as buffers & rebuilt only when bitwidth or running range change
+    def enable_lut(self):
+        if self.lut:
+            return
+
+        self.lut = True
+        self.register_buffer('running_mean', torch.zeros(1))
+        self.register_buffer('running_std', torch.ones(1))
+        self.register_buffer('lut_thresholds', torch.zeros(0))
+        self.register_buffer('lut_levels', torch.zeros(0))
+        # bitwidth cached tables were built for, None means tables have to be rebuilt
+        self.lut_bitwidth = None
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        super(ActQuant, self)._load_from_state_dict(*args, **kwargs)
+        # running range might have changed
+        if self.lut:
+            self.lut_bitwidth = None
 
     def update_stage(self, quatize_during_training=False, noise_during_training=False):
         self.quatize_during_training = quatize_during_training
         self.noise_during_training = noise_during_training
 
+    def lut_quantize(self, input):
+        if self.training:
+            mean, std = mean_std(input.data)
+            # update running range, cached tables are out of date
+            self.running_mean.mul_(1. - self.momentum).add_(self.momentum * mean)
+            self.running_std.mul_(1. - self.momentum).add_(self.momentum * std)
+            self.lut_bitwidth = None
+            thresholds, levels = act_quantize_range_tables(mean, std, self.bitwidth, input.dtype)
+        else:
+            if self.lut_bitwidth != self.bitwidth:
+                self.lut_thresholds, self.lut_levels = act_quantize_range_tables(self.running_mean[0], self.running_std[0], self.bitwidth,
+                                                                                 input.dtype)
+                self.lut_bitwidth = self.bitwidth
+            thresholds, levels = self.lut_thresholds, self.lut_levels
+
+        return act_quantize_lut.apply(input, thresholds, levels)
+
     def forward(self, input):
         if self.quant and (not self.training or (self.training and self.quatize_during_training)):
             assert (isinstance(self.bitwidth, int))
-            x = act_quantize.apply(input, self.bitwidth)
+            if self.bitwidth > 16:
+                x = F.relu(input)  # No quantization for high bitwidths
+            elif self.lut:
+                x = self.lut_quantize(input)
+            else:
+                x = act_quantize.apply(input, self.bitwidth)
         elif self.noise and self.training and self.noise_during_training:
             assert (False)
             x = act_noise.apply(input, bitwidth=self.bitwidth, training=self.training)
@@ -30,3 +79,11 @@ class ActQuant(nn.Module):
 
         # print('Activation is quantized to {} values'.format(check_quantization(x)))
         return x
+
+
+# enables lookup table mode in all model ActQuant modules
+def set_act_lut(model, lut):
+    if lut:
+        for m in model.modules():
+            if isinstance(m, ActQuant):
+                m.enable_lut()
@@ -1,10 +1,41 @@
 from os.path import join
+from numpy.random import RandomState
+from numpy import uint8
+from PIL import Image
 import torchvision.datasets as datasets
 
 __DATASETS_DEFAULT_PATH = '/media/ssd/Datasets/'
 
 
-def get_dataset(name, train, transform, target_transform=None, download=True, datasets_path=__DATASETS_DEFAULT_PATH):
+# deterministic random images & labels, generated in memory, i.e. no download & no disk access
+# same interface as torchvision CIFAR datasets (data of [N, H, W, C] uint8, targets, train)
+class SyntheticDataset:
+    def __init__(self, train, transform=None, target_transform=None, size=10000, resolution=32, nClasses=10):
+        self.train = train
+        self.transform = transform
+        self.target_transform = target_transform
+        # validation split is 1/5 of train split, each split has its own seed
+        nSamples = size if train else max(size // 5, 1)
+        rand = RandomState(0 if train else 1)
+        self.data = rand.randint(256, size=(nSamples, resolution, resolution, 3)).astype(uint8)
+        self.targets = rand.randint(nClasses, size=nSamples).tolist()
+
+    def __getitem__(self, index):
+        img, target = Image.fromarray(self.data[index]), self.targets[index]
+        if self.transform is not None:
+            img = self.transform(img)
+        if self.target_transform is not None:
+            target = self.target_transform(target)
+
+        return img, target
+
+    def __len__(self):
+        return len(self.data)
+
+
+# synthetic_size, synthetic_resolution & synthetic_classes are used only by synthetic dataset
+def get_dataset(name, train, transform, target_transform=None, download=True, datasets_path=__DATASETS_DEFAULT_PATH, synthetic_size=10000,
+                synthetic_resolution=32, synthetic_classes=10):
     root = datasets_path  # '/mnt/ssd/ImageNet/ILSVRC/Data/CLS-LOC' #os.path.join(datasets_path, name)
 
     if name == 'cifar10':
@@ -22,3 +53,7 @@ def get_dataset(name, train, transform, target_transform=None, download=True, da
             root = join(root, 'val')
 
         return datasets.ImageFolder(root=root, transform=transform, target_transform=target_transform)
+
+    elif name == 'synthetic':
+        return SyntheticDataset(train, transform=transform, target_transform=target_transform, size=synthetic_size,
+                                resolution=synthetic_resolution, nClasses=synthetic_classes)
@@ -369,10 +369,11 @@ def count_flops(model, input_size, in_channels):
 
     net = add_flops_counting_methods(net)
 
-    net.cuda()
+    # count on model device
+    device = next(net.parameters()).device
     net = net.train()
 
-    batch = randn(batch_size, in_channels, input_size, input_size).cuda()
+    batch = randn(batch_size, in_channels, input_size, input_size, device=device)
     net.start_flops_count()
 
     _ = net(batch)
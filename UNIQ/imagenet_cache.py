@@ -0,0 +1,89 @@
+from argparse import ArgumentParser
+from json import dump
+from os import makedirs
+from os.path import join, exists
+from multiprocessing import Pool
+from time import time
+
+from numpy import asarray, array, save, int64 as np_int64, uint8 as np_uint8
+from numpy.lib.format import open_memmap
+from PIL import Image
+import torchvision.datasets as datasets
+
+from UNIQ.tensor_data import cachePaths
+
+
+# one-time ImageNet preprocessing, JPEGs are decoded & scaled once into a raw uint8 store
+# each split is written as [N, size, size, C] uint8 .npy (memory-mapped by MemmapImageDataset) + labels .npy + classes index
+# usage: python -m UNIQ.imagenet_cache --data <ImageNet folder with train/val subfolders> --dst <cache folder>
+
+# scale shorter side to size & take center crop, like scale_crop() before its crop
+def loadImage(path, size):
+    with open(path, 'rb') as f:
+        img = Image.open(f).convert('RGB')
+
+    w, h = img.size
+    scale = size / min(w, h)
+    w, h = max(size, int(round(w * scale))), max(size, int(round(h * scale)))
+    img = img.resize((w, h), Image.BILINEAR)
+    left, top = (w - size) // 2, (h - size) // 2
+    img = img.crop((left, top, left + size, top + size))
+
+    return asarray(img, dtype=np_uint8)
+
+
+def loadImageWorker(args):
+    return loadImage(*args)
+
+
+# maxPerClass: take only the first maxPerClass images of each class, i.e. ImageNet subset. None takes all images
+def buildCache(root, split, dst, size, maxPerClass=None, nWorkers=8, loggerFuncs=[]):
+    folder = datasets.ImageFolder(join(root, split))
+    samples = folder.samples
+    if maxPerClass is not None:
+        counters = [0] * len(folder.classes)
+        subset = []
+        for path, label in samples:
+            if counters[label] < maxPerClass:
+                subset.append((path, label))
+                counters[label] += 1
+        samples = subset
+
+    imagesPath, labelsPath, classesPath = cachePaths(dst, split)
+    nSamples = len(samples)
+    images = open_memmap(imagesPath, mode='w+', dtype=np_uint8, shape=(nSamples, size, size, 3))
+
+    startTime = time()
+    with Pool(nWorkers) as pool:
+        for i, img in enumerate(pool.imap(loadImageWorker, [(path, size) for path, _ in samples], chunksize=64)):
+            images[i] = img
+            if ((i + 1) % 10000) == 0:
+                for f in loggerFuncs:
+                    f('[{}] cached [{}/{}] images, time:[{:.3f}]'.format(split, i + 1, nSamples, time() - startTime))
+
+    images.flush()
+    del images
+
+    save(labelsPath, array([label for _, label in samples], dtype=np_int64))
+    with open(classesPath, 'w') as f:
+        dump(dict(classes=folder.classes, class_to_idx=folder.class_to_idx, size=size), f)
+
+    for f in loggerFuncs:
+        f('[{}] cache of [{}] images, size:[{}] is ready in [{}], time:[{:.3f}]'.format(split, nSamples, size, dst, time() - startTime))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser('ImageNet uint8 cache')
+    parser.add_argument('--data', type=str, required=True, help='ImageNet folder, with train & val subfolders')
+    parser.add_argument('--dst', type=str, required=True, help='cache folder')
+    parser.add_argument('--splits', type=str, default='train,val', help='comma separated splits to cache')
+    parser.add_argument('--size', type=int, default=256, help='cached images size, i.e. shorter side scale & center crop')
+    parser.add_argument('--max_per_class', type=int, default=None, help='max images per class, for ImageNet subsets')
+    parser.add_argument('--workers', type=int, default=8, help='num of decoding processes')
+    args = parser.parse_args()
+
+    if not exists(args.dst):
+        makedirs(args.dst)
+
+    for split in args.splits.split(','):
+        buildCache(args.data, split, args.dst, args.size, args.max_per_class, args.workers, loggerFuncs=[print])
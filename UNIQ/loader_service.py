@@ -0,0 +1,103 @@
+from atexit import register as atexit_register
+from collections import deque
+from math import ceil
+from random import seed as random_seed
+
+from torch import randperm, tensor, manual_seed, int64
+from torch.multiprocessing import Pool
+from torch.utils.data.dataloader import default_collate
+
+# datasets of worker process, set by workers initializer
+workerDatasets = None
+
+
+def initWorker(datasets):
+    global workerDatasets
+    workerDatasets = datasets
+
+
+# load & collate a single batch in worker
+# pool assigns batches to workers nondeterministically, therefore augmentations RNG (torch & python) is seeded per batch
+def loadBatch(args):
+    name, batchIndices, batchSeed = args
+    manual_seed(batchSeed)
+    random_seed(batchSeed)
+    dataset = workerDatasets[name]
+    return default_collate([dataset[i] for i in batchIndices])
+
+
+# a single persistent pool of workers, which serves the batches of all queues
+# workers hold the datasets, they are spawned once & serve all queues during all epochs
+class LoaderService:
+    # datasets: dict of dataset name -> dataset
+    # prefetch: number of batches in flight per queue iterator
+    def __init__(self, datasets, nWorkers, prefetch=2, seed=0):
+        self.datasets = datasets
+        self.prefetch = prefetch
+        self.seed = seed
+        # number of queues created so far, queue index is part of its batches seeds
+        self.nQueues = 0
+        self.pool = Pool(nWorkers, initializer=initWorker, initargs=(datasets,))
+        atexit_register(self.close)
+
+    # returns a queue over dataset name, indices is subset of dataset indices, None means the whole dataset
+    def queue(self, name, batch_size, indices=None, shuffle=True, pin_memory=True):
+        self.nQueues += 1
+        return ServiceQueue(self, self.nQueues - 1, name, batch_size, indices, shuffle, pin_memory)
+
+    # batch augmentations seed, a function of (seed, queue, epoch, batch) only, i.e. reproducible by seed
+    # tuple of ints hash does not depend on process hash randomization
+    def batchSeed(self, queueIdx, epoch, batchIdx):
+        return hash((self.seed, queueIdx, epoch, batchIdx)) % (2 ** 31)
+
+    def submit(self, name, batchIndices, batchSeed):
+        return self.pool.apply_async(loadBatch, ((name, batchIndices, batchSeed),))
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+# DataLoader replacement, iterates over LoaderService batches
+class ServiceQueue:
+    def __init__(self, service, queueIdx, name, batch_size, indices, shuffle, pin_memory):
+        self.service = service
+        self.queueIdx = queueIdx
+        self.name = name
+        self.batch_size = batch_size
+        self.indices = tensor(list(range(len(service.datasets[name]))) if indices is None else indices, dtype=int64)
+        self.shuffle = shuffle
+        self.pin_memory = pin_memory
+        # number of iterations over queue so far
+        self.epoch = 0
+
+    def __len__(self):
+        return int(ceil(len(self.indices) / self.batch_size))
+
+    def __iter__(self):
+        epoch = self.epoch
+        self.epoch += 1
+        indices = self.indices[randperm(len(self.indices))] if self.shuffle else self.indices
+        batches = enumerate(indices.split(self.batch_size))
+
+        def submit(batchIdx, batchIndices):
+            return self.service.submit(self.name, batchIndices.tolist(), self.service.batchSeed(self.queueIdx, epoch, batchIdx))
+
+        # keep prefetch batches in flight, results are yielded in order
+        inFlight = deque()
+        for batchIdx, batchIndices in batches:
+            inFlight.append(submit(batchIdx, batchIndices))
+            if len(inFlight) >= self.service.prefetch:
+                break
+
+        while len(inFlight) > 0:
+            input, target = inFlight.popleft().get()
+            batch = next(batches, None)
+            if batch is not None:
+                inFlight.append(submit(*batch))
+
+            if self.pin_memory:
+                input, target = input.pin_memory(), target.pin_memory()
+
+            yield input, target
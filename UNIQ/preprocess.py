@@ -39,8 +39,13 @@ def scale_random_crop(input_size, scale_size=None, normalize=__imagenet_stats):
     transforms.Compose(t_list)
 
 
+# padding of pad_random_crop(), input is padded to scale_size
+def pad_random_crop_padding(input_size, scale_size):
+    return int((scale_size - input_size) / 2)
+
+
 def pad_random_crop(input_size, scale_size=None, normalize=__imagenet_stats):
-    padding = int((scale_size - input_size) / 2)
+    padding = pad_random_crop_padding(input_size, scale_size)
     return transforms.Compose([
         transforms.RandomCrop(input_size, padding=padding),
         transforms.RandomHorizontalFlip(),
@@ -76,6 +81,8 @@ def inception_color_preproccess(input_size, normalize=__imagenet_stats):
 def get_transform_with_sizes(name='imagenet', input_size=None, scale_size=None, normalize=None, augment=True):
     normalize = normalize or __imagenet_stats
     cropFunc = None
+    # random crop padding, 0 if transform does not pad
+    padding = 0
 
     if name == 'imagenet':
         input_channels = 3
@@ -86,14 +93,15 @@ def get_transform_with_sizes(name='imagenet', input_size=None, scale_size=None,
         else:
             cropFunc = scale_crop(input_size=input_size,
                                   scale_size=scale_size, normalize=normalize)
-    elif 'cifar' in name:
+    elif ('cifar' in name) or (name == 'synthetic'):
         input_channels = 3
         input_size = input_size or 32
         if augment:
-            scale_size = scale_size or 40
+            scale_size = scale_size or (input_size + 8)
             cropFunc = pad_random_crop(input_size, scale_size=scale_size, normalize=normalize)
+            padding = pad_random_crop_padding(input_size, scale_size)
         else:
-            scale_size = scale_size or 32
+            scale_size = scale_size or input_size
             cropFunc = scale_crop(input_size=input_size,
                                   scale_size=scale_size, normalize=normalize)
     elif name == 'mnist':
@@ -104,24 +112,36 @@ def get_transform_with_sizes(name='imagenet', input_size=None, scale_size=None,
             scale_size = scale_size or 32
             cropFunc = pad_random_crop(input_size, scale_size=scale_size,
                                        normalize=normalize)
+            padding = pad_random_crop_padding(input_size, scale_size)
         else:
             scale_size = scale_size or 32
             cropFunc = scale_crop(input_size=input_size,
                                   scale_size=scale_size, normalize=normalize)
 
-    return cropFunc, input_size, input_channels
+    return cropFunc, input_size, input_channels, padding
+
+
+# normalization stats used by get_transform(), for loaders which normalize outside of transforms
+def get_normalize_stats(name='imagenet'):
+    return {'mean': [0.5], 'std': [0.5]} if name == 'mnist' else __imagenet_stats
 
 
 def get_transform(name='imagenet', input_size=None, scale_size=None, normalize=None, augment=True):
-    cropFunc, _, _ = get_transform_with_sizes(name, input_size, scale_size, normalize, augment)
+    cropFunc, _, _, _ = get_transform_with_sizes(name, input_size, scale_size, normalize, augment)
     return cropFunc
 
 
 def get_transform_input_size(name='imagenet', input_size=None, scale_size=None, normalize=None, augment=True):
-    _, input_size, input_channels = get_transform_with_sizes(name, input_size, scale_size, normalize, augment)
+    _, input_size, input_channels, _ = get_transform_with_sizes(name, input_size, scale_size, normalize, augment)
     return input_size, input_channels
 
 
+# random crop padding of get_transform(), for loaders which augment outside of transforms
+def get_transform_padding(name='imagenet', input_size=None, scale_size=None, augment=True):
+    _, _, _, padding = get_transform_with_sizes(name, input_size, scale_size, augment=augment)
+    return padding
+
+
 class Lighting(object):
     """Lighting noise(AlexNet - style PCA - based noise)"""
 
@@ -11,31 +11,47 @@ eps = 1e-5
 
 
 def my_mean(x):
-    size = x.size()
-    size_tensor = torch.Tensor([s for s in size])
-    elements = torch.prod(size_tensor)
-    return torch.sum(x) / elements
+    return torch.sum(x) / x.numel()
 
 
 def my_std(x):
-    size = x.size()
-    size_tensor = torch.Tensor([s for s in size])
-    elements = torch.FloatTensor([torch.prod(size_tensor)])
-    x_min_mean_sq = (x - my_mean(x)) * (x - my_mean(x))
-    std = torch.sqrt(torch.sum(x_min_mean_sq) / (elements - 1))
-    return std[0]
+    x_min_mean = x - my_mean(x)
+    return torch.sqrt(torch.sum(x_min_mean * x_min_mean) / (x.numel() - 1))
 
 
+# mean & std of x in a single pass over x, as 0-dim tensors of x dtype on x device, i.e. without host syncs
+# sums are accumulated in double precision, therefore statistics do not depend on the device (or its reduction order)
+def mean_std(x):
+    n = x.numel()
+    x_sum = torch.sum(x, dtype=torch.float64)
+    x_sq_sum = torch.sum(x * x, dtype=torch.float64)
+    mean = x_sum / n
+    var = (x_sq_sum - x_sum * mean).clamp(min=0.) / max(n - 1, 1)
+    return mean.to(x.dtype), var.sqrt().to(x.dtype)
+
+
+# in-place ops are used when x is not part of the graph, in order to avoid intermediate tensors
 def norm_cdf(x, mean, std):
-    return 1. / 2 * (1. + torch.erf((x - mean) / (std * sqrt_of_2)))
+    if x.requires_grad:
+        return 1. / 2 * (1. + torch.erf((x - mean) / (std * sqrt_of_2)))
+
+    return (x - mean).div_(std * sqrt_of_2).erf_().add_(1.).mul_(1. / 2)
 
 
 def norm_icdf(x, mean, std):
-    return mean + std * sqrt_of_2 * torch.erfinv(2. * x - 1)
+    if x.requires_grad:
+        return mean + std * sqrt_of_2 * torch.erfinv(2. * x - 1)
+
+    return (2. * x).sub_(1).erfinv_().mul_(std * sqrt_of_2).add_(mean)
+
+
+# norm_cdf of a scalar x, mean & std are 0-dim tensors, i.e. result is 0-dim tensor on their device
+def norm_cdf_scalar(x, mean, std):
+    return 1. / 2 * (1. + torch.erf((x - mean) / (std * sqrt_of_2)))
 
 
 def check_quantization(x):
-    unique_vals = torch.sort(torch.unique(x.cpu()))[0]  # TODO remove cpu when possible
+    unique_vals = torch.unique(x, sorted=True)
     return unique_vals.size()[0]
 
 
@@ -46,9 +62,8 @@ def add_noise(modules, training=False, bitwidth=32, noise=True, high_noise=False
                 if m._parameters[p] is not None:
                     d = m._parameters[p].device
 
-                    mean_p = torch.mean(m._parameters[p].data)
-
-                    std_p = max(torch.std(m._parameters[p].data), eps)
+                    mean_p, std_p = mean_std(m._parameters[p].data)
+                    std_p = std_p.clamp(min=eps)
 
                     y_p = norm_cdf(m._parameters[p].data, mean_p, std_p)
 
@@ -67,8 +82,8 @@ def quantize(modules, bitwidth=32):
             for p in m._parameters:
                 if m._parameters[p] is not None:
                     d = m._parameters[p].device
-                    mean_p = torch.mean(m._parameters[p].data)
-                    std_p = max(torch.std(m._parameters[p].data), eps)
+                    mean_p, std_p = mean_std(m._parameters[p].data)
+                    std_p = std_p.clamp(min=eps)
                     y_p = norm_cdf(m._parameters[p].data, mean_p, std_p)
                     m._parameters[p].data = norm_icdf(
                         torch.clamp((torch.round(y_p * 2 ** bitwidth - 0.5) + 0.5) / 2 ** bitwidth,
@@ -84,23 +99,23 @@ class act_quantize(Function):
         if bitwidth > 16:
             return F.relu(x)  # No quantization for high bitwidths
 
-        mean = torch.mean(x.data)
-        std = 3 * torch.std(x.data)
+        mean, std = mean_std(x.data)
+        std = (3 * std).clamp(min=eps)
         cdf = norm_cdf(x.data, mean, std)
-        low_bound = norm_cdf(torch.cuda.FloatTensor([0]), mean, std)[0]
+        low_bound = norm_cdf_scalar(0., mean, std)
         indexes_of_zero = cdf < low_bound
-        cdf[indexes_of_zero] = low_bound  # ReLU
         num_of_bins = 2 ** bitwidth - 1  # one for 0
 
-        mapped_interval = (cdf - low_bound) / (1. - low_bound)
+        # ReLU & map to [0,1]
+        mapped_interval = cdf.sub_(low_bound).clamp_(min=0.).div_(1. - low_bound)
 
-        quantized_values = (torch.round(mapped_interval * num_of_bins - 0.5) + 0.5) / num_of_bins
-        back_mapped = quantized_values * (1. - low_bound) + low_bound
-        back_mapped[indexes_of_zero] = low_bound  # ReLU
-        clipped_values = torch.clamp(back_mapped, 1. / 2 ** (bitwidth + 1), 1. - 1. / 2 ** (bitwidth + 1))
+        quantized_values = mapped_interval.mul_(num_of_bins).sub_(0.5).round_().add_(0.5).div_(num_of_bins)
+        back_mapped = quantized_values.mul_(1. - low_bound).add_(low_bound)
+        back_mapped.masked_fill_(indexes_of_zero, low_bound)  # ReLU
+        clipped_values = back_mapped.clamp_(1. / 2 ** (bitwidth + 1), 1. - 1. / 2 ** (bitwidth + 1))
         norm = norm_icdf(clipped_values, mean, std)
 
-        return norm.to(x.device)
+        return norm
 
     @staticmethod
     def backward(ctx, grad_output):
@@ -110,25 +125,86 @@ class act_quantize(Function):
         return grad_input, None
 
 
+# act_quantize() output is piecewise constant for fixed (mean, std, bitwidth)
+# therefore it can be computed by a lookup table: 2^b - 1 decision thresholds and 2^b reconstruction levels
+# the tables are computed once per statistics, in double precision on statistics device, instead of erf & erfinv per element
+def act_quantize_tables(mean, std, bitwidth):
+    mean, std = mean.double(), std.double()
+    num_of_bins = 2 ** bitwidth - 1  # one for 0
+    low_bound = norm_cdf_scalar(0., mean, std)
+    k = torch.arange(num_of_bins, dtype=torch.float64, device=mean.device)
+    # thresholds, x >= thresholds[k] is mapped to level k + 1
+    # the first threshold is the ReLU, i.e. cdf(x) < low_bound iff x < 0
+    thresholds = norm_icdf((k[1:] / num_of_bins) * (1. - low_bound) + low_bound, mean, std)
+    thresholds = torch.cat([thresholds.new_zeros(1), thresholds])
+    # levels, the first level is the ReLU level
+    levels_cdf = torch.cat([low_bound.view(1), ((k + 0.5) / num_of_bins) * (1. - low_bound) + low_bound])
+    levels = norm_icdf(levels_cdf.clamp_(1. / 2 ** (bitwidth + 1), 1. - 1. / 2 ** (bitwidth + 1)), mean, std)
+
+    return thresholds, levels
+
+
+# returns for each element of x the number of thresholds which are <= x, thresholds are sorted
+def bucket_index(x, thresholds):
+    if hasattr(torch, 'bucketize'):
+        return torch.bucketize(x, thresholds, right=True)
+
+    # vectorized binary search, log2(len(thresholds) + 1) passes over x
+    n_buckets = 1
+    while n_buckets <= thresholds.numel():
+        n_buckets *= 2
+    # pad thresholds to (power of 2) - 1 elements
+    thresholds = torch.cat([thresholds, thresholds.new_full((n_buckets - 1 - thresholds.numel(),), float('inf'))])
+    idx = torch.zeros_like(x, dtype=torch.long)
+    step = n_buckets // 2
+    while step > 0:
+        candidate = idx + step
+        idx = torch.where(thresholds.take(candidate - 1) <= x, candidate, idx)
+        step //= 2
+
+    return idx
+
+
+# act_quantize() tables of activations range (mean, std), in x dtype
+def act_quantize_range_tables(mean, std, bitwidth, dtype):
+    thresholds, levels = act_quantize_tables(mean, (3 * std).clamp(min=eps), bitwidth)
+    return thresholds.to(dtype), levels.to(dtype)
+
+
+# quantizes x by given act_quantize_range_tables() tables, i.e. tables are built by caller once per range
+class act_quantize_lut(Function):
+    @staticmethod
+    def forward(ctx, x, thresholds, levels):
+        ctx.save_for_backward(x)
+        return levels.take(bucket_index(x.data, thresholds))
+
+    @staticmethod
+    def backward(ctx, grad_output):
+        input, = ctx.saved_tensors
+        grad_input = grad_output.clone()
+        grad_input[input < 0] = 0
+        return grad_input, None, None
+
+
 class act_noise(Function):
     @staticmethod
     def forward(ctx, x, training=False, bitwidth=32, noise=True, high_noise=False):
         ctx.save_for_backward(x)
-        act_mean = torch.mean(x.data)
-        act_std = max(torch.std(x.data), eps)
+        act_mean, act_std = mean_std(x.data)
+        act_std = act_std.clamp(min=eps)
         act_cdf = norm_cdf(x.data, act_mean, act_std)
 
-        low_bound = norm_cdf(torch.cuda.FloatTensor([0]), act_mean, act_std)[0]
+        low_bound = norm_cdf_scalar(0., act_mean, act_std)
         indexes_of_zero = act_cdf < low_bound
-        act_cdf[indexes_of_zero] = low_bound  # ReLU
+        act_cdf.sub_(low_bound).clamp_(min=0.).add_(low_bound)  # ReLU
         num_of_bins = 2 ** bitwidth - 1  # one for 0
 
         noise_step = (1. - low_bound) / (2 * num_of_bins) if not high_noise else (1. - low_bound) / num_of_bins
-        noise = act_cdf.clone().uniform_(-noise_step, noise_step)
-        noise[indexes_of_zero] = 0.
-        clipped_values = torch.clamp(act_cdf + noise, 1. / 2 ** (bitwidth + 1), 1. - 1. / 2 ** (bitwidth + 1))
+        noise = torch.empty_like(act_cdf).uniform_(-1., 1.).mul_(noise_step)
+        noise.masked_fill_(indexes_of_zero, 0.)
+        clipped_values = act_cdf.add_(noise).clamp_(1. / 2 ** (bitwidth + 1), 1. - 1. / 2 ** (bitwidth + 1))
         res = norm_icdf(clipped_values, act_mean, act_std)
-        return res.to(x.device)
+        return res
 
     @staticmethod
     def backward(ctx, grad_output):
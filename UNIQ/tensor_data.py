@@ -0,0 +1,116 @@
+from math import ceil
+from os.path import join
+
+from numpy import asarray, load
+from torch import from_numpy, tensor, arange, randperm, randint, zeros, full, uint8, int64, float32
+
+
+# whole dataset split as a single uint8 tensor of [N, C, H, W] and its targets
+class UInt8ImageDataset:
+    def __init__(self, data, targets):
+        assert (data.dtype == uint8)
+        assert (data.size(0) == targets.size(0))
+        self.data = data
+        self.targets = targets
+
+    # build from torchvision CIFAR dataset, data is a numpy array of [N, H, W, C]
+    @staticmethod
+    def fromCIFAR(dataset):
+        # torchvision renamed train_data/test_data & train_labels/test_labels to data & targets
+        data = getattr(dataset, 'data', None)
+        if data is None:
+            data = dataset.train_data if dataset.train else dataset.test_data
+        targets = getattr(dataset, 'targets', None)
+        if targets is None:
+            targets = dataset.train_labels if dataset.train else dataset.test_labels
+
+        data = from_numpy(asarray(data)).permute(0, 3, 1, 2).contiguous()
+        return UInt8ImageDataset(data, tensor(targets, dtype=int64))
+
+    def __len__(self):
+        return self.data.size(0)
+
+
+# UInt8ImageDataset over a cache built by UNIQ/imagenet_cache.py
+# images are memory-mapped, i.e. batches are read from the cache pages, images are never decoded again
+class MemmapImageDataset(UInt8ImageDataset):
+    def __init__(self, root, split):
+        imagesPath, labelsPath, _ = cachePaths(root, split)
+        # copy-on-write mapping, tensors require writable memory, cache file is never modified
+        images = load(imagesPath, mmap_mode='c')
+        labels = load(labelsPath)
+        # images are stored as [N, H, W, C]
+        super(MemmapImageDataset, self).__init__(from_numpy(images).permute(0, 3, 1, 2), from_numpy(labels))
+
+
+# cache files paths of dataset split
+def cachePaths(root, split):
+    return join(root, '{}_images.npy'.format(split)), join(root, '{}_labels.npy'.format(split)), join(root, '{}_classes.json'.format(split))
+
+
+# loads batches of UInt8ImageDataset, augmentation & normalization are applied on the whole batch
+# crop (after zero padding) & horizontal flip are a single gather, like transforms RandomCrop(padding) + RandomHorizontalFlip
+# crop_size is the output size, None keeps the input size. random_crop=False takes center crop
+class TensorDataLoader:
+    def __init__(self, dataset, batch_size, mean, std, indices=None, shuffle=False, padding=0, flip=False, crop_size=None, random_crop=True,
+                 pin_memory=False):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.indices = arange(len(dataset), dtype=int64) if indices is None else tensor(indices, dtype=int64)
+        self.shuffle = shuffle
+        self.padding = padding
+        self.flip = flip
+        self.crop_size = crop_size
+        self.random_crop = random_crop
+        self.pin_memory = pin_memory
+        # (x / 255 - mean) / std == x * scale - shift
+        std = tensor(std, dtype=float32)
+        self.scale = (1.0 / (255.0 * std)).view(1, -1, 1, 1)
+        self.shift = (tensor(mean, dtype=float32) / std).view(1, -1, 1, 1)
+
+    def __len__(self):
+        return int(ceil(len(self.indices) / self.batch_size))
+
+    # crop & flip as a single gather
+    def augment(self, x):
+        B, C, H, W = x.size()
+        p = self.padding
+        if p > 0:
+            padded = zeros(B, C, H + (2 * p), W + (2 * p), dtype=uint8)
+            padded[:, :, p:p + H, p:p + W] = x
+            x = padded
+
+        outH, outW = (H, W) if self.crop_size is None else (self.crop_size, self.crop_size)
+        maxRow, maxCol = x.size(2) - outH, x.size(3) - outW
+        if self.random_crop:
+            rowsOffset = randint(maxRow + 1, (B,), dtype=int64)
+            colsOffset = randint(maxCol + 1, (B,), dtype=int64)
+        else:
+            rowsOffset = full((B,), maxRow // 2, dtype=int64)
+            colsOffset = full((B,), maxCol // 2, dtype=int64)
+
+        rows = rowsOffset.view(-1, 1) + arange(outH, dtype=int64).view(1, -1)
+        cols = arange(outW, dtype=int64).view(1, -1).expand(B, outW)
+        if self.flip:
+            # flipped column is (outW - 1 - col)
+            flipped = randint(2, (B, 1), dtype=int64)
+            cols = cols + flipped * ((outW - 1) - (2 * cols))
+        cols = colsOffset.view(-1, 1) + cols
+
+        batchIdx = arange(B, dtype=int64).view(-1, 1, 1, 1)
+        channelIdx = arange(C, dtype=int64).view(1, -1, 1, 1)
+        return x[batchIdx, channelIdx, rows.view(B, 1, outH, 1), cols.view(B, 1, 1, outW)]
+
+    def __iter__(self):
+        indices = self.indices[randperm(len(self.indices))] if self.shuffle else self.indices
+        for batchIndices in indices.split(self.batch_size):
+            input = self.dataset.data.index_select(0, batchIndices)
+            if (self.padding > 0) or self.flip or (self.crop_size is not None):
+                input = self.augment(input)
+            input = input.type(float32).mul_(self.scale).sub_(self.shift)
+            target = self.dataset.targets.index_select(0, batchIndices)
+
+            if self.pin_memory:
+                input, target = input.pin_memory(), target.pin_memory()
+
+            yield input, target
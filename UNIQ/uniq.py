@@ -1,6 +1,6 @@
 import torch.nn as nn
 from UNIQ.quantize import backup_weights, quantize, add_noise, restore_weights, check_quantization
-from UNIQ.actquant import ActQuant
+from UNIQ.actquant import ActQuant, set_act_lut
 
 
 def save_state(self, _):
@@ -42,7 +42,7 @@ def restore_state(self, _, __):
 
 class UNIQNet(nn.Module):
     def __init__(self, quant=False, noise=False, bitwidth=[], quant_edges=True, act_noise=True, step_setup=[15, 9],
-                 act_bitwidth=[], act_quant=False):
+                 act_bitwidth=[], act_quant=False, act_lut=False):
         super(UNIQNet, self).__init__()
         self.quant = quant
         self.noise = noise
@@ -57,6 +57,8 @@ class UNIQNet(nn.Module):
 
         self.act_noise = act_noise
         self.act_quant = act_quant
+        # activations quantization by lookup tables, set on ActQuant modules in prepare_uniq()
+        self.act_lut = act_lut
         assert (isinstance(act_bitwidth, list))
         self.act_bitwidth = act_bitwidth
         self.quant_edges = quant and quant_edges
@@ -154,6 +156,7 @@ class UNIQNet(nn.Module):
         """
         # collect layers
         self.layers_list = self.get_layers_list()
+        set_act_lut(self, self.act_lut)
 
         # set full precision to all layers
         for layer in self.layers_list:
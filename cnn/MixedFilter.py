@@ -18,7 +18,7 @@ class QuantizedOp(UNIQNet):
         self.modulesIdxDict = modulesIdxDict
 
     def initModules(self, op):
-        self.op = op.cuda()
+        self.op = op
         # self.useResidual = useResidual
         # self.forward = self.residualForward if useResidual else self.standardForward
         # self.hookHandlers = []
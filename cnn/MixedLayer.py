@@ -69,9 +69,8 @@ class MixedLayer(Block):
         assert (isinstance(self.filters[0], MixedFilter))
 
         # init operations alphas (weights)
-        self.alphas = tensor((zeros(self.numOfOps())).cuda(), requires_grad=True)
+        self.alphas = tensor(zeros(self.numOfOps()), requires_grad=True)
         # self.alphas = tensor(getAlphas(), requires_grad=True)
-        self.alphas = self.alphas.cuda()
 
         # =========== change alphas distribution ==================
         if self.numOfOps() > 1:
@@ -93,7 +92,12 @@ class MixedLayer(Block):
         #     self.setFiltersPartition()
 
         # set forward function
+        self.useResidual = useResidual
         self.forwardFunc = self.residualForward if useResidual else self.standardForward
+        # relaxed filters ops weights, tensor of [nFilters, nOps], None means discrete forward
+        self.relaxedWeights = None
+        # op index of frozen layer, i.e. layer we stopped optimizing its alphas and its partition is pinned
+        self.frozenOpIdx = None
 
         # # register post forward hook
         # self.register_forward_hook(postForward)
@@ -103,6 +107,12 @@ class MixedLayer(Block):
         self.quantized = False
         self.added_noise = False
 
+    # alphas are not a module parameter, move them with the layer, i.e. on cuda(), cpu(), to()
+    def _apply(self, fn):
+        super(MixedLayer, self)._apply(fn)
+        self.alphas.data = fn(self.alphas.data)
+        return self
+
     def nFilters(self):
         return len(self.filters)
 
@@ -198,11 +208,18 @@ class MixedLayer(Block):
         probs = F.softmax(self.alphas, dim=-1)
         self.__setFiltersPartitionFromRatio(probs)
 
+    # layer partition is deterministic when alphas distribution is a single op, e.g. after we stopped optimizing layer alphas
+    def isDeterministic(self):
+        return (self.numOfOps() == 1) or (F.softmax(self.alphas.detach(), dim=-1).max().item() == 1.0)
+
     def getCurrentFiltersPartition(self):
         return self.currFiltersPartition
 
     # input_bitwidth is a list of bitwidth per feature map
     def getBops(self, input_bitwidth):
+        if self.relaxedWeights is not None:
+            return self.getRelaxedBops(input_bitwidth)
+
         bops = 0.0
         # init bops map
         bopsMap = {}
@@ -247,11 +264,82 @@ class MixedLayer(Block):
         return self
 
     # select alpha based on alphas distribution
+    # stop optimizing layer alphas, all filters are pinned to op opIdx
+    def freezeAlphas(self, opIdx):
+        self.alphas.grad = None
+        self.alphas.requires_grad = False
+        # set optimal alpha probability to 1 and the rest to zero
+        self.alphas.data.fill_(0.0)
+        self.alphas.data[opIdx] = 1000.0
+        self.frozenOpIdx = opIdx
+        # pin partition
+        partition = zeros(self.numOfOps(), dtype=int32)
+        partition[opIdx] = self.nFilters()
+        self.setFiltersPartition(partition)
+
     def choosePathByAlphas(self):
+        # frozen layer partition is pinned
+        if self.frozenOpIdx is not None:
+            return
+
         dist = Multinomial(total_count=self.nFilters(), logits=self.alphas)
         partition = dist.sample().type(int32)
         self.setFiltersPartition(partition)
 
+    # set filters relaxed ops weights, weights is a tensor of [nFilters, nOps], None turns relaxation off
+    # filters curr_alpha_idx is the op with max weight, i.e. the discrete path we use for next layers input bitwidth
+    def setRelaxedWeights(self, weights):
+        self.relaxedWeights = weights
+        if weights is not None:
+            self.currFiltersPartition = [0] * self.numOfOps()
+            for f, opIdx in zip(self.filters, weights.detach().argmax(dim=1).tolist()):
+                f.curr_alpha_idx = opIdx
+                self.currFiltersPartition[opIdx] += 1
+
+    # expected bops over filters relaxed ops weights, differentiable w.r.t. weights
+    # input_bitwidth is the discrete input bitwidth, i.e. previous layer path by max weights
+    def getRelaxedBops(self, input_bitwidth):
+        # all layer filters have the same ops, therefore the same bops per op
+        filter = self.filters[0]
+        currAlphaIdx = filter.curr_alpha_idx
+        bopsMap = {}
+        opsBops = []
+        for opIdx in range(self.numOfOps()):
+            filter.curr_alpha_idx = opIdx
+            opsBops.append(filter.getBops(input_bitwidth, bopsMap))
+        filter.curr_alpha_idx = currAlphaIdx
+
+        opsBops = tensor(opsBops, device=self.relaxedWeights.device)
+        return (self.relaxedWeights * opsBops.unsqueeze(0)).sum()
+
+    # forward all ops of all filters, layer output is each filter ops outputs weighted by its relaxed weights
+    def relaxedForward(self, input):
+        x, residual = input if self.useResidual else (input, None)
+        currAlphaIdx = [f.curr_alpha_idx for f in self.filters]
+
+        out = 0
+        for opIdx in range(self.numOfOps()):
+            for f in self.filters:
+                f.curr_alpha_idx = opIdx
+            opOut = self.preResidualForward(x)
+            if residual is not None:
+                opOut = opOut + residual
+            opOut = self.postResidualForward(opOut)
+            out = out + (opOut * self.relaxedWeights[:, opIdx].view(1, -1, 1, 1))
+
+        for f, opIdx in zip(self.filters, currAlphaIdx):
+            f.curr_alpha_idx = opIdx
+
+        return out
+
+    # choose path by filters uniform samples, i.e. inverse CDF of alphas distribution per filter
+    # u is a tensor of nFilters uniform samples in [0, 1)
+    def choosePathByUniform(self, u):
+        cdf = F.softmax(self.alphas.detach(), dim=-1).cumsum(dim=0).cpu()
+        opIdx = (u.unsqueeze(1) > cdf.unsqueeze(0)).sum(dim=1).clamp(max=self.numOfOps() - 1)
+        partition = opIdx.bincount(minlength=self.numOfOps()).type(int32)
+        self.setFiltersPartition(partition)
+
     @abstractmethod
     def preResidualForward(self, x):
         raise NotImplementedError('subclasses must override preResidualForward()!')
@@ -274,6 +362,9 @@ class MixedLayer(Block):
         return out
 
     def forward(self, x):
+        if self.relaxedWeights is not None:
+            return self.relaxedForward(x)
+
         return self.forwardFunc(self, x)
 
     # standard forward
@@ -25,8 +25,14 @@ class Architect(object):
         #                      weight_decay=args.arch_weight_decay)
 
     def step(self, model, input_valid, target_valid):
+        # stop optimizing converged layers alphas
+        self.modelReplicator.updateLayersAlphaOptimization(model)
         # collect architecture parameters
         arch_parameters = model.arch_parameters()
+        # all layers alphas have converged, calc loss only
+        if len(arch_parameters) == 0:
+            return self.modelReplicator.loss(model, input_valid, target_valid)
+
         # init optimizer
         optimizer = SGD(arch_parameters, lr=self.lr, momentum=self.network_momentum)
         # update learning rate
@@ -43,6 +49,32 @@ class Architect(object):
 
         return loss
 
+    # pipelined step is split to submit() -> collect() -> update()
+    # submit() sends step to replications, collect() waits for replications and sets alphas gradient, update() applies the gradient
+    # next step is submitted between collect() and update(), therefore its samples are drawn from one alphas version before
+    def submit(self, model, input_valid, target_valid):
+        self.modelReplicator.submitStep(model, input_valid, target_valid)
+
+    def collect(self, model):
+        return self.modelReplicator.collectStep(model)
+
+    def update(self, model):
+        # stop optimizing converged layers alphas
+        self.modelReplicator.updateLayersAlphaOptimization(model)
+        # collect architecture parameters
+        arch_parameters = model.arch_parameters()
+        if len(arch_parameters) == 0:
+            return
+
+        # init optimizer
+        optimizer = SGD(arch_parameters, lr=self.lr, momentum=self.network_momentum)
+        # update learning rate
+        self.lr *= 0.999
+        # clip grad norm
+        clip_grad_norm_(arch_parameters, 10.0)
+        # perform optimizer step
+        optimizer.step()
+
     # def step(self, input_train, target_train, input_valid, target_valid, eta, network_optimizer, unrolled):
     #     arch_parameters = self.model.arch_parameters()
     #     # init optimizer for current arch_parameters
@@ -0,0 +1,210 @@
+from torch import no_grad, cat, zeros, randperm
+from torch.nn import Conv2d, BatchNorm2d
+from torch.nn import functional as F
+
+from NICE.actquant import ActQuantBuffers
+
+
+# streaming per-channel moments, merged batch by batch (Welford / Chan parallel update)
+class RunningMoments:
+    def __init__(self, nChannels, device):
+        self.count = 0
+        self.mean = zeros(nChannels, device=device)
+        self.M2 = zeros(nChannels, device=device)
+
+    # x is a tensor of shape [nChannels, nElements]
+    def update(self, x):
+        n = x.size(1)
+        batchMean = x.mean(dim=1)
+        batchM2 = ((x - batchMean.unsqueeze(1)) ** 2).sum(dim=1)
+
+        total = self.count + n
+        delta = batchMean - self.mean
+        self.mean += delta * (n / total)
+        self.M2 += batchM2 + (delta ** 2) * (self.count * n / total)
+        self.count = total
+
+    def std(self):
+        return (self.M2 / max(self.count - 1, 1)).sqrt()
+
+
+# calibrates ActQuantBuffers statistics (running_mean, running_std, clamp_val) of all ops of all filters in a single pass
+# the forward pass follows model current filters partition, while each layer input is applied on all layer ops
+# filters have a single ops copy (MixedFilter has no previous layer), i.e. calibrated ops are all filters ops
+class ActStatisticsCalibration:
+    def __init__(self, model):
+        self.model = model
+        # layers that have activation quantization
+        self.layers = [layer for layer in model.layersList if next(layer.opsList()).getModule(ActQuantBuffers) is not None]
+        # ops copies of other previous layer ops would have been left uncalibrated
+        assert (all(f.nOpsCopies() == 1 for layer in self.layers for f in layer.filters))
+        # init moments per (layer, op index)
+        self.moments = {}
+        # ratio of elements we sample from each feature map, in order to save time
+        self.ratio = 1.0
+
+    # returns the list of ops of op index opIdx, one op per filter
+    @staticmethod
+    def layerOps(layer, opIdx):
+        return [f.ops[f.prev_alpha_idx][opIdx] for f in layer.filters]
+
+    # apply op index opIdx on all layer filters at once, i.e. the input to the op ActQuantBuffers
+    @staticmethod
+    def opPreActivation(layer, opIdx, x, residual):
+        ops = ActStatisticsCalibration.layerOps(layer, opIdx)
+        convs = [op.getModule(Conv2d) for op in ops]
+        conv = convs[0]
+        # filters convs are concatenated to a single conv, they have to share their geometry
+        assert (all((c.stride, c.padding, c.dilation) == (conv.stride, conv.padding, conv.dilation) for c in convs))
+        if all(c.groups == 1 for c in convs):
+            weight = cat([c.weight for c in convs], dim=0)
+            bias = cat([c.bias for c in convs]) if conv.bias is not None else None
+            out = F.conv2d(x, weight, bias, conv.stride, conv.padding, conv.dilation)
+        else:
+            # grouped convs channels do not map to a concatenated conv groups, apply filters one by one
+            out = cat([F.conv2d(x, c.weight, c.bias, c.stride, c.padding, c.dilation, c.groups) for c in convs], dim=1)
+
+        bnModules = [op.getModule(BatchNorm2d) for op in ops]
+        if bnModules[0] is not None:
+            out = F.batch_norm(out, cat([bn.running_mean for bn in bnModules]), cat([bn.running_var for bn in bnModules]),
+                               cat([bn.weight for bn in bnModules]), cat([bn.bias for bn in bnModules]), False, 0.0, bnModules[0].eps)
+
+        # layer BN, in case of MixedLayerWithBN
+        bn = getattr(layer, 'bn', None)
+        if bn is not None:
+            out = bn(out)
+
+        if residual is not None:
+            out = out + residual
+
+        return out
+
+    def __collect(self, layer, input):
+        input = input[0]
+        x, residual = input if isinstance(input, tuple) else (input, None)
+
+        for opIdx in range(layer.numOfOps()):
+            out = self.opPreActivation(layer, opIdx, x, residual)
+            # reshape to [nChannels, nElements]
+            out = out.transpose(0, 1).contiguous().view(out.size(1), -1)
+            # subsample elements
+            if self.ratio < 1.0:
+                nElements = max(int(out.size(1) * self.ratio), 2)
+                out = out.index_select(1, randperm(out.size(1), device=out.device)[:nElements])
+
+            key = (layer, opIdx)
+            if key not in self.moments:
+                self.moments[key] = RunningMoments(out.size(0), out.device)
+            self.moments[key].update(out)
+
+    # copies merged moments to ops buffers on device, without per filter host syncs
+    def __writeBack(self):
+        for (layer, opIdx), moments in self.moments.items():
+            ops = self.layerOps(layer, opIdx)
+            std = moments.std()
+            # clamp_val like quantize.get_act_max_value_from_pre_calc_stats(), computed for all filters at once
+            clampVal = moments.mean + ops[0].quantize.std_act_clamp * std
+            for filterIdx, op in enumerate(ops):
+                actQuant = op.getModule(ActQuantBuffers)
+                actQuant.running_mean.copy_(moments.mean[filterIdx:filterIdx + 1])
+                actQuant.running_std.copy_(std[filterIdx:filterIdx + 1])
+                actQuant.clamp_val.copy_(clampVal[filterIdx:filterIdx + 1])
+
+    # nBatches: max number of batches to use from statistics_queue, None means the whole queue
+    # ratio: ratio of feature maps elements to accumulate moments from, i.e. subsampled mode
+    def calibrate(self, statistics_queue, nBatches=None, ratio=1.0, loggerFuncs=[]):
+        model = self.model
+        self.moments = {}
+        self.ratio = ratio
+
+        # register hooks for collecting statistics
+        handlers = [layer.register_forward_hook(lambda m, input, _: self.__collect(m, input)) for layer in self.layers]
+
+        # collect statistics on full precision activations (ReLU), like the former statisticsForward()
+        actQuantList = [m for m in model.modules() if isinstance(m, ActQuantBuffers)]
+        actQuantState = [m.quant for m in actQuantList]
+        for m in actQuantList:
+            m.quant = False
+
+        training = model.training
+        model.eval()
+        device = self.layers[0].alphas.device
+        nSamples = 0
+        with no_grad():
+            for step, (input, _) in enumerate(statistics_queue):
+                if (nBatches is not None) and (step >= nBatches):
+                    break
+
+                model(input.to(device))
+                nSamples += input.size(0)
+
+        for handler in handlers:
+            handler.remove()
+        model.train(training)
+        for m, quant in zip(actQuantList, actQuantState):
+            m.quant = quant
+
+        self.__writeBack()
+
+        logMsg = 'Calibrated activations statistics of [{}] layers on [{}] samples, elements ratio:[{}]'.format(len(self.layers), nSamples, ratio)
+        for f in loggerFuncs:
+            f(logMsg)
+
+
+# BN modules used by model current partition, i.e. BN of selected op of each filter & layer BN (MixedLayerWithBN)
+def partitionBatchNorms(model):
+    bnModules = []
+    for layer in model.layersList:
+        for f in layer.filters:
+            bn = f.ops[f.prev_alpha_idx][f.curr_alpha_idx].getModule(BatchNorm2d)
+            if bn is not None:
+                bnModules.append(bn)
+
+        bn = getattr(layer, 'bn', None)
+        if bn is not None:
+            bnModules.append(bn)
+
+    return bnModules
+
+
+# resets & re-estimates BN running statistics of partition selected ops, by nBatches forward passes over data_queue
+# running statistics are cumulative average (momentum=None) over the batches, the rest of model is in eval mode
+# partition is a list of IntTensor (or lists) per layer, if None we use model current partition
+# statistics are estimated on quantized model, i.e. unstaged layers are quantized during recalibration & restored afterwards
+def recalibrate_bn(model, partition, data_queue, n_batches, loggerFuncs=[]):
+    if partition is not None:
+        assert (len(partition) == model.nLayers())
+        model.setFiltersByPartition(model.partitionTensors(partition))
+
+    model.quantizeUnstagedLayers()
+
+    bnModules = partitionBatchNorms(model)
+    bnMomentum = [bn.momentum for bn in bnModules]
+    for bn in bnModules:
+        bn.reset_running_stats()
+        bn.momentum = None
+
+    training = model.training
+    model.eval()
+    # only selected BN modules accumulate statistics
+    for bn in bnModules:
+        bn.train()
+
+    device = model.layersList[0].alphas.device
+    nSamples = 0
+    with no_grad():
+        for step, (input, _) in enumerate(data_queue):
+            if step >= n_batches:
+                break
+
+            model(input.to(device))
+            nSamples += input.size(0)
+
+    for bn, momentum in zip(bnModules, bnMomentum):
+        bn.momentum = momentum
+    model.train(training)
+    model.unQuantizeUnstagedLayers()
+
+    logMsg = 'Recalibrated BN statistics of [{}] modules on [{}] samples'.format(len(bnModules), nSamples)
+    for f in loggerFuncs:
+        f(logMsg)
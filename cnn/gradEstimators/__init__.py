@@ -1,3 +1,9 @@
 from .random_path import RandomPath as random_path
 from .layer_same_path import LayerSamePath as layer_same_path
 from .triple_alphas import TripleAlphas as triple_alphas
+from .distributed_same_path import DistributedSamePath as distributed_same_path
+from .adaptive_same_path import AdaptiveSamePath as adaptive_same_path
+from .layer_same_path_ema import LayerSamePathEMA as layer_same_path_ema
+from .layer_same_path_loo import LayerSamePathLOO as layer_same_path_loo
+from .layer_same_path_antithetic import LayerSamePathAntithetic as layer_same_path_antithetic
+from .gumbel_softmax import GumbelSoftmax as gumbel_softmax
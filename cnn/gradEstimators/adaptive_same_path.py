@@ -0,0 +1,84 @@
+from math import sqrt
+
+from torch import tensor, cat
+from torch.nn import functional as F
+
+from .layer_same_path import LayerSamePath
+
+
+# LayerSamePath with adaptive number of samples per step
+# samples paths in small chunks of args.adaptive_chunk, until alphas gradient relative standard error is below target or samples budget is over
+class AdaptiveSamePath(LayerSamePath):
+    # number of chunks is known only after each chunk results
+    supportsPipeline = False
+
+    def __init__(self, model, modelClass, args, logger):
+        super(AdaptiveSamePath, self).__init__(model, modelClass, args, logger)
+
+        self.targetRSE = args.adaptive_rse
+        # chunk has to have at least 2 samples, in order to estimate variance
+        self.chunkSize = max(args.adaptive_chunk, 2)
+        self.argsMaxSamples = args.max_samples
+        self.setNSamples(self.nSamples)
+        # plot number of samples per step
+        stats = model.stats
+        if stats.samplesCountKey not in stats.plotAllLayersKeys:
+            stats.plotAllLayersKeys.append(stats.samplesCountKey)
+
+        self.logger.addRowToInfoTableByTitle(self.title, ['Adaptive samples', 'chunk:[{}] max samples:[{}] target relative SE:[{}]'
+                                              .format(self.chunkSize, self.maxSamples, self.targetRSE)])
+
+    # samples budget is derived from nSamples
+    def setNSamples(self, nSamples):
+        super(AdaptiveSamePath, self).setNSamples(nSamples)
+        # max number of samples per step, 0 means 4 * nSamples. budget is at least a single chunk
+        maxSamples = self.argsMaxSamples if self.argsMaxSamples > 0 else (4 * self.nSamples)
+        self.maxSamples = max(maxSamples, self.chunkSize)
+
+    # relative standard error of alphas gradient estimator, i.e. ||SE(grad)|| / ||grad||
+    # sample gradient is l_s * (p_s - nFilters * probs), its mean is LayerSamePath gradient
+    @staticmethod
+    def relativeStdError(model, samplesData):
+        losses = tensor([l for l, _, _, _ in samplesData]).unsqueeze(1)
+        samplesGrad = []
+        for layerIdx, layer in enumerate(model.layersList):
+            if layer.alphas.requires_grad is False:
+                continue
+
+            probs = F.softmax(layer.alphas.detach(), dim=-1).cpu().unsqueeze(0)
+            partitions = tensor([p[layerIdx] for _, _, _, p in samplesData]).type(probs.type())
+            samplesGrad.append(losses * (partitions - layer.nFilters() * probs))
+
+        # no alphas to optimize
+        if len(samplesGrad) == 0:
+            return 0.0
+
+        samplesGrad = cat(samplesGrad, dim=1)
+        gradNorm = samplesGrad.mean(dim=0).norm().item()
+        stdError = sqrt(samplesGrad.var(dim=0).sum().item() / samplesGrad.size(0))
+
+        return (stdError / gradNorm) if gradNorm > 0 else float('inf')
+
+    def loss(self, model, input, target):
+        samplesData, counters = [], []
+        while True:
+            nSamples = min(self.chunkSize, self.maxSamples - len(samplesData))
+            results, chunkCounters = self.runReplications(model, input, target, nSamples)
+            for partialSamplesData in results:
+                samplesData.extend(partialSamplesData)
+            counters.extend(chunkCounters)
+
+            if (len(samplesData) >= self.maxSamples) or (self.relativeStdError(model, samplesData) <= self.targetRSE):
+                break
+
+        res = self.processResults(model, [samplesData])
+
+        # reset model layers forward counters
+        model.resetForwardCounters()
+        # sum forward counters
+        self.addForwardCounters(model, counters)
+        # add number of samples to statistics
+        stats = model.stats
+        stats.containers[stats.samplesCountKey][0].append(len(samplesData))
+
+        return res
@@ -0,0 +1,199 @@
+from atexit import register as atexit_register
+
+from torch import tensor, zeros, cat, float64, int64, device
+from torch.distributed import init_process_group, is_initialized, get_rank, get_world_size, broadcast, all_reduce
+
+from .layer_same_path import LayerSamePath
+from cnn.model_replicator import ModelReplicator, SharedWeights
+
+
+# LayerSamePath over torch.distributed (gloo), ranks can be processes on the same host or on different hosts
+# every rank draws its share of nSamples paths on the same batch, using its local replications
+# ranks all-reduce the samples losses sums LayerSamePath gradient needs, rank 0 applies alphas update
+# rank 0 runs the training regime, the other ranks serve its steps
+class DistributedSamePath(LayerSamePath):
+    stepCmd, stopCmd = 0, 1
+    # ranks step is driven by loss()
+    supportsPipeline = False
+    # samples are split between ranks at init
+    supportsSetNSamples = False
+    # header: [cmd, sendWeights, baseSeed, nDims, dims...]
+    headerSize = 8
+
+    def __init__(self, model, modelClass, args, logger):
+        if not is_initialized():
+            init_process_group('gloo', init_method=args.dist_url, world_size=args.world_size, rank=args.rank)
+
+        self.rank = get_rank()
+        self.worldSize = get_world_size()
+        # split samples between ranks, each rank uses its share as local nSamples
+        self.totalSamples = args.nSamples
+        nSamplesPerRank = self.splitSamples(self.totalSamples, self.worldSize)
+        assert (min(nSamplesPerRank) > 0)
+        self.samplesOffset = sum(nSamplesPerRank[:self.rank])
+        args.nSamples = nSamplesPerRank[self.rank]
+
+        super(DistributedSamePath, self).__init__(model, modelClass, args, logger)
+        args.nSamples = self.totalSamples
+
+        # weights are broadcasted from CPU flat buffers with the same layout on all ranks
+        self.broadcastWeights = SharedWeights(model.state_dict(), device('cpu'))
+        # rank 0 sends weights in next step if weights have been updated
+        self.weightsUpdated = False
+        # local samples seeds of current step
+        self.stepSeeds = None
+
+        self.logger.addRowToInfoTableByTitle(self.title, ['Distributed', 'rank:[{}] world size:[{}] local samples:[{}]'
+                                              .format(self.rank, self.worldSize, self.nSamples)])
+        # release serving ranks when rank 0 is done
+        if self.rank == 0:
+            atexit_register(self.stopRanks)
+
+    # replicator is sent to local workers, without its broadcast buffers
+    def __getstate__(self):
+        state = super(DistributedSamePath, self).__getstate__()
+        state.pop('broadcastWeights', None)
+
+        return state
+
+    def samplesSeeds(self, nSamples):
+        assert (len(self.stepSeeds) == nSamples)
+        return self.stepSeeds
+
+    def updateModelWeights(self, model, loggerFuncs=[]):
+        super(DistributedSamePath, self).updateModelWeights(model, loggerFuncs)
+        if self.rank == 0:
+            # take snapshot of current model weights, they are sent to other ranks in next step
+            self.broadcastWeights.update(model.state_dict())
+            self.weightsUpdated = True
+
+    def __broadcastHeader(self, cmd=None, sendWeights=False, baseSeed=0, input=None):
+        header = zeros(self.headerSize, dtype=int64)
+        if self.rank == 0:
+            header[0], header[1], header[2] = cmd, int(sendWeights), baseSeed
+            if input is not None:
+                header[3] = input.dim()
+                header[4:4 + input.dim()] = tensor(list(input.size()))
+
+        broadcast(header, 0)
+        return header
+
+    # broadcast step data from rank 0, returns the step (input, target) on all ranks
+    def __broadcastStep(self, model, input=None, target=None, header=None):
+        sendWeights = bool(header[1].item())
+        if sendWeights:
+            for buffer in self.broadcastWeights.buffers.values():
+                broadcast(buffer, 0)
+
+        # alphas, their requires_grad status and frozen layers op index (-1 if not frozen)
+        alphas = cat([layer.alphas.data.cpu() for layer in model.layersList])
+        requiresGrad = tensor([int(layer.alphas.requires_grad) for layer in model.layersList], dtype=int64)
+        frozenOpIdx = tensor([-1 if layer.frozenOpIdx is None else layer.frozenOpIdx for layer in model.layersList], dtype=int64)
+        broadcast(alphas, 0)
+        broadcast(requiresGrad, 0)
+        broadcast(frozenOpIdx, 0)
+
+        # batch
+        size = header[4:4 + header[3].item()].tolist()
+        input = input.cpu().contiguous() if self.rank == 0 else zeros(size)
+        target = target.cpu().contiguous() if self.rank == 0 else zeros(size[0], dtype=int64)
+        broadcast(input, 0)
+        broadcast(target, 0)
+
+        # local samples seeds
+        baseSeed = header[2].item()
+        self.stepSeeds = [baseSeed + self.samplesOffset + i for i in range(self.nSamples)]
+
+        if self.rank > 0:
+            # load alphas
+            offset = 0
+            for layer, layerRequiresGrad, layerFrozenOpIdx in zip(model.layersList, requiresGrad.tolist(), frozenOpIdx.tolist()):
+                # pin frozen layers partition
+                if (layerFrozenOpIdx >= 0) and (layer.frozenOpIdx is None):
+                    layer.freezeAlphas(layerFrozenOpIdx)
+                n = layer.alphas.numel()
+                layer.alphas.data.copy_(alphas[offset:offset + n])
+                layer.alphas.requires_grad = bool(layerRequiresGrad)
+                offset += n
+            # model weights are views on broadcast buffers, copy them to local replications
+            if sendWeights:
+                self.updateModelWeights(model)
+
+        return input, target
+
+    def loss(self, model, input, target):
+        assert (self.rank == 0)
+        baseSeed = self.drawSeed()
+        header = self.__broadcastHeader(self.stepCmd, self.weightsUpdated, baseSeed, input)
+        self.__broadcastStep(model, input, target, header)
+        self.weightsUpdated = False
+
+        return super(DistributedSamePath, self).loss(model, input, target)
+
+    # rank > 0 main loop, serve rank 0 steps until it stops
+    def serve(self, model):
+        assert (self.rank > 0)
+        # map model weights on broadcast buffers
+        self.broadcastWeights.map(model.state_dict(keep_vars=True))
+
+        while True:
+            header = self.__broadcastHeader()
+            if header[0].item() == self.stopCmd:
+                break
+
+            input, target = self.__broadcastStep(model, header=header)
+            super(DistributedSamePath, self).loss(model, input, target)
+
+        self.stopWorkers()
+
+    def stopRanks(self):
+        if self.worldSize > 1:
+            self.__broadcastHeader(self.stopCmd)
+
+    def processResults(self, model, results, alphas=None):
+        # init samples data list
+        samplesData = []
+        # merge all samples losses to same list
+        for partialSamplesData in results:
+            samplesData.extend(partialSamplesData)
+
+        assert (len(samplesData) == self.nSamples)
+        # local sums: [nSamples, loss, cross entropy, bops loss, squared loss, weighted loss per layer alphas ..., partition per layer alphas ...]
+        statistics = [float(len(samplesData)), sum(l for l, _, _, _ in samplesData), sum(c for _, c, _, _ in samplesData),
+                      sum(b for _, _, b, _ in samplesData), sum(l * l for l, _, _, _ in samplesData)]
+        for layerIdx, layer in enumerate(model.layersList):
+            statistics.extend([sum([l * p[layerIdx][alphaIdx] for l, _, _, p in samplesData]) for alphaIdx in range(layer.numOfOps())])
+        for layerIdx, layer in enumerate(model.layersList):
+            statistics.extend([sum([p[layerIdx][alphaIdx] for _, _, _, p in samplesData]) for alphaIdx in range(layer.numOfOps())])
+        # sum over ranks
+        statistics = tensor(statistics, dtype=float64)
+        all_reduce(statistics)
+        statistics = statistics.tolist()
+
+        nSamples, totalLoss, crossEntropyLoss, bopsLoss, squaredLoss = statistics[:5]
+        assert (int(nSamples) == self.totalSamples)
+        weightedLossSum = []
+        offset = 5
+        for layer in model.layersList:
+            weightedLossSum.append(statistics[offset:offset + layer.numOfOps()])
+            offset += layer.numOfOps()
+        partitionSum = []
+        for layer in model.layersList:
+            partitionSum.append(statistics[offset:offset + layer.numOfOps()])
+            offset += layer.numOfOps()
+        # calc variance
+        lossVariance = (squaredLoss - (totalLoss ** 2) / nSamples) / (nSamples - 1)
+
+        return self.applyResults(model, self.totalSamples, totalLoss, crossEntropyLoss, bopsLoss, weightedLossSum, partitionSum,
+                                 lossVariance, alphas)
+
+
+# entry point of ranks > 0
+def serve(modelClass, args, logger):
+    # rank model holds main model weights, received from rank 0
+    model = modelClass(args)
+    ModelReplicator.switchStage(model)
+    model.eval()
+
+    estimator = DistributedSamePath(model, modelClass, args, logger)
+    estimator.serve(model)
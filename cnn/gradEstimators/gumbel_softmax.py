@@ -0,0 +1,84 @@
+from torch import rand_like, autograd
+from torch.nn import functional as F
+
+from .layer_same_path import LayerSamePath
+
+
+# continuous relaxation of filters allocation, alphas gradient comes from a single forward & backward
+# each filter blends its ops outputs with Gumbel-softmax weights drawn from layer alphas, bops are the expected bops over these weights
+# temperature is annealed over relaxed epochs, after them we fall back to LayerSamePath discrete estimation
+class GumbelSoftmax(LayerSamePath):
+    eps = 1E-10
+    # relaxed step runs on main model
+    supportsPipeline = False
+
+    def __init__(self, model, modelClass, args, logger):
+        super(GumbelSoftmax, self).__init__(model, modelClass, args, logger)
+
+        self.tauInit = args.gumbel_tau
+        self.tauMin = args.gumbel_tau_min
+        # number of epochs with relaxation, 0 means all epochs
+        self.gumbelEpochs = args.gumbel_epochs
+
+        self.tau = self.tauInit
+        self.relaxed = True
+
+        self.logger.addRowToInfoTableByTitle(self.title, ['Gumbel-softmax', 'tau:[{}]->[{}] relaxed epochs:[{}]'
+                                              .format(self.tauInit, self.tauMin, self.gumbelEpochs if self.gumbelEpochs > 0 else 'All')])
+
+    def epochStart(self, epoch, nEpochs, loggerFuncs=[]):
+        relaxedEpochs = self.gumbelEpochs if self.gumbelEpochs > 0 else nEpochs
+        self.relaxed = epoch <= relaxedEpochs
+        # exponential annealing from tauInit to tauMin over relaxed epochs
+        progress = min((epoch - 1) / max(relaxedEpochs - 1, 1), 1.0)
+        self.tau = self.tauInit * ((self.tauMin / self.tauInit) ** progress)
+
+        logMsg = 'Gumbel-softmax tau:[{:.4f}]'.format(self.tau) if self.relaxed else 'Discrete alphas gradient estimation'
+        for f in loggerFuncs:
+            f(logMsg)
+
+    # filters ops weights, tensor of [nFilters, nOps]
+    @staticmethod
+    def gumbelWeights(alphas, nFilters, tau):
+        logits = alphas.unsqueeze(0).expand(nFilters, -1)
+        u = rand_like(logits)
+        gumbel = -(-(u + GumbelSoftmax.eps).log() + GumbelSoftmax.eps).log()
+
+        return F.softmax((logits + gumbel) / tau, dim=-1)
+
+    def loss(self, model, input, target):
+        if self.relaxed is False:
+            return super(GumbelSoftmax, self).loss(model, input, target)
+
+        # layers we optimize their alphas are relaxed, the rest follow a path drawn from their alphas
+        layers = [layer for layer in model.layersList if layer.alphas.requires_grad]
+        model.choosePathByAlphas()
+        for layer in layers:
+            layer.setRelaxedWeights(self.gumbelWeights(layer.alphas, layer.nFilters(), self.tau))
+
+        # relaxed forward runs in eval mode, like model replications
+        training = model.training
+        model.eval()
+        logits = model(input)
+        loss, crossEntropyLoss, bopsLoss = model.loss(logits, target)
+        model.train(training)
+
+        # alphas gradient only
+        if len(layers) > 0:
+            grads = autograd.grad(loss, [layer.alphas for layer in layers])
+            for layer, grad in zip(layers, grads):
+                layer.alphas.grad = grad
+
+        for layer in layers:
+            layer.setRelaxedWeights(None)
+        # relaxed forward counters do not represent paths
+        model.resetForwardCounters()
+
+        loss, crossEntropyLoss, bopsLoss = loss.item(), crossEntropyLoss.item(), bopsLoss.item()
+        # add statistics
+        stats = model.stats
+        stats.containers[stats.lossAvgKey][0].append(loss)
+        stats.containers[stats.crossEntropyLossAvgKey][0].append(crossEntropyLoss)
+        stats.containers[stats.bopsLossAvgKey][0].append(bopsLoss)
+
+        return loss, crossEntropyLoss, bopsLoss
@@ -1,4 +1,4 @@
-from .random_path import RandomPath, set_device, no_grad
+from .random_path import RandomPath, no_grad
 
 from torch import ones, tensor
 from torch.nn import functional as F
@@ -10,10 +10,18 @@ class LayerSamePath(RandomPath):
     def __init__(self, model, modelClass, args, logger):
         super(LayerSamePath, self).__init__(model, modelClass, args, logger)
 
+    # choose sample path in replication model, path has to depend only on sample seed
+    def choosePath(self, cModel, seed):
+        self.seedSample(seed)
+        cModel.choosePathByAlphas()
+
+    # returns (baseline, scale) of current step gradient, i.e. grad = scale * E[(Loss - baseline) * (I_ni - E[I_ni])]
+    # default is no baseline, i.e. plain Monte-Carlo estimate
+    def baseline(self, nSamples, lossAvg):
+        return 0.0, 1.0
+
     def lossPerReplication(self, args):
-        cModel, input, target, nSamples, gpu = args
-        # switch to process GPU
-        set_device(gpu)
+        cModel, input, target, samples, _ = args
         assert (cModel.training is False)
 
         # init samples data list, each elements is a tuple (loss,partition)
@@ -21,11 +29,14 @@ class LayerSamePath(RandomPath):
 
         with no_grad():
             # calc losses and add to list
-            for _ in range(nSamples):
-                # choose path in model based on alphas distribution
-                cModel.choosePathByAlphas()
+            for i, seed in enumerate(samples):
+                # choose path in model based on alphas distribution, path depends only on sample seed
+                self.choosePath(cModel, seed)
+                # forward deterministic prefix once, after 1st sample path is set
+                if i == 0:
+                    nPrefixBlocks, prefixOut = self.prefixForward(cModel, input)
                 # forward input in model
-                logits = cModel(input)
+                logits = self.sampleForward(cModel, nPrefixBlocks, prefixOut)
                 # calc loss
                 loss, crossEntropyLoss, bopsLoss = cModel.loss(logits, target)
                 # get sample model partition
@@ -33,16 +44,20 @@ class LayerSamePath(RandomPath):
                 # add sample data to list
                 samplesData.append((loss.item(), crossEntropyLoss.item(), bopsLoss.item(), modelPartition))
 
+            # count prefix forwards we saved
+            if len(samples) > 0:
+                cModel.addPrefixForwardCounters(nPrefixBlocks, len(samples) - 1)
+
         return samplesData
 
-    def processResults(self, model, results):
+    def processResults(self, model, results, alphas=None):
         # init  samples data  list
         samplesData = []
         # merge all samples losses to same list
         for partialSamplesData in results:
             samplesData.extend(partialSamplesData)
 
-        assert (len(samplesData) == self.nSamples)
+        nSamples = len(samplesData)
         # calc total losses
         totalLoss, crossEntropyLoss, bopsLoss = 0.0, 0.0, 0.0
         for l, c, b, _ in samplesData:
@@ -50,27 +65,47 @@ class LayerSamePath(RandomPath):
             crossEntropyLoss += c
             bopsLoss += b
         # calc loss average
-        lossAvg = totalLoss / self.nSamples
-        crossEntropyAvg = crossEntropyLoss / self.nSamples
-        bopsAvg = bopsLoss / self.nSamples
+        lossAvg = totalLoss / nSamples
+        # calc weighted loss sum per layer alphas
+        weightedLossSum = []
+        for layerIdx, layer in enumerate(model.layersList):
+            weightedLossSum.append([sum([l * p[layerIdx][alphaIdx] for l, _, _, p in samplesData]) for alphaIdx in range(layer.numOfOps())])
+        # calc partition sum per layer alphas
+        partitionSum = []
+        for layerIdx, layer in enumerate(model.layersList):
+            partitionSum.append([sum([p[layerIdx][alphaIdx] for _, _, _, p in samplesData]) for alphaIdx in range(layer.numOfOps())])
+        # calc variance
+        lossVariance = [((l - lossAvg) ** 2) for l, _, _, p in samplesData]
+        lossVariance = sum(lossVariance) / (nSamples - 1)
+
+        return self.applyResults(model, nSamples, totalLoss, crossEntropyLoss, bopsLoss, weightedLossSum, partitionSum, lossVariance, alphas)
+
+    # update alphas gradient & statistics given samples losses sums
+    # weightedLossSum[layerIdx][alphaIdx] is the sum of sample loss multiplied by the number of layer filters of alphaIdx in sample partition
+    # partitionSum[layerIdx][alphaIdx] is the sum of the number of layer filters of alphaIdx in sample partition
+    # alphas is the list of layers alphas the samples were drawn from, None means model current alphas
+    def applyResults(self, model, nSamples, totalLoss, crossEntropyLoss, bopsLoss, weightedLossSum, partitionSum, lossVariance,
+                     alphas=None):
+        # calc loss average
+        lossAvg = totalLoss / nSamples
+        crossEntropyAvg = crossEntropyLoss / nSamples
+        bopsAvg = bopsLoss / nSamples
+        # get gradient baseline
+        baseline, scale = self.baseline(nSamples, lossAvg)
         # calc gradient for all alphas
         for layerIdx, layer in enumerate(model.layersList):
-            # calc layer alphas softmax
-            probs = F.softmax(layer.alphas, dim=-1)
-            # grad = E[I_ni*Loss] - E[I_ni]*E[Loss] = v2 - v1
+            # calc layer alphas softmax, of the alphas samples were drawn from
+            layerAlphas = layer.alphas if alphas is None else alphas[layerIdx].to(layer.alphas.device)
+            probs = F.softmax(layerAlphas.detach(), dim=-1)
+            # grad = E[I_ni*(Loss-b)] - E[I_ni]*E[Loss-b] = v2 - v1
             # calc v1
-            v1 = lossAvg * layer.nFilters() * probs
-            # calc v2
-            v2 = []
-            for alphaIdx in range(layer.numOfOps()):
-                # calc weighted loss average
-                weightedLossAvg = sum([l * p[layerIdx][alphaIdx] for l, _, _, p in samplesData]) / self.nSamples
-                v2.append(weightedLossAvg)
-
+            v1 = (lossAvg - baseline) * layer.nFilters() * probs
+            # calc v2, weighted loss average
+            v2 = [(w - baseline * n) / nSamples for w, n in zip(weightedLossSum[layerIdx], partitionSum[layerIdx])]
             # convert v2 to tensor
             v2 = tensor(v2).type(v1.type())
             # update layer alphas grad
-            layer.alphas.grad = v2 - v1
+            layer.alphas.grad = scale * (v2 - v1)
 
         # add statistics
         stats = model.stats
@@ -79,8 +114,6 @@ class LayerSamePath(RandomPath):
         stats.containers[stats.crossEntropyLossAvgKey][0].append(crossEntropyAvg)
         stats.containers[stats.bopsLossAvgKey][0].append(bopsAvg)
         # add variance
-        lossVariance = [((l - lossAvg) ** 2) for l, _, _, p in samplesData]
-        lossVariance = sum(lossVariance) / (self.nSamples - 1)
         stats.containers[stats.lossVarianceKey][0].append(lossVariance)
 
         return lossAvg, crossEntropyAvg, bopsAvg
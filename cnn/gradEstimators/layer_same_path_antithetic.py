@@ -0,0 +1,32 @@
+from torch import rand
+
+from .layer_same_path import LayerSamePath
+
+
+# LayerSamePath with antithetic samples pairs
+# each pair shares the filters uniform samples, the 2nd sample chooses each filter op by (1 - u) instead of u
+# therefore pair paths are negatively correlated, while each sample path is still drawn from alphas distribution
+class LayerSamePathAntithetic(LayerSamePath):
+    def __init__(self, model, modelClass, args, logger):
+        super(LayerSamePathAntithetic, self).__init__(model, modelClass, args, logger)
+
+        if self.nSamples % 2 == 1:
+            self.logger.addRowToInfoTableByTitle(self.title, ['Antithetic', 'odd nSamples:[{}], last sample has no pair'.format(self.nSamples)])
+
+    # pair base seed is even, therefore (seed // 2) is the pair seed and (seed % 2) is the pair index
+    def samplesSeeds(self, nSamples):
+        baseSeed = 2 * self.drawSeed()
+        return [baseSeed + i for i in range(nSamples)]
+
+    def choosePath(self, cModel, seed):
+        self.seedSample(seed // 2)
+        for layer in cModel.layersList:
+            # frozen layer partition is pinned
+            if layer.frozenOpIdx is not None:
+                continue
+
+            u = rand(layer.nFilters())
+            if seed % 2 == 1:
+                u = 1 - u
+
+            layer.choosePathByUniform(u)
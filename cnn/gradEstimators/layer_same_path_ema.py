@@ -0,0 +1,24 @@
+from .layer_same_path import LayerSamePath
+
+
+# LayerSamePath with exponential moving average of previous steps loss average as baseline
+# baseline does not depend on current step samples, therefore gradient remains unbiased
+class LayerSamePathEMA(LayerSamePath):
+    def __init__(self, model, modelClass, args, logger):
+        super(LayerSamePathEMA, self).__init__(model, modelClass, args, logger)
+
+        self.baselineDecay = args.baseline_decay
+        # first step has no baseline
+        self.emaBaseline = None
+
+        self.logger.addRowToInfoTableByTitle(self.title, ['EMA baseline decay', self.baselineDecay])
+
+    def baseline(self, nSamples, lossAvg):
+        baseline = 0.0 if self.emaBaseline is None else self.emaBaseline
+        # update baseline with current step loss average
+        if self.emaBaseline is None:
+            self.emaBaseline = lossAvg
+        else:
+            self.emaBaseline = (self.baselineDecay * self.emaBaseline) + ((1 - self.baselineDecay) * lossAvg)
+
+        return baseline, 1.0
@@ -0,0 +1,12 @@
+from .layer_same_path import LayerSamePath
+
+
+# LayerSamePath with leave-one-out baseline, i.e. each sample baseline is the loss average of the other samples
+# sum_s (l_s - b_s) * (I_s - E[I]) / N, where b_s = (sum(l) - l_s) / (N - 1), equals N / (N - 1) of the batch mean baseline gradient
+class LayerSamePathLOO(LayerSamePath):
+    def __init__(self, model, modelClass, args, logger):
+        super(LayerSamePathLOO, self).__init__(model, modelClass, args, logger)
+
+    def baseline(self, nSamples, lossAvg):
+        assert (nSamples > 1)
+        return lossAvg, nSamples / (nSamples - 1)
@@ -1,7 +1,7 @@
 from torch import zeros, tensor, no_grad
 from torch.nn import functional as F
 
-from cnn.model_replicator import ModelReplicator, set_device
+from cnn.model_replicator import ModelReplicator
 
 
 class RandomPath(ModelReplicator):
@@ -11,16 +11,12 @@ class RandomPath(ModelReplicator):
     def getModel(self, args):
         return args[0]
 
-    def buildArgs(self, inputPerGPU, targetPerGPU, nSamplesPerModel):
-        args = ((cModel, inputPerGPU[gpu], targetPerGPU[gpu], nSamples, gpu)
-                for nSamples, (cModel, gpu) in zip(nSamplesPerModel, self.replications))
-
-        return args
+    def buildArgs(self, cModel, input, target, samples, device):
+        return cModel, input, target, samples, device
 
     def lossPerReplication(self, args):
-        cModel, input, target, nSamples, gpu = args
-        # switch to process GPU
-        set_device(gpu)
+        cModel, input, target, samples, device = args
+        nSamples = len(samples)
         assert (cModel.training is False)
 
         with no_grad():
@@ -38,7 +34,7 @@ class RandomPath(ModelReplicator):
                 # turn off coin toss for this layer
                 layer.alphas.requires_grad = False
                 # init layer alphas gradient
-                layerAlphasGrad = zeros(len(layer.alphas)).cuda(gpu)
+                layerAlphasGrad = zeros(len(layer.alphas), device=device)
                 # calc layer alphas softmax
                 probs = F.softmax(layer.alphas, dim=-1)
 
@@ -48,7 +44,8 @@ class RandomPath(ModelReplicator):
 
                     # init loss samples list
                     alphaLossSamples = []
-                    for _ in range(nSamples):
+                    for seed in samples:
+                        self.seedSample(seed)
                         # choose path in model based on alphas distribution, while current layer alpha is [i]
                         cModel.choosePathByAlphas(layerIdx=layerIdx, alphaIdx=i)
                         # forward input in model
@@ -79,10 +76,10 @@ class RandomPath(ModelReplicator):
 
             return alphasGrad, allLossSamples, layersIndices, totalLoss, gradNorm, alphaLossVariance
 
-    def processResults(self, model, results):
+    def processResults(self, model, results, alphas=None):
         stats = model.stats
         # init total loss
-        totalLoss = tensor(0.0).cuda()
+        totalLoss = tensor(0.0, device=model.layersList[0].alphas.device)
         # init loss samples list for ALL alphas
         allLossSamples = []
         # process returned results
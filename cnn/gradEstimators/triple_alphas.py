@@ -8,11 +8,8 @@ class TripleAlphas(ModelReplicator):
     def __init__(self, model, modelClass, args):
         super(TripleAlphas, self).__init__(model, modelClass, args)
 
-    def buildArgs(self, inputPerGPU, targetPerGPU, layersIndicesPerModel):
-        args = ((cModel, inputPerGPU[gpu], targetPerGPU[gpu], layersIndices)
-                for layersIndices, (cModel, gpu) in zip(layersIndicesPerModel, self.replications))
-
-        return args
+    def buildArgs(self, cModel, input, target, layersIndices, device):
+        return cModel, input, target, layersIndices
 
     def lossPerReplication(self, args):
         cModel, input, target, layersIndices = args
@@ -106,7 +103,7 @@ class TripleAlphas(ModelReplicator):
 
         return alphasGrad, allLossSamples, layersIndices, totalLoss.cuda(), gradNorm, alphaLossVariance
 
-    def processResults(self, model, results):
+    def processResults(self, model, results, alphas=None):
         stats = model.stats
         # init total loss
         totalLoss = 0.0
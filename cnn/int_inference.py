@@ -0,0 +1,276 @@
+from time import time
+from itertools import groupby
+
+from numpy import matmul, int32 as np_int32, int64 as np_int64
+
+from torch import no_grad, zeros, cat, tensor, from_numpy, int32, float32
+from torch.nn import Conv2d, BatchNorm2d
+from torch.nn import functional as F
+
+from NICE.actquant import ActQuantBuffers
+from cnn.MixedLayer import MixedLayer
+from cnn.models.ResNet import BasicBlock
+from cnn.models.ResNetNice import BasicBlock as NiceBasicBlock
+
+
+# feature maps passed between layers
+# codes holds integer activation codes (int32), steps holds the quantization step of each feature map
+# when feature maps are not quantized (model input, downsample output), codes is None and value holds the float tensor
+class LayerActivations:
+    def __init__(self, codes=None, steps=None, value=None):
+        assert ((codes is None) != (value is None))
+        self.codes = codes
+        self.steps = steps
+        self.value = value
+
+    def isQuantized(self):
+        return self.codes is not None
+
+    def dequantize(self):
+        if self.isQuantized():
+            return self.codes.type(float32) * self.steps.view(1, -1, 1, 1)
+
+        return self.value
+
+
+# integer convolution of a group of filters sharing the same op (same kernel, bitwidth & stride)
+class IntConvGroup:
+    def __init__(self, filtersIdx, ops, maxIntBitwidth):
+        self.filtersIdx = filtersIdx
+        op = ops[0]
+        conv = op.getModule(Conv2d)
+        self.stride = conv.stride
+        self.padding = conv.padding
+        self.kernel_size = conv.kernel_size
+
+        bitwidth, _ = op.getBitwidth()
+        # full precision weights
+        self.weight = cat([o.getModule(Conv2d).weight.detach().cpu() for o in ops], dim=0)
+        # integer weights codes
+        self.weightCodes, self.weightSteps = None, None
+        if bitwidth <= maxIntBitwidth:
+            self.weightCodes, self.weightSteps = self.__buildWeightCodes(ops)
+
+        # stack BN modules as a single BN per group
+        self.bn = None
+        bnModules = [o.getModule(BatchNorm2d) for o in ops]
+        if bnModules[0] is not None:
+            self.bn = [cat([getattr(bn, attr).detach().cpu() for bn in bnModules]) for attr in ['running_mean', 'running_var', 'weight', 'bias']]
+            self.bnEps = bnModules[0].eps
+
+        # stack activation quantization params
+        self.actClamp, self.actBitwidth = None, None
+        actModules = [o.getModule(ActQuantBuffers) for o in ops]
+        if actModules[0] is not None:
+            self.actClamp = cat([act.clamp_val.detach().cpu() for act in actModules])
+            self.actBitwidth = actModules[0].bitwidth
+            self.actQuant = actModules[0].quant
+
+    # weights codes are computed with the same WRPN scale as quantize.quant_weight_wrpn_improved()
+    @staticmethod
+    def __buildWeightCodes(ops):
+        codes, steps = [], []
+        for op in ops:
+            conv = op.getModule(Conv2d)
+            w, weight_max_value = op.quantize.clamp_weights(conv.weight.detach().cpu(), conv)
+            weight_scale = op.quantize.weight_max_int / weight_max_value
+            codes.append(op.quantize.round_to_int(w * weight_scale).type(int32))
+            steps.append(1 / weight_scale)
+
+        return cat(codes, dim=0), tensor(steps, dtype=float32)
+
+    def nFilters(self):
+        return len(self.filtersIdx)
+
+    def conv(self, x):
+        # at least one side is not integer, run in float
+        if (not x.isQuantized()) or (self.weightCodes is None):
+            return F.conv2d(x.dequantize(), self.weight, stride=self.stride, padding=self.padding)
+
+        B, _, H, W = x.codes.shape
+        Hout = (H + 2 * self.padding[0] - self.kernel_size[0]) // self.stride[0] + 1
+        Wout = (W + 2 * self.padding[1] - self.kernel_size[1]) // self.stride[1] + 1
+
+        out = zeros(B, self.nFilters(), Hout * Wout)
+        # feature maps with the same activation step share the same scale, accumulate each such group in int32
+        # scales are applied once per group, i.e. at the layer boundary
+        steps = x.steps.tolist()
+        for step in sorted(set(steps)):
+            channels = tensor([c for c, s in enumerate(steps) if s == step])
+            # extract integer patches, codes are small integers therefore exact in float
+            patches = F.unfold(x.codes.index_select(1, channels).type(float32), self.kernel_size, padding=self.padding, stride=self.stride)
+            patches = patches.type(int32).numpy()
+            weights = self.weightCodes.index_select(1, channels).view(self.nFilters(), -1).numpy()
+            # int32 accumulation, unless int32 accumulator might overflow, then accumulate in int64
+            maxAcc = int(abs(weights).astype(np_int64).sum(axis=1).max()) * int(abs(patches).max())
+            accType = np_int32 if maxAcc < 2 ** 31 else np_int64
+            acc = matmul(weights.astype(accType), patches.astype(accType))
+            assert (acc.dtype == accType)
+            # rescale to float
+            out += from_numpy(acc).type(float32) * (self.weightSteps.view(1, -1, 1) * step)
+
+        return out.view(B, self.nFilters(), Hout, Wout)
+
+    def batchNorm(self, x):
+        if self.bn is None:
+            return x
+
+        running_mean, running_var, weight, bias = self.bn
+        return F.batch_norm(x, running_mean, running_var, weight, bias, False, 0.0, self.bnEps)
+
+
+class IntegerInference:
+    # higher bitwidths are not integer-friendly, i.e. run in float
+    maxIntBitwidth = 16
+    # supported model blocks, in addition to MixedLayer
+    supportedBlocks = (BasicBlock, NiceBasicBlock)
+
+    # partition is a list of IntTensor per layer, if None we use model current partition
+    def __init__(self, model, partition=None):
+        # fail early on unsupported models
+        for block in model.layers:
+            if not isinstance(block, (MixedLayer,) + self.supportedBlocks):
+                raise NotImplementedError('integer inference does not support block of type [{}]'.format(type(block)))
+
+        self.model = model
+        if partition is not None:
+            model.setFiltersByPartition(partition)
+
+        # build layers plans, i.e. filters groups with their integer weights, once for the frozen partition
+        self.plans = {}
+        for layer in model.layersList:
+            self.plans[layer] = self.__buildLayerPlan(layer)
+
+    def __buildLayerPlan(self, layer):
+        ops = [f.ops[f.prev_alpha_idx][f.curr_alpha_idx] for f in layer.filters]
+        # group filters by op index
+        filtersIdx = sorted(range(layer.nFilters()), key=lambda i: layer.filters[i].curr_alpha_idx)
+        groups = []
+        for _, g in groupby(filtersIdx, key=lambda i: layer.filters[i].curr_alpha_idx):
+            g = list(g)
+            groups.append(IntConvGroup(g, [ops[i] for i in g], self.maxIntBitwidth))
+
+        return groups
+
+    def __layerForward(self, layer, x, residual=None):
+        groups = self.plans[layer]
+        out = None
+        for group in groups:
+            res = group.conv(x)
+            res = group.batchNorm(res)
+            if out is None:
+                out = zeros(res.size(0), layer.nFilters(), res.size(2), res.size(3))
+            out[:, group.filtersIdx] = res
+
+        # layer BN, in case of MixedLayerWithBN
+        bn = getattr(layer, 'bn', None)
+        if bn is not None:
+            out = F.batch_norm(out, bn.running_mean.cpu(), bn.running_var.cpu(), bn.weight.detach().cpu(), bn.bias.detach().cpu(), False, 0.0,
+                               bn.eps)
+
+        # add residual
+        if residual is not None:
+            out += residual.dequantize()
+
+        return self.__activation(groups, out)
+
+    # quantize layer output to integer codes, the same way as ActQuantBuffers
+    def __activation(self, groups, x):
+        # no activation quantization in layer (i.e. downsample), keep float
+        if groups[0].actClamp is None:
+            return LayerActivations(value=x)
+
+        nFilters = x.size(1)
+        clampVal = zeros(nFilters)
+        bitwidth = [None] * nFilters
+        quant = True
+        for group in groups:
+            clampVal[group.filtersIdx] = group.actClamp
+            for i in group.filtersIdx:
+                bitwidth[i] = group.actBitwidth
+            quant = quant and group.actQuant
+
+        # clamp, like ActQuant.act_clamp()
+        x = F.relu(x) - F.relu(x - clampVal.view(1, -1, 1, 1))
+        # check that activations can be represented as integers
+        if (not quant) or (max(bitwidth) > self.maxIntBitwidth):
+            return LayerActivations(value=x)
+
+        actScale = tensor([(2 ** b) - 1 for b in bitwidth], dtype=float32) / clampVal
+        codes = (x * actScale.view(1, -1, 1, 1)).round().type(int32)
+
+        return LayerActivations(codes=codes, steps=1 / actScale)
+
+    def __blockForward(self, block, x):
+        if isinstance(block, MixedLayer):
+            return self.__layerForward(block, x)
+
+        assert (isinstance(block, self.supportedBlocks))
+        residual = self.__layerForward(block.downsample, x) if block.downsample else x
+        out = self.__layerForward(block.block1, x)
+        return self.__layerForward(block.block2, out, residual)
+
+    # model maxpool after 1st layer (ResNetNice), max commutes with positive per channel steps, i.e. applied on codes
+    def __maxpool(self, x):
+        maxpool = getattr(self.model, 'maxpool', None)
+        if maxpool is None:
+            return x
+
+        if x.isQuantized():
+            return LayerActivations(codes=maxpool(x.codes.type(float32)).type(int32), steps=x.steps)
+
+        return LayerActivations(value=maxpool(x.value))
+
+    # returns model logits, computed by integer arithmetic
+    def forward(self, input):
+        with no_grad():
+            # model input is not quantized
+            x = LayerActivations(value=input.cpu())
+            for idx, block in enumerate(self.model.layers):
+                x = self.__blockForward(block, x)
+                if idx == 0:
+                    x = self.__maxpool(x)
+
+            out = x.dequantize()
+            out = F.adaptive_avg_pool2d(out, 1)
+            out = out.view(out.size(0), -1)
+            out = F.linear(out, self.model.fc.weight.detach().cpu(), self.model.fc.bias.detach().cpu())
+
+        return out
+
+    def __call__(self, input):
+        return self.forward(input)
+
+    # compares integer inference to fake-quant model logits
+    # model has to be quantized and in eval mode
+    def validate(self, data_queue, nBatches, tolerance=1E-3, loggerFuncs=[]):
+        assert (self.model.isQuantized() is True)
+        self.model.eval()
+        device = next(iter(self.model.parameters())).device
+
+        maxDiff, nSamples, nCorrect, nAgree = 0.0, 0, 0, 0
+        intTime = 0.0
+        with no_grad():
+            for step, (input, target) in enumerate(data_queue):
+                if step >= nBatches:
+                    break
+
+                logits = self.model(input.to(device)).cpu()
+                startTime = time()
+                intLogits = self.forward(input)
+                intTime += time() - startTime
+
+                maxDiff = max(maxDiff, (intLogits - logits).abs().max().item())
+                nSamples += input.size(0)
+                nCorrect += intLogits.argmax(dim=1).eq(target).sum().item()
+                nAgree += intLogits.argmax(dim=1).eq(logits.argmax(dim=1)).sum().item()
+
+        result = dict(maxDiff=maxDiff, match=(maxDiff <= tolerance), accuracy=(100.0 * nCorrect / max(nSamples, 1)),
+                      agreement=(100.0 * nAgree / max(nSamples, 1)), throughput=(nSamples / max(intTime, 1E-9)))
+
+        for f in loggerFuncs:
+            f([['Samples', nSamples], ['Max logits diff', '{:.6f}'.format(maxDiff)], ['Within tolerance [{}]'.format(tolerance), result['match']],
+               ['Accuracy', '{:.3f}'.format(result['accuracy'])], ['Top-1 agreement', '{:.3f}'.format(result['agreement'])],
+               ['Throughput [samples/sec]', '{:.2f}'.format(result['throughput'])]])
+
+        return result
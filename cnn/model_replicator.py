@@ -1,56 +1,229 @@
-from multiprocessing import Pool
 from abc import abstractmethod
 from math import floor
+from traceback import format_exc
+from os import cpu_count, sched_setaffinity
 
-from torch.cuda import set_device
+from torch import Tensor, tensor, zeros, full, cat, int64, uint8, device, set_num_threads, manual_seed, randint
+from torch.cuda import set_device, synchronize, device as cuda_device
 from torch.nn import functional as F
+from torch.multiprocessing import Process, Queue
+
+# move tensors in (nested) result to CPU, so results do not hold worker GPU memory
+def toCPU(obj):
+    if isinstance(obj, Tensor):
+        return obj.cpu()
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(toCPU(x) for x in obj)
+    if isinstance(obj, dict):
+        return {k: toCPU(v) for k, v in obj.items()}
+
+    return obj
+
+
+# main model weights, stored in a single buffer per dtype on a specific device
+# replications on this device map their weights (parameters & buffers) onto these buffers, i.e. there is a single weights copy per device
+# sync is a single copy from main model to buffers, followed by a version bump
+class SharedWeights:
+    def __init__(self, stateDict, device):
+        self.device = device
+        # layout is a list of (key, dtype, offset, size)
+        self.layout = []
+        nElements = {}
+        for key, t in stateDict.items():
+            offset = nElements.get(t.dtype, 0)
+            self.layout.append((key, t.dtype, offset, t.size()))
+            nElements[t.dtype] = offset + t.numel()
+
+        # CPU buffers have to be moved to shared memory, CUDA buffers are shared by IPC
+        self.buffers = {dtype: zeros(n, dtype=dtype, device=device).share_memory_() for dtype, n in nElements.items()}
+        # weights version, in shared memory, 0 means weights have not been synchronized yet
+        self.version = zeros(1, dtype=int64).share_memory_()
+
+    def update(self, stateDict):
+        for dtype, buffer in self.buffers.items():
+            tensors = [stateDict[key].contiguous().view(-1) for key, d, _, _ in self.layout if d == dtype]
+            if tensors[0].device == buffer.device:
+                cat(tensors, out=buffer)
+            else:
+                buffer.copy_(cat(tensors))
+
+        # replications read the buffers from other processes, make sure copy is done before version bump
+        if self.device.type == 'cuda':
+            with cuda_device(self.device.index):
+                synchronize()
+        self.version += 1
+
+    # replace stateDict tensors (parameters & buffers) data with views on shared buffers
+    def map(self, stateDict):
+        for key, dtype, offset, size in self.layout:
+            t = stateDict[key]
+            assert ((t.dtype == dtype) and (t.size() == size))
+            t.data = self.buffers[dtype].narrow(0, offset, t.numel()).view(size)
+
+
+# replica worker process main loop
+# the replication is created inside the process and lives as long as the process, therefore it is never pickled
+# replicator is pickled once, at process creation, and lives as long as the process as well
+# on CPU, nThreads is the worker intra-op threads number and cores is the set of cores the worker is pinned to
+def replicaWorkerLoop(modelClass, args, replicator, workerDevice, nThreads, cores, sharedWeights, commands, results):
+    try:
+        if workerDevice.type == 'cuda':
+            # set device to required gpu
+            set_device(workerDevice.index)
+        else:
+            set_num_threads(nThreads)
+            sched_setaffinity(0, cores)
+        # create model new instance on worker device
+        cModel = modelClass(args).to(workerDevice)
+        # model switch stages, make model quantized
+        ModelReplicator.switchStage(cModel)
+        # replication never restores its full precision weights, release their backup
+        for layer in cModel.layersList:
+            for op in layer.opsList():
+                op.full_parameters = {}
+        # map replication weights on device shared weights
+        sharedWeights.map(cModel.state_dict(keep_vars=True))
+        # set mode to eval mode
+        cModel.eval()
+        results.put((True, 'Quantized'))
+    except Exception:
+        results.put((False, format_exc()))
+        return
+
+    while True:
+        cmd, data = commands.get()
+        if cmd == ReplicaWorker.stopCmd:
+            break
+
+        try:
+            result = None
+            if cmd == ReplicaWorker.lossCmd:
+                assert (sharedWeights.version.item() > 0)
+                alphas, input, target, samples = data
+                # copy model alphas
+                for cLayer, (layerAlphas, requires_grad, frozenOpIdx) in zip(cModel.layersList, alphas):
+                    # pin frozen layers partition
+                    if (frozenOpIdx is not None) and (cLayer.frozenOpIdx is None):
+                        cLayer.freezeAlphas(frozenOpIdx)
+                    cLayer.alphas.data.copy_(layerAlphas)
+                    cLayer.alphas.requires_grad = requires_grad
+                # forward counters are per step
+                cModel.resetForwardCounters()
+                result = toCPU(replicator.replicationFunc(replicator.buildArgs(cModel, input, target, samples, workerDevice)))
+
+            results.put((True, result))
+        except Exception:
+            results.put((False, format_exc()))
+
+
+# long-lived process which holds a single model replication on a specific device
+# each step main process sends only alphas, batch and samples budget
+class ReplicaWorker:
+    stopCmd, lossCmd = 'stop', 'loss'
+
+    def __init__(self, modelClass, args, replicator, workerDevice, sharedWeights, nThreads=None, cores=None):
+        self.device = workerDevice
+        self.commands = Queue()
+        self.results = Queue()
+        self.process = Process(target=replicaWorkerLoop,
+                               args=(modelClass, args, replicator, workerDevice, nThreads, cores, sharedWeights, self.commands, self.results))
+        self.process.daemon = True
+        self.process.start()
+
+    def send(self, cmd, data=None):
+        self.commands.put((cmd, data))
+
+    def getResult(self):
+        success, result = self.results.get()
+        if success is False:
+            raise RuntimeError('Replication on [{}] failed:\n{}'.format(self.device, result))
+
+        return result
+
+    def stop(self):
+        self.send(self.stopCmd)
+        self.process.join()
 
 
 class ModelReplicator:
+    # estimators whose step is a single submitStep() & collectStep() support pipelined alphas training
+    supportsPipeline = True
+    # number of samples per step can be changed after init by setNSamples()
+    supportsSetNSamples = True
+
     def __init__(self, model, modelClass, args, logger):
         self.gpuIDs = args.gpu
         self.alphaLimit = args.alpha_limit
         self.alphaLimitCounter = args.alpha_limit_counter
         # save number of samples
         self.nSamples = args.nSamples
-        # init replications list
-        self.replications = []
+        # number of consecutive steps each layer optimal alpha probability has been over alphaLimit
+        self.optLimitCounters = zeros(len(model.layersList), dtype=int64)
+        # memory budget of deterministic prefix output cache, 0 disables the cache
+        self.prefixCacheBytes = args.prefix_cache_mb * (1024 ** 2)
+        # cached prefix depth per (input size, deterministic prefix length), filled by the resident replicator in each worker
+        self.prefixDepths = {}
+        # init replica workers list
+        self.workers = []
         # save logger
         self.logger = logger
         self.title = 'Replications'
         self.rows = []
 
-        # create replications
-        for gpu in self.gpuIDs:
-            for _ in range(args.nCopies):
-                # set device to required gpu
-                set_device(gpu)
-                # create model new instance
-                cModel = modelClass(args)
-                # set model to cuda on specific GPU
-                cModel = cModel.cuda()
-                # set model criterion to its GPU
-                cModel._criterion.cuda()
-                # model switch stages, make model quantized
-                self.__switch_stage(cModel)
-                # set mode to eval mode
-                cModel.eval()
-                # add model to replications
-                self.replications.append((cModel, gpu))
-
-        self.rows.insert(0, ['nReplications', len(self.replications)])
+        # init replications devices
+        if args.replicator_device == 'cpu':
+            self.devices = [device('cpu')]
+            nCores = cpu_count()
+            # split cores between CPU replications
+            nThreads = args.replica_threads if args.replica_threads > 0 else max(nCores // args.nCopies, 1)
+            workersCores = [set((i * nThreads + j) % nCores for j in range(nThreads)) for i in range(args.nCopies)]
+            self.rows.append(['Threads per replication', nThreads])
+        else:
+            self.devices = [device('cuda', gpu) for gpu in self.gpuIDs]
+            nThreads = None
+            workersCores = [None] * args.nCopies
+
+        # create shared weights per device
+        modelStateDict = model.state_dict()
+        self.sharedWeights = {d: SharedWeights(modelStateDict, d) for d in self.devices}
+        # create replica workers, a worker per (device, copy)
+        # replicator is sent to workers once, here, therefore state replications use has to be set before workers creation
+        for d in self.devices:
+            for cores in workersCores:
+                self.workers.append(ReplicaWorker(modelClass, args, self, d, self.sharedWeights[d], nThreads, cores))
+        # wait for replications to be ready
+        for i, worker in enumerate(self.workers):
+            self.rows.append(['cModel [{}]'.format(i), '[{}] {}'.format(worker.device, worker.getResult())])
+
+        self.rows.insert(0, ['nReplications', len(self.workers)])
 
         # # update replications weights, take main model quantized weights
         # loggerFunc = [lambda msg: self.rows.append(['Init', msg])]
         # self.updateModelWeights(model, loggerFunc)
         # restore original gpu
-        set_device(args.gpu[0])
+        if args.replicator_device == 'cuda':
+            set_device(args.gpu[0])
         # create info table
         self.logger.addInfoTable(self.title, self.rows)
 
-    # build args for pool.map
+    # replicator is sent to workers at their creation, without its workers & logger
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ['workers', 'logger', 'rows', 'sharedWeights', 'stepAlphas']:
+            state.pop(key, None)
+
+        return state
+
+    def stopWorkers(self):
+        for worker in self.workers:
+            worker.stop()
+
+        self.workers = []
+
+    # build lossPerReplication() args for a single replication, runs in replica worker
+    # samples is the list of replication samples seeds
     @abstractmethod
-    def buildArgs(self, inputPerGPU, targetPerGPU, nSamplesPerModel):
+    def buildArgs(self, cModel, input, target, samples, device):
         raise NotImplementedError('subclasses must override buildArgs()!')
 
     # get model from args tuple
@@ -63,18 +236,19 @@ class ModelReplicator:
     def lossPerReplication(self, args):
         raise NotImplementedError('subclasses must override lossPerReplication()!')
 
-    # process results from all pool processes
+    # process results from all replica workers
+    # alphas is the list of layers alphas the samples were drawn from, None means model current alphas
     @abstractmethod
-    def processResults(self, model, results):
+    def processResults(self, model, results, alphas=None):
         raise NotImplementedError('subclasses must override processResults()!')
 
-    def __switch_stage(self, cModel):
+    @staticmethod
+    def switchStage(cModel):
         switchStageFlag = True
         while switchStageFlag:
             switchStageFlag = cModel.switch_stage()
 
         assert (cModel.isQuantized() is True)
-        self.rows.append(['cModel [{}]'.format(len(self.replications)), 'Quantized'])
 
     # Wrapper function per process, i.e. per replication
     def replicationFunc(self, args):
@@ -87,6 +261,14 @@ class ModelReplicator:
 
         return result, counters
 
+    # set number of samples per step
+    def setNSamples(self, nSamples):
+        self.nSamples = nSamples
+
+    # called by regime before each alphas training epoch
+    def epochStart(self, epoch, nEpochs, loggerFuncs=[]):
+        pass
+
     def logWeightsUpdateMsg(self, msg, nEpoch):
         self.logger.addRowToInfoTableByTitle(self.title, [nEpoch, msg])
 
@@ -95,49 +277,43 @@ class ModelReplicator:
         # load model state dict
         modelStateDict = model.state_dict()
 
-        # load model weights
-        for cModel, _ in self.replications:
-            assert (cModel.isQuantized() is True)
-            cModel.load_state_dict(modelStateDict)
+        # copy model weights once per device, replications share them
+        for sharedWeights in self.sharedWeights.values():
+            sharedWeights.update(modelStateDict)
 
         # apply loggers funcs
         for f in loggerFuncs:
             f('Model replications weights have been updated')
 
-    def updateLayersAlphaOptimization(self, model):
-        # init list of layers indices we still have to optimize their alphas
-        optimizeLayerIdx = []
-        # update layers alphas training status, if optimal alpha reached training limit then stop training
-        for idx, layer in enumerate(model.layersList):
-            if layer.alphas.requires_grad is True:
-                # calc layer alphas softmax
-                probs = F.softmax(layer.alphas, dim=-1)
-                optProb = probs.max().item()
-
-                # update layer limit counter or reset it
-                if optProb >= self.alphaLimit:
-                    layer.optLimitCounter += 1
-                else:
-                    layer.optLimitCounter = 0
-
-                # check if counter is enough or not
-                if layer.optLimitCounter >= self.alphaLimitCounter:
-                    # reset gradient
-                    layer.alphas.grad = None
-                    # then turn off requires_grad
-                    layer.alphas.requires_grad = False
-                    # set optimal alpha probability to 1 and the rest to zero
-                    optIdx = probs.argmax().item()
-                    print('Stopped training alphas in layer [{}]: idx:[{}], prob:[{:.3f}]'.format(idx, optIdx, optProb))
-                    layer.alphas.data.fill_(0.0)
-                    layer.alphas.data[optIdx] = 1000.0
-                else:
-                    optimizeLayerIdx.append(idx)
-
-        # update list of learnable alphas
-        model.updateLearnableAlphas()
-
-        return optimizeLayerIdx
+    # stop optimizing alphas of layers whose optimal alpha probability has been over alphaLimit for alphaLimitCounter consecutive steps
+    # frozen layers partition is pinned to their optimal op, in model and in all replications
+    def updateLayersAlphaOptimization(self, model, loggerFuncs=[]):
+        layers = model.layersList
+        # stack all layers alphas in a single matrix, padding has zero probability
+        nOps = [layer.numOfOps() for layer in layers]
+        alphas = full((len(layers), max(nOps)), -float('inf'))
+        for idx, layer in enumerate(layers):
+            alphas[idx, :nOps[idx]] = layer.alphas.detach().cpu()
+        optProb, optIdx = F.softmax(alphas, dim=-1).max(dim=-1)
+        # update layers limit counters, counter is reset once optimal probability drops below limit
+        optimized = tensor([layer.alphas.requires_grad for layer in layers], dtype=uint8)
+        self.optLimitCounters = (self.optLimitCounters + 1) * ((optProb >= self.alphaLimit) & optimized).type(int64)
+        freeze = (self.optLimitCounters >= self.alphaLimitCounter) & optimized
+
+        frozenIdx = freeze.nonzero().view(-1).tolist()
+        for idx in frozenIdx:
+            layers[idx].freezeAlphas(optIdx[idx].item())
+            logMsg = 'Stopped training alphas in layer [{}]: idx:[{}], prob:[{:.3f}]'.format(idx, optIdx[idx].item(), optProb[idx].item())
+            for f in loggerFuncs:
+                f(logMsg)
+
+        if len(frozenIdx) > 0:
+            # update list of learnable alphas
+            model.updateLearnableAlphas()
+            self.logger.addRowToInfoTableByTitle(self.title, ['Frozen layers', [idx for idx, layer in enumerate(layers)
+                                                                                 if layer.frozenOpIdx is not None]])
+
+        return [idx for idx, layer in enumerate(layers) if layer.alphas.requires_grad is True]
 
     @staticmethod
     def splitSamples(nSamples, nCopies):
@@ -154,55 +330,125 @@ class ModelReplicator:
 
         return nSamplesPerCopy
 
+    # draw seed from main process RNG
+    @staticmethod
+    def drawSeed():
+        return randint(2 ** 30, (1,)).item()
+
+    # seeds for nSamples samples
+    def samplesSeeds(self, nSamples):
+        baseSeed = self.drawSeed()
+        return [baseSeed + i for i in range(nSamples)]
+
+    # forward model deterministic prefix once per batch, returns (number of prefix blocks, prefix output)
+    # samples forward starts from prefix output, the deepest prefix output within memory budget is cached
+    # model path has to be set before, prefix path is the same for all samples
+    def prefixForward(self, cModel, input):
+        if (self.prefixCacheBytes <= 0) or (cModel.supportsBlocksForward is False):
+            return 0, input
+
+        nPrefixBlocks = cModel.deterministicPrefix()
+        key = (tuple(input.size()), nPrefixBlocks)
+        # blocks outputs size depends only on input size, forward only up to the depth we cache
+        nBlocks = self.prefixDepths.get(key)
+        if nBlocks is not None:
+            return nBlocks, (cModel.blocksForward(input, 0, nBlocks) if nBlocks > 0 else input)
+
+        # 1st batch of this size, find the deepest prefix output within memory budget
+        nBlocks, prefixOut = 0, input
+        out = input
+        for blockIdx in range(nPrefixBlocks):
+            out = cModel.blocksForward(out, blockIdx, blockIdx + 1)
+            if out.numel() * out.element_size() <= self.prefixCacheBytes:
+                nBlocks, prefixOut = blockIdx + 1, out
+        self.prefixDepths[key] = nBlocks
+
+        return nBlocks, prefixOut
+
+    # sample forward, from prefix output if we have any
+    @staticmethod
+    def sampleForward(cModel, nBlocks, prefixOut):
+        return cModel(prefixOut) if nBlocks == 0 else cModel.suffixForward(prefixOut, nBlocks)
+
+    # seed sample RNG, i.e. sample path is a function of its seed only
+    @staticmethod
+    def seedSample(seed):
+        manual_seed(seed)
+
+    # send nSamples samples to replications, replications run them in background
+    def sendReplications(self, model, input, target, nSamples):
+        nCopies = len(self.workers)
+        # clone input & target to all devices
+        inputPerDevice = {}
+        targetPerDevice = {}
+        for d in self.devices:
+            inputPerDevice[d] = input.to(d)
+            targetPerDevice[d] = target.to(d)
+
+        # split samples between model copies
+        nSamplesPerModel = self.splitSamples(nSamples, nCopies)
+        # each sample has its own seed, therefore results do not depend on the samples split between replications
+        samples = self.samplesSeeds(nSamples)
+
+        # model alphas
+        alphas = [(layer.alphas.data.cpu(), layer.alphas.requires_grad, layer.frozenOpIdx) for layer in model.layersList]
+        # snapshot of alphas the samples are drawn from, model alphas might be updated before the step is collected
+        self.stepAlphas = [layer.alphas.detach().cpu().clone() for layer in model.layersList]
+
+        offset = 0
+        for nCopySamples, worker in zip(nSamplesPerModel, self.workers):
+            d = worker.device
+            worker.send(ReplicaWorker.lossCmd, (alphas, inputPerDevice[d], targetPerDevice[d], samples[offset:offset + nCopySamples]))
+            offset += nCopySamples
+
+    # wait for replications, returns replications results and forward counters
+    def collectReplications(self):
+        results = [worker.getResult() for worker in self.workers]
+
+        # separate cModel forward counters from results
+        counters = []
+        for i, result in enumerate(results):
+            counters.append(result[-1])
+            results[i] = results[i][0]
+
+        return results, counters
+
+    # run nSamples samples on replications, returns replications results and forward counters
+    def runReplications(self, model, input, target, nSamples):
+        self.sendReplications(model, input, target, nSamples)
+        return self.collectReplications()
+
+    # sum replications forward counters to model forward counters
+    @staticmethod
+    def addForwardCounters(model, counters):
+        for replicationCounter in counters:
+            for layerIdx, layer in enumerate(model.layersList):
+                for filterIdx, filter in enumerate(layer.filters):
+                    filterCounter = replicationCounter[layerIdx][filterIdx]
+                    for prev_alpha in range(filter.nOpsCopies()):
+                        for curr_alpha in range(filter.numOfOps()):
+                            filter.opsForwardCounters[prev_alpha][curr_alpha] += filterCounter[prev_alpha][curr_alpha]
+
+    # step is split to submitStep() & collectStep(), in order to let main process work while replications run the step
+    def submitStep(self, model, input, target):
+        self.sendReplications(model, input, target, self.nSamples)
+
+    def collectStep(self, model):
+        results, counters = self.collectReplications()
+        res = self.processResults(model, results, alphas=self.stepAlphas)
+
+        # reset model layers forward counters
+        model.resetForwardCounters()
+        # sum forward counters
+        self.addForwardCounters(model, counters)
+
+        return res
+
     def loss(self, model, input, target):
-        nCopies = len(self.replications)
+        nCopies = len(self.workers)
         if nCopies > 0:
-            # clone input & target to all GPUs
-            inputPerGPU = {}
-            targetPerGPU = {}
-            for id in self.gpuIDs:
-                inputPerGPU[id] = input if (id == input.device.index) else input.clone().cuda(id)
-                targetPerGPU[id] = target if (id == target.device.index) else target.clone().cuda(id)
-
-            # # update model layers alphas optimization status
-            # optimizeLayerIdx = self.updateLayersAlphaOptimization(model)
-            # # split layers indices between models
-            # layersIndicesPerModel = array_split(optimizeLayerIdx, nCopies)
-
-            # split samples between model copies
-            nSamplesPerModel = self.splitSamples(self.nSamples, nCopies)
-
-            # copy model alphas
-            for cModel, _ in self.replications:
-                for cLayer, mLayer in zip(cModel.layersList, model.layersList):
-                    cLayer.alphas.data.copy_(mLayer.alphas.data)
-                    cLayer.alphas.requires_grad = mLayer.alphas.requires_grad
-
-            args = self.buildArgs(inputPerGPU, targetPerGPU, nSamplesPerModel)
-
-            with Pool(processes=nCopies, maxtasksperchild=1) as pool:
-                results = pool.map(self.replicationFunc, args)
-
-            # separate cModel forward counters from results
-            counters = []
-            for i, result in enumerate(results):
-                counters.append(result[-1])
-                results[i] = results[i][0]
-
-            res = self.processResults(model, results)
-
-            # reset model layers forward counters
-            model.resetForwardCounters()
-            # sum forward counters
-            for replicationCounter in counters:
-                for layerIdx, layer in enumerate(model.layersList):
-                    for filterIdx, filter in enumerate(layer.filters):
-                        filterCounter = replicationCounter[layerIdx][filterIdx]
-                        for prev_alpha in range(filter.nOpsCopies()):
-                            for curr_alpha in range(filter.numOfOps()):
-                                filter.opsForwardCounters[prev_alpha][curr_alpha] += filterCounter[prev_alpha][curr_alpha]
-
-            return res
+            self.submitStep(model, input, target)
+            return self.collectStep(model)
 
 # # quantize all replications ops
 # def quantize(self):
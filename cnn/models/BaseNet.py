@@ -6,6 +6,8 @@ from numpy import argmax
 from torch.nn import Module, Conv2d
 from torch.nn import functional as F
 from torch import load as loadModel
+from torch import Tensor, tensor, int32
+from torch.cuda import is_available
 
 from cnn.MixedFilter import MixedConvBNWithReLU as MixedConvWithReLU
 from cnn.uniq_loss import UniqLoss
@@ -65,6 +67,8 @@ class BaseNet(Module):
     # init bitwidth of input to model
     modelInputBitwidth = 8
     modelInputnFeatureMaps = 3
+    # models that forward self.layers sequentially support forward from a given block, i.e. blocksForward() & suffixForward()
+    supportsBlocksForward = False
 
     # counts the entire model bops in discrete mode
     def countBopsDiscrete(self):
@@ -119,7 +123,6 @@ class BaseNet(Module):
         self.stats.addBaselineBopsData(args, baselineBops)
         # init criterion
         self._criterion = UniqLoss(args)
-        self._criterion = self._criterion.cuda()
 
         # init hooks handlers list
         self.hooksList = []
@@ -150,6 +153,31 @@ class BaseNet(Module):
     def forward(self, x):
         raise NotImplementedError('subclasses must override forward()!')
 
+    # forward model blocks [start, end)
+    def blocksForward(self, x, start, end):
+        raise NotImplementedError('subclasses that support blocks forward must override blocksForward()!')
+
+    # forward from block start to model output
+    def suffixForward(self, x, start):
+        raise NotImplementedError('subclasses that support blocks forward must override suffixForward()!')
+
+    # number of model blocks at the beginning of the model whose path is deterministic, i.e. their layers partition does not depend on sample
+    def deterministicPrefix(self):
+        nBlocks = 0
+        for block in self.layers:
+            if not all(layer.isDeterministic() for layer in block.getLayers()):
+                break
+            nBlocks += 1
+
+        return nBlocks
+
+    # add n forwards to blocks [0, nBlocks) current path forward counters, i.e. forwards we saved by prefix cache
+    def addPrefixForwardCounters(self, nBlocks, n):
+        for block in self.layers[:nBlocks]:
+            for layer in block.getLayers():
+                for filter in layer.filters:
+                    filter.opsForwardCounters[filter.prev_alpha_idx][filter.curr_alpha_idx] += n
+
     @abstractmethod
     def switch_stage(self, logger=None):
         raise NotImplementedError('subclasses must override switch_stage()!')
@@ -190,7 +218,8 @@ class BaseNet(Module):
         for f in loggerFuncs:
             f('Updated layer_basis according to bitwidth (weight_max_int)')
 
-    def loadPreTrained(self, path, logger, gpu):
+    # statistics_queue is used to calibrate activations statistics in case checkpoint doesn't include updated statistics
+    def loadPreTrained(self, path, logger, gpu, statistics_queue=None):
         # init bool flag whether we loaded ops in the same layer with equal or different weights
         loadOpsWithDifferentWeights = False
         loggerRows = []
@@ -198,8 +227,9 @@ class BaseNet(Module):
         if path is not None:
             if exists(path):
                 # load checkpoint
-                checkpoint = loadModel(path, map_location=lambda storage, loc: storage.cuda(gpu))
-                assert (checkpoint['updated_statistics'] is True)
+                checkpoint = loadModel(path, map_location=lambda storage, loc: storage.cuda(gpu) if is_available() else storage)
+                updatedStatistics = checkpoint.get('updated_statistics', False) is True
+                assert (updatedStatistics or (statistics_queue is not None))
                 chckpntStateDict = checkpoint['state_dict']
                 # load model state dict keys
                 modelStateDictKeys = set(self.state_dict().keys())
@@ -225,7 +255,10 @@ class BaseNet(Module):
                     # add info rows about checkpoint
                     loggerRows.append(['Path', '{}'.format(path)])
                     loggerRows.append(['Validation accuracy', '{:.5f}'.format(checkpoint['best_prec1'])])
-                    loggerRows.append(['checkpoint[updated_statistics]', checkpoint['updated_statistics']])
+                    loggerRows.append(['checkpoint[updated_statistics]', updatedStatistics])
+                    # calibrate activations statistics, checkpoint doesn't include them
+                    if not updatedStatistics:
+                        self.calcStatistics(statistics_queue, loggerFuncs=[lambda msg: loggerRows.append(['Statistics calibration', msg])])
                     # check if model includes stats
                     modelIncludesStats = False
                     for key in chckpntStateDict.keys():
@@ -398,6 +431,15 @@ class BaseNet(Module):
     def getCurrentFiltersPartition(self):
         return [layer.getCurrentFiltersPartition() for layer in self.layersList]
 
+    # converts partition layers lists to int tensors, i.e. setFiltersByPartition() format
+    @staticmethod
+    def partitionTensors(partition):
+        return [p if isinstance(p, Tensor) else tensor(p, dtype=int32) for p in partition]
+
+    # current partition as list of int tensors, can be set back by setFiltersByPartition()
+    def getCurrentPartitionTensors(self):
+        return self.partitionTensors(self.getCurrentFiltersPartition())
+
     # partition is list of int tensors
     # given a partition, set model filters accordingly
     def setFiltersByPartition(self, partition, loggerFuncs=[]):
@@ -408,6 +450,21 @@ class BaseNet(Module):
         for f in loggerFuncs:
             f(logMsg)
 
+    # calibrates ActQuantBuffers statistics of all ops in a single pass over statistics_queue
+    # nBatches & ratio allow subsampled (cheaper) calibration
+    def calcStatistics(self, statistics_queue, nBatches=None, ratio=1.0, loggerFuncs=[]):
+        from cnn.calibration import ActStatisticsCalibration
+
+        calibration = ActStatisticsCalibration(self)
+        calibration.calibrate(statistics_queue, nBatches=nBatches, ratio=ratio, loggerFuncs=loggerFuncs)
+
+    # re-estimates BN running statistics of partition selected ops, by n_batches forward passes
+    # partition is a list of IntTensor per layer, if None we use model current partition
+    def recalibrateBN(self, partition, data_queue, n_batches, loggerFuncs=[]):
+        from cnn.calibration import recalibrate_bn
+
+        recalibrate_bn(self, partition, data_queue, n_batches, loggerFuncs=loggerFuncs)
+
     def isQuantized(self):
         for layerIdx, layer in enumerate(self.layersList):
             assert (layer.quantized is True)
@@ -476,6 +533,14 @@ class BaseNet(Module):
             layer = self.layersList[self.nLayersQuantCompleted]
             layer.turnOnNoise(self.nLayersQuantCompleted)
 
+    # seeded noise mode, each op gets its own seed derived from seed, None turns seeded mode off
+    def setNoiseSeed(self, seed):
+        opIdx = 0
+        for layer in self.layersList:
+            for op in layer.opsList():
+                op.quantize.set_noise_seed(None if seed is None else seed + opIdx)
+                opIdx += 1
+
     def resetForwardCounters(self):
         for layer in self.layersList:
             for filter in layer.filters:
@@ -1,6 +1,6 @@
 from collections import OrderedDict
 
-from torch.nn import Sequential, Conv2d, BatchNorm2d, ReLU, Module, AvgPool2d, Linear
+from torch.nn import Sequential, Conv2d, BatchNorm2d, ReLU, Module, AdaptiveAvgPool2d, Linear
 
 from .ResNet import ResNet, BasicBlock
 from cnn.MixedFilter import MixedConvWithReLU
@@ -66,8 +66,8 @@ class ModifiedResNet(ResNet):
             setattr(self, 'block{}'.format(i), l)
             i += 1
 
-        self.avgpool = AvgPool2d(8)
-        self.fc = Linear(64, 10).cuda()
+        self.avgpool = AdaptiveAvgPool2d(1)
+        self.fc = Linear(64, 10)
 
     def loadUNIQPreTrained(self, chckpntDict):
         def iterateKey(chckpntDict, map, key1, key2, dstKey):
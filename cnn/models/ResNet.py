@@ -1,6 +1,6 @@
 from collections import OrderedDict
 
-from torch.nn import AvgPool2d, Linear, ModuleList
+from torch.nn import AdaptiveAvgPool2d, Linear, ModuleList
 
 from cnn.MixedFilter import Block
 from cnn.MixedFilter import MixedConvBNWithReLU as MixedConvWithReLU
@@ -88,6 +88,8 @@ class BasicBlock(Block):
 
 
 class ResNet(BaseNet):
+    supportsBlocksForward = True
+
     def __init__(self, args):
         super(ResNet, self).__init__(args, initLayersParams=(args.bitwidth, args.kernel, args.nClasses))
 
@@ -131,9 +133,9 @@ class ResNet(BaseNet):
             # add layer to layers list
             layers.append(l)
 
-        self.avgpool = AvgPool2d(8)
+        self.avgpool = AdaptiveAvgPool2d(1)
         # self.fc = MixedLinear(bitwidths, 64, 10)
-        self.fc = Linear(64, nClasses).cuda()
+        self.fc = Linear(64, nClasses)
 
         # # turn off gradients in Linear layer
         # for p in self.fc.parameters():
@@ -142,10 +144,18 @@ class ResNet(BaseNet):
         return layers
 
     def forward(self, x):
+        return self.suffixForward(x, 0)
+
+    def blocksForward(self, x, start, end):
         out = x
-        for layer in self.layers:
+        for layer in self.layers[start:end]:
             out = layer(out)
 
+        return out
+
+    def suffixForward(self, x, start):
+        out = self.blocksForward(x, start, len(self.layers))
+
         out = self.avgpool(out)
         out = out.view(out.size(0), -1)
         out = self.fc(out)
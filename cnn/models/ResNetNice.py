@@ -1,7 +1,7 @@
 from collections import OrderedDict
 
 from torch import nn
-from torch.nn import AvgPool2d, Linear, ModuleList
+from torch.nn import AdaptiveAvgPool2d, Linear, ModuleList
 
 from cnn.MixedFilter import MixedConv, MixedConvWithReLU, Block
 from cnn.MixedLayer import MixedLayer
@@ -105,6 +105,8 @@ class BasicBlock(Block):
 
 
 class ResNet(BaseNet):
+    supportsBlocksForward = True
+
     def __init__(self, args):
         self.dataset = args.dataset
         super(ResNet, self).__init__(args, initLayersParams=(args.bitwidth, args.kernel, args.nClasses))
@@ -172,20 +174,27 @@ class ResNet(BaseNet):
             # # update previous layer
             # prevLayer = l.outputLayer()
 
-        self.avgpool = AvgPool2d(7 if self.dataset == 'imagenet' else 4)
+        self.avgpool = AdaptiveAvgPool2d(1)
         # self.fc = MixedLinear(bitwidths, 64, 10)
-        self.fc = Linear(512, nClasses).cuda()
+        self.fc = Linear(512, nClasses)
 
         return layers
 
     def forward(self, x):
-        out = self.layers[0](x)
-        # print(out.shape)
-        out = self.maxpool(out)
-        # print(out.shape)
-        for layer in self.layers[1:]:
-            out = layer(out)
+        return self.suffixForward(x, 0)
+
+    def blocksForward(self, x, start, end):
+        out = x
+        for idx in range(start, min(end, len(self.layers))):
+            out = self.layers[idx](out)
             # print(out.shape)
+            if idx == 0:
+                out = self.maxpool(out)
+
+        return out
+
+    def suffixForward(self, x, start):
+        out = self.blocksForward(x, start, len(self.layers))
 
         out = self.avgpool(out)
         out = out.view(out.size(0), -1)
@@ -5,12 +5,14 @@ from torch.nn import Sequential, Conv2d, Linear
 from cnn.MixedFilter import MixedConvBNWithReLU as MixedConvWithReLU
 from cnn.models.BaseNet import BaseNet
 
-from UNIQ.actquant import ActQuant
+from UNIQ.actquant import ActQuant, set_act_lut
 
 
 class TinyNet(BaseNet):
     def __init__(self, args):
         super(TinyNet, self).__init__(args, initLayersParams=(args.bitwidth, args.kernel))
+        # UNIQ activations quantization mode
+        set_act_lut(self, args.act_lut)
 
         # for layer in self.layersList:
         #     # turn on noise
@@ -34,7 +36,7 @@ class TinyNet(BaseNet):
         self.features = Sequential(*layers)
 
         # self.fc = MixedLinear(bitwidths, 512, 10)
-        self.fc = Linear(512, 10).cuda()
+        self.fc = Linear(512, 10)
 
         # self.features = nn.Sequential(
         #     nn.Conv2d(3, 16, 3, 2, 1, bias=False), nn.BatchNorm2d(16), nn.ReLU(inplace=True),
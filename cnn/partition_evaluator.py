@@ -0,0 +1,80 @@
+from time import time
+
+from torch import no_grad
+from torch.nn import BatchNorm2d
+from torch.nn import functional as F
+
+from cnn.calibration import recalibrate_bn, partitionBatchNorms
+
+
+# BN running statistics snapshot of list of BN modules
+class BatchNormSnapshot:
+    keys = ['running_mean', 'running_var', 'num_batches_tracked']
+
+    def __init__(self, bnModules):
+        self.bnModules = bnModules
+        self.buffers = [[getattr(bn, k).clone() for k in self.keys] for bn in bnModules]
+
+    def restore(self):
+        for bn, buffers in zip(self.bnModules, self.buffers):
+            for k, v in zip(self.keys, buffers):
+                getattr(bn, k).copy_(v)
+
+
+# evaluates list of partitions in a single pass over validation set
+# BN statistics are recalibrated per partition and kept as partition snapshot, since partitions share ops
+# each validation batch is loaded once and applied on all partitions
+class PartitionEvaluator:
+    def __init__(self, model, statistics_queue, valid_queue, nBatchesBN):
+        self.model = model
+        self.statistics_queue = statistics_queue
+        self.valid_queue = valid_queue
+        # number of batches for BN recalibration
+        self.nBatchesBN = nBatchesBN
+
+    # returns list of dict(accuracy, loss, bops, bopsRatio) per partition
+    def evaluate(self, partitions, loggerFuncs=[]):
+        model = self.model
+        startTime = time()
+        # save model state
+        currentPartition = model.getCurrentPartitionTensors()
+        bnSnapshot = BatchNormSnapshot([m for m in model.modules() if isinstance(m, BatchNorm2d)])
+        training = model.training
+
+        # recalibrate BN per partition, recalibrate_bn() quantizes unstaged layers by itself
+        snapshots, results = [], []
+        for partition in partitions:
+            recalibrate_bn(model, partition, self.statistics_queue, self.nBatchesBN)
+            snapshots.append(BatchNormSnapshot(partitionBatchNorms(model)))
+            results.append(dict(accuracy=0.0, loss=0.0, bops=model.countBops(), bopsRatio=model.calcBopsRatio()))
+
+        model.quantizeUnstagedLayers()
+        model.eval()
+        device = model.layersList[0].alphas.device
+        nSamples = 0
+        with no_grad():
+            for input, target in self.valid_queue:
+                input, target = input.to(device, non_blocking=True), target.to(device, non_blocking=True)
+                nSamples += input.size(0)
+                for partition, snapshot, result in zip(partitions, snapshots, results):
+                    model.setFiltersByPartition(partition)
+                    snapshot.restore()
+                    logits = model(input)
+                    result['loss'] += F.cross_entropy(logits, target, reduction='sum').item()
+                    result['accuracy'] += logits.argmax(dim=1).eq(target).sum().item()
+
+        for result in results:
+            result['loss'] /= nSamples
+            result['accuracy'] *= (100.0 / nSamples)
+
+        # restore model state
+        model.unQuantizeUnstagedLayers()
+        model.setFiltersByPartition(currentPartition)
+        bnSnapshot.restore()
+        model.train(training)
+
+        logMsg = 'Evaluated [{}] partitions on [{}] samples, time:[{:.3f}]'.format(len(partitions), nSamples, time() - startTime)
+        for f in loggerFuncs:
+            f(logMsg)
+
+        return results
@@ -28,6 +28,7 @@ class Statistics:
     lossAvgKey = 'loss_avg'
     crossEntropyLossAvgKey = 'cross_entropy_loss_avg'
     bopsLossAvgKey = 'bops_loss_avg'
+    samplesCountKey = 'samples_count'
     bopsKey = 'bops'
 
     # set plot points style
@@ -53,7 +54,8 @@ class Statistics:
         self.containers = {
             self.entropyKey: [[] for _ in range(nLayers)],
             self.lossVarianceKey: [[]], self.alphaDistributionKey: [[[] for _ in range(layer.numOfOps())] for layer in layersList],
-            self.lossAvgKey: [[]], self.crossEntropyLossAvgKey: [[]], self.bopsLossAvgKey: [[]]
+            self.lossAvgKey: [[]], self.crossEntropyLossAvgKey: [[]], self.bopsLossAvgKey: [[]],
+            self.samplesCountKey: [[]]
         }
         # map each list we plot for all layers on single plot to filename
         self.plotAllLayersKeys = [self.entropyKey, self.lossAvgKey, self.crossEntropyLossAvgKey, self.bopsLossAvgKey, self.lossVarianceKey]
@@ -116,7 +116,7 @@ def train(train_queue, model, criterion, optimizer):
 
     for step, (input, target) in enumerate(train_queue):
         input = Variable(input).cuda()
-        target = Variable(target).cuda(async=True)
+        target = Variable(target).cuda(non_blocking=True)
 
         optimizer.zero_grad()
         logits, logits_aux = model(input)
@@ -148,7 +148,7 @@ def infer(valid_queue, model, criterion):
 
     for step, (input, target) in enumerate(valid_queue):
         input = Variable(input, volatile=True).cuda()
-        target = Variable(target, volatile=True).cuda(async=True)
+        target = Variable(target, volatile=True).cuda(non_blocking=True)
 
         logits, _ = model(input)
         loss = criterion(logits, target)
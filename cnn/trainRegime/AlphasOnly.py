@@ -29,7 +29,7 @@ class AlphasOnly(TrainRegime):
             # set loggers dictionary
             loggersDict = dict(train=trainLogger, main=self.logger)
             # train alphas
-            self.trainAlphas(self.search_queue, self.model, self.architect, epoch, loggersDict)
+            self.trainAlphas(self.search_queue, self.architect, epoch, loggersDict, nEpochs)
             # validation on current optimal model
             valid_acc = self.infer(epoch, loggersDict)
 
@@ -4,3 +4,5 @@ from .alphasWeightsLoop import AlphasWeightsLoop as alphas_weights_loop
 from .AlphasOnly import AlphasOnly as alphas_only
 from .RandomSearch import RandomSearch as random_search
 from .optimalModel import OptimalModel as optimal_model
+from .gradVariance import GradVariance as grad_variance
+from .supernet import Supernet as supernet
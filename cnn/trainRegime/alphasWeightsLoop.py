@@ -10,6 +10,7 @@ from torch import load as loadCheckpoint
 
 from .regime import TrainRegime, save_checkpoint
 from cnn.architect import Architect
+from cnn.partition_evaluator import PartitionEvaluator
 from cnn.HtmlLogger import HtmlLogger
 from cnn.managers.aws import AWS_Manager
 import cnn.gradEstimators as gradEstimators
@@ -81,6 +82,21 @@ class AlphasWeightsLoop(TrainRegime):
         replicator = replicatorClass(self.model, self.modelClass, args, logger)
         # init architect
         self.architect = Architect(replicator, args)
+        # init evaluator of epoch jobs partitions
+        self.partitionEvaluator = PartitionEvaluator(self.model, self.statistics_queue, self.valid_queue, args.bn_batches) \
+            if args.eval_partitions else None
+
+    # evaluate epoch jobs partitions locally, in a single pass over validation set
+    def __evaluateEpochJobs(self, epochJobsList, epoch, loggersDict):
+        trainLogger = loggersDict.get('train')
+        loggerFuncs = [lambda msg: trainLogger.addInfoToDataTable(msg)] if trainLogger else []
+        results = self.partitionEvaluator.evaluate([job.partition for job in epochJobsList], loggerFuncs=loggerFuncs)
+
+        rows = [['Job', self.validAccKey, self.validLossKey, self.validBopsRatioKey]]
+        for job, result in zip(epochJobsList, results):
+            rows.append([job.jsonFileName, self.formats[self.validAccKey].format(result['accuracy']),
+                         self.formats[self.validLossKey].format(result['loss']), self.formats[self.validBopsRatioKey].format(result['bopsRatio'])])
+        self.logger.addInfoTable('Epoch:[{}] - Partitions evaluation'.format(epoch), rows)
 
     # run on validation set and add validation data to main data row
     def __inferWithData(self, setModelPathFunc, epoch, nEpochs, loggersDict, dataRow):
@@ -103,6 +119,7 @@ class AlphasWeightsLoop(TrainRegime):
         jsonFileName = '{}-{}-{}.json'.format(args.time, nEpoch, id)
         # create training job instance
         trainingJob = TrainingJob(dict(bopsRatio=model.calcBopsRatio(), bops=model.countBops(), epochID=nEpoch, ID=id,
+                                       partition=model.getCurrentPartitionTensors(),
                                        bitwidthInfoTable=self.createBitwidthsTable(model, self.logger, self.bitwidthKey),
                                        jsonFileName=jsonFileName, jsonPath='{}/{}'.format(self.jobsPath, jsonFileName)))
 
@@ -198,7 +215,7 @@ class AlphasWeightsLoop(TrainRegime):
             loggersDict = dict(train=trainLogger)
 
             # train alphas
-            dataRow = self.trainAlphas(self.search_queue[epoch % args.alphas_data_parts], self.architect, epoch, loggersDict)
+            dataRow = self.trainAlphas(self.search_queue[epoch % args.alphas_data_parts], self.architect, epoch, loggersDict, nEpochs)
 
             # create epoch jobs
             epochJobsList = self.__createEpochJobs(epoch)
@@ -245,6 +262,10 @@ class AlphasWeightsLoop(TrainRegime):
             # add data to main logger table
             logger.addDataRow(dataRow)
 
+            # evaluate epoch jobs partitions on trained weights
+            if self.partitionEvaluator:
+                self.__evaluateEpochJobs(epochJobsList, epoch, loggersDict)
+
             # add data rows for epoch JSONs
             self.__addEpochJSONsDataRows(epochJobsList, epoch, nEpochs)
 
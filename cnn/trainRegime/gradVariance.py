@@ -0,0 +1,60 @@
+from torch import cat, stack
+
+from .regime import TrainRegime
+import cnn.gradEstimators as gradEstimators
+
+
+# alphas gradient estimators variance harness
+# estimates each gradient estimator variance on a fixed batch & fixed alphas, per number of samples
+class GradVariance(TrainRegime):
+    colsVariance = ['nSamples', 'Variance', 'Variance x nSamples', 'Grad norm']
+
+    def __init__(self, args, logger):
+        super(GradVariance, self).__init__(args, logger)
+        # harness sets estimators number of samples
+        for name in args.variance_estimators:
+            assert (gradEstimators.__dict__[name].supportsSetNSamples is True), '[{}] does not support setting nSamples'.format(name)
+
+    # returns model alphas gradient as a single vector
+    @staticmethod
+    def alphasGrad(model):
+        return cat([layer.alphas.grad.detach().cpu().view(-1) for layer in model.layersList])
+
+    # estimates replicator gradient variance, i.e. trace of gradient covariance, over nReps steps on the same batch
+    @staticmethod
+    def estimatorVariance(model, replicator, input, target, nSamples, nReps):
+        replicator.setNSamples(nSamples)
+        grads = []
+        for _ in range(nReps):
+            replicator.loss(model, input, target)
+            grads.append(GradVariance.alphasGrad(model))
+
+        grads = stack(grads)
+        variance = grads.var(dim=0).sum().item()
+
+        return variance, grads.mean(dim=0).norm().item()
+
+    def train(self):
+        args = self.args
+        model = self.model
+        # fixed batch for all estimators, from 1st search part
+        input, target = next(iter(self.search_queue[0]))
+        input, target = input.cuda(), target.cuda()
+
+        summary = [['Estimator'] + ['nSamples:[{}]'.format(n) for n in args.variance_samples]]
+        for name in args.variance_estimators:
+            replicator = gradEstimators.__dict__[name](model, self.modelClass, args, self.logger)
+            replicator.updateModelWeights(model)
+
+            rows = [self.colsVariance]
+            summaryRow = [name]
+            for nSamples in args.variance_samples:
+                variance, gradNorm = self.estimatorVariance(model, replicator, input, target, nSamples, args.variance_reps)
+                rows.append([nSamples, '{:.5f}'.format(variance), '{:.5f}'.format(variance * nSamples), '{:.5f}'.format(gradNorm)])
+                summaryRow.append('{:.5f}'.format(variance))
+
+            replicator.stopWorkers()
+            self.logger.addInfoTable('Gradient variance - [{}]'.format(name), rows)
+            summary.append(summaryRow)
+
+        self.logger.addInfoTable('Gradient variance, [{}] steps per value'.format(args.variance_reps), summary)
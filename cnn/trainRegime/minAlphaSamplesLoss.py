@@ -16,11 +16,8 @@ class Replicator(ModelReplicator):
     def getModel(self, args):
         return args[0]
 
-    def buildArgs(self, inputPerGPU, targetPerGPU, layersIndicesPerModel):
-        args = ((cModel, inputPerGPU[gpu], targetPerGPU[gpu], layersIndices)
-                for layersIndices, (cModel, gpu) in zip(layersIndicesPerModel, self.replications))
-
-        return args
+    def buildArgs(self, cModel, input, target, layersIndices, device):
+        return cModel, input, target, layersIndices
 
     def lossPerReplication(self, args):
         cModel, input, target, layersIndices = args
@@ -65,7 +62,7 @@ class Replicator(ModelReplicator):
 
         return totalLoss.cuda(), alphasLoss
 
-    def processResults(self, model, results):
+    def processResults(self, model, results, alphas=None):
         # init list of model alphas loss average
         alphasLoss = [[[] for _ in range(layer.numOfOps())] for layer in model.layersList]
         # init total loss
@@ -102,11 +99,11 @@ class MinimalAlphaSamplesLoss(TrainRegime):
         # init list of model alphas loss average
         alphasLoss = [[[] for _ in range(layer.numOfOps())] for layer in model.layersList]
 
-        for step, (input, target) in enumerate(self.search_queue):
+        for step, (input, target) in enumerate(self.prefetch(self.search_queue)):
             startTime = time()
 
             input = Variable(input, requires_grad=False).cuda()
-            target = Variable(target, requires_grad=False).cuda(async=True)
+            target = Variable(target, requires_grad=False).cuda(non_blocking=True)
 
             # model.trainMode()
             res = self.calcBatchAlphaAvgLoss(input, target)
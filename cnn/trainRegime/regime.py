@@ -11,7 +11,7 @@ from torch.optim import SGD
 from torch.optim.lr_scheduler import ReduceLROnPlateau
 
 from cnn.HtmlLogger import HtmlLogger
-from cnn.utils import accuracy, AvgrageMeter, load_data, save_checkpoint
+from cnn.utils import accuracy, AvgrageMeter, load_data, save_checkpoint, DevicePrefetcher, FixedBatchCache, wilsonInterval
 from cnn.utils import sendDataEmail, models, logParameters
 
 
@@ -57,7 +57,7 @@ class TrainRegime:
         modelClass = models.__dict__[args.model]
         # init model
         model = modelClass(args)
-        model = model.cuda()
+        model = model.to(args.device)
         # create DataParallel model instance
         self.modelParallel = model
         # self.modelParallel = DataParallel(model, args.gpu)
@@ -68,7 +68,7 @@ class TrainRegime:
             assert (isinstance(args.partition, list))
             # convert partition to tensors
             for i, p in enumerate(args.partition):
-                args.partition[i] = tensor(p, dtype=int32).cuda()
+                args.partition[i] = tensor(p, dtype=int32, device=args.device)
             # set filters by partition
             model.setFiltersByPartition(args.partition, loggerFuncs=[lambda msg: logger.addInfoTable('Partition', [[msg]])])
             # set args.bops
@@ -76,9 +76,16 @@ class TrainRegime:
 
         # load data
         self.train_queue, self.search_queue, self.valid_queue, self.statistics_queue = load_data(args)
+        # materialize search parts batches once
+        if args.alphas_cache != 'none':
+            cachePath = lambda i: '{}/alphas_cache_{}'.format(args.save, i) if args.alphas_cache == 'disk' else None
+            self.search_queue = [FixedBatchCache(queue, args.seed + i, cachePath(i)) for i, queue in enumerate(self.search_queue)]
         # load pre-trained full-precision model
-        args.loadedOpsWithDiffWeights = model.loadPreTrained(args.pre_trained, logger, args.gpu[0])
+        args.loadedOpsWithDiffWeights = model.loadPreTrained(args.pre_trained, logger, args.gpu[0], self.statistics_queue)
         # args.loadedOpsWithDiffWeights = model.loadUniformPreTrained(args, logger)
+        # set seeded noise mode
+        if args.noise_seed is not None:
+            model.setNoiseSeed(args.noise_seed)
 
         # log parameters
         logParameters(logger, args, model)
@@ -104,7 +111,7 @@ class TrainRegime:
         self.trainFolderPath = '{}/{}'.format(args.save, args.trainFolder)
 
         # init cross entropy loss
-        self.cross_entropy = CrossEntropyLoss().cuda()
+        self.cross_entropy = CrossEntropyLoss().to(args.device)
 
         # init checkpoints dictionary
         self.optimalModelCheckpoint = (None, None)
@@ -253,17 +260,17 @@ class TrainRegime:
             # add learning rate
             trainData[self.lrKey] = self.formats[self.lrKey].format(optimizer.param_groups[0]['lr'])
 
-            # validation
-            valid_acc, valid_loss, validData = self.infer(model.setFiltersByAlphas, epoch, loggersDict)
+            # validation, in fast validation mode stop only if model is clearly below optimum, i.e. full pass otherwise
+            valid_acc, valid_loss, validData = self.infer(model.setFiltersByAlphas, epoch, loggersDict, accThreshold=best_prec1, narrowExit=False)
             # merge trainData with validData
             for k, v in validData.items():
                 trainData[k] = v
 
-            # update scheduler
-            scheduler.step(valid_loss)
+            # update scheduler, partial loss is not comparable, early exit epoch is below optimum, i.e. counts as bad epoch
+            scheduler.step(float('inf') if self.inferEarlyExit else valid_loss)
 
-            # update best precision only after switching stage is complete
-            is_best = valid_acc > best_prec1
+            # update best precision only after switching stage is complete, partial validation is never best
+            is_best = (not self.inferEarlyExit) and (valid_acc > best_prec1)
             if is_best:
                 best_prec1 = valid_acc
                 best_valid_loss = valid_loss
@@ -343,7 +350,61 @@ class TrainRegime:
         # create InfoTable
         return logger.createInfoTable(bitwidthKey, table)
 
-    def trainAlphas(self, search_queue, architect, nEpoch, loggers):
+    # wraps queue by DevicePrefetcher, i.e. next batch is copied to GPU while current step runs
+    def prefetch(self, queue):
+        return DevicePrefetcher(queue, device=self.args.device) if self.args.device_prefetch else queue
+
+    # alphas training steps, yields (step, batch size, step start time, step losses) after each step alphas update
+    def alphasSteps(self, search_queue, architect):
+        if self.args.pipeline_alphas and architect.modelReplicator.supportsPipeline:
+            return self.pipelinedAlphasSteps(search_queue, architect)
+
+        return self.serialAlphasSteps(search_queue, architect)
+
+    def serialAlphasSteps(self, search_queue, architect):
+        model = self.model
+        for step, (input, target) in enumerate(self.prefetch(search_queue)):
+            startTime = time()
+            n = input.size(0)
+
+            input = Variable(input, requires_grad=False).to(self.args.device)
+            target = Variable(target, requires_grad=False).to(self.args.device, non_blocking=True)
+
+            yield step, n, startTime, architect.step(model, input, target)
+
+    # replications run step k+1 while main process updates alphas by step k and logs it
+    # next batch is loaded while replications run current step, step k+1 samples are drawn from alphas before step k update
+    def pipelinedAlphasSteps(self, search_queue, architect):
+        model = self.model
+        nBatches = len(search_queue)
+        batches = iter(self.prefetch(search_queue))
+
+        def loadBatch():
+            input, target = next(batches)
+            return input.size(0), Variable(input, requires_grad=False).to(self.args.device), Variable(target, requires_grad=False).to(self.args.device, non_blocking=True)
+
+        startTime = time()
+        n, input, target = loadBatch()
+        # stop optimizing converged layers alphas before 1st step, like Architect.step()
+        architect.modelReplicator.updateLayersAlphaOptimization(model)
+        architect.submit(model, input, target)
+        for step in range(nBatches):
+            # prefetch next batch while replications run current step
+            nextBatch = loadBatch() if (step + 1) < nBatches else None
+            losses = architect.collect(model)
+            # submit next step before bookkeeping
+            if nextBatch is not None:
+                architect.submit(model, nextBatch[1], nextBatch[2])
+            architect.update(model)
+
+            yield step, n, startTime, losses
+
+            if nextBatch is not None:
+                startTime = time()
+                n = nextBatch[0]
+
+    # nEpochs is the number of alphas training epochs, for estimators which anneal over epochs
+    def trainAlphas(self, search_queue, architect, nEpoch, loggers, nEpochs):
         print('*** trainAlphas ***')
         loss_container = AvgrageMeter()
         crossEntropy_container = AvgrageMeter()
@@ -360,6 +421,8 @@ class TrainRegime:
             loggerFunc = [lambda msg: trainLogger.addInfoToDataTable(msg),
                           lambda msg: modelReplicator.logWeightsUpdateMsg(msg, nEpoch)]
 
+        # let gradient estimator know about new epoch
+        modelReplicator.epochStart(nEpoch, nEpochs, loggerFuncs=loggerFunc[:1])
         # update model replications weights
         modelReplicator.updateModelWeights(model, loggerFuncs=loggerFunc)
 
@@ -377,16 +440,9 @@ class TrainRegime:
         def forwardCountersFunc(rows):
             createInfoTable(dataRow, self.forwardCountersKey, trainLogger, rows)
 
-        for step, (input, target) in enumerate(search_queue):
-            startTime = time()
-            n = input.size(0)
+        for step, n, startTime, (loss, crossEntropyLoss, bopsLoss) in self.alphasSteps(search_queue, architect):
             dataRow = {}
 
-            input = Variable(input, requires_grad=False).cuda()
-            target = Variable(target, requires_grad=False).cuda(async=True)
-
-            loss, crossEntropyLoss, bopsLoss = architect.step(model, input, target)
-
             # add alphas data to statistics
             model.stats.addBatchData(model, nEpoch, step)
 
@@ -443,6 +499,19 @@ class TrainRegime:
 
         return summaryData
 
+    # weights training step forward & backward, returns logits & loss
+    def weightsForwardBackward(self, input, target):
+        # choose model partition if we haven't set partition to model
+        if self.args.partition is None:
+            self.model.choosePathByAlphas()
+        logits = self.modelParallel(input)
+        # calc loss
+        loss = self.cross_entropy(logits, target)
+        # back propagate
+        loss.backward()
+
+        return logits, loss
+
     def trainWeights(self, optimizer, epoch, loggers):
         print('*** trainWeights() ***')
         loss_container = AvgrageMeter()
@@ -450,7 +519,6 @@ class TrainRegime:
 
         model = self.model
         modelParallel = self.modelParallel
-        crit = self.cross_entropy
         train_queue = self.train_queue
         grad_clip = self.args.grad_clip
 
@@ -469,23 +537,16 @@ class TrainRegime:
         # set pre & post forward hooks
         model.setWeightsTrainingHooks()
 
-        for step, (input, target) in enumerate(train_queue):
+        for step, (input, target) in enumerate(self.prefetch(train_queue)):
             startTime = time()
             n = input.size(0)
 
-            input = Variable(input, requires_grad=False).cuda()
-            target = Variable(target, requires_grad=False).cuda(async=True)
+            input = Variable(input, requires_grad=False).to(self.args.device)
+            target = Variable(target, requires_grad=False).to(self.args.device, non_blocking=True)
 
-            # choose model partition if we haven't set partition to model
-            if self.args.partition is None:
-                model.choosePathByAlphas()
             # optimize model weights
             optimizer.zero_grad()
-            logits = modelParallel(input)
-            # calc loss
-            loss = crit(logits, target)
-            # back propagate
-            loss.backward()
+            logits, loss = self.weightsForwardBackward(input, target)
             clip_grad_norm_(modelParallel.parameters(), grad_clip)
             # update weights
             optimizer.step()
@@ -514,6 +575,11 @@ class TrainRegime:
         # remove pre & post forward hooks
         model.removeWeightsTrainingHooks()
 
+        # recalibrate activations statistics after weights update, in subsampled mode
+        if self.args.calibrate_batches > 0:
+            func = [lambda msg: trainLogger.addInfoTable(title='Statistics calibration', rows=[[msg]])] if trainLogger else []
+            model.calcStatistics(self.statistics_queue, nBatches=self.args.calibrate_batches, ratio=self.args.calibrate_ratio, loggerFuncs=func)
+
         # log accuracy, loss, etc.
         summaryData = {self.trainLossKey: loss_container.avg, self.trainAccKey: top1.avg, self.batchNumKey: 'Summary'}
         # apply formats
@@ -533,10 +599,16 @@ class TrainRegime:
 
         return summaryData
 
-    def infer(self, setModelPartitionFunc, nEpoch, loggers):
+    # in fast validation mode (args.fast_valid), valid_queue is class-stratified and inference stops as soon as accuracy confidence interval
+    # is narrower than args.valid_tolerance, or its upper bound is below accThreshold
+    # narrowExit: in fast validation mode, allow early exit once accuracy interval is narrow, otherwise exit only below accThreshold
+    # self.inferEarlyExit is set whether the last pass stopped before the end of valid_queue, i.e. its loss & accuracy are partial
+    def infer(self, setModelPartitionFunc, nEpoch, loggers, accThreshold=None, narrowExit=True):
         print('*** infer() ***')
+        self.inferEarlyExit = False
         objs = AvgrageMeter()
         top1 = AvgrageMeter()
+        nCorrect = 0
 
         model = self.model
         modelParallel = self.modelParallel
@@ -564,11 +636,11 @@ class TrainRegime:
         assert (model.training is False)
 
         with no_grad():
-            for step, (input, target) in enumerate(valid_queue):
+            for step, (input, target) in enumerate(self.prefetch(valid_queue)):
                 startTime = time()
 
-                input = Variable(input).cuda()
-                target = Variable(target).cuda(async=True)
+                input = Variable(input).to(self.args.device)
+                target = Variable(target).to(self.args.device, non_blocking=True)
 
                 logits = modelParallel(input)
                 loss = crit(logits, target)
@@ -577,6 +649,7 @@ class TrainRegime:
                 n = input.size(0)
                 objs.update(loss.item(), n)
                 top1.update(prec1.item(), n)
+                nCorrect += logits.argmax(dim=1).eq(target).sum().item()
 
                 endTime = time()
 
@@ -592,6 +665,19 @@ class TrainRegime:
                     # add row to data table
                     trainLogger.addDataRow(dataRow)
 
+                if self.args.fast_valid:
+                    lower, upper = wilsonInterval(nCorrect, top1.cnt)
+                    isNarrow = narrowExit and ((upper - lower) < self.args.valid_tolerance)
+                    isBelow = (accThreshold is not None) and ((100.0 * upper) < accThreshold)
+                    if isNarrow or isBelow:
+                        msg = 'Early exit after [{}/{}] batches, [{}] samples, accuracy interval:[{:.3f}, {:.3f}]' \
+                            .format(step + 1, nBatches, top1.cnt, 100.0 * lower, 100.0 * upper)
+                        print(msg)
+                        if trainLogger:
+                            trainLogger.addInfoToDataTable(msg)
+                        self.inferEarlyExit = True
+                        break
+
         model.unQuantizeUnstagedLayers()
         # log UNIQ status after restoring model state
         self.addModelUNIQstatusTable(model, trainLogger, 'UNIQ status - state restored')
@@ -657,11 +743,11 @@ class TrainRegime:
         with no_grad():
             for queue in search_queue:
                 nBatches = len(queue)
-                for step, (input, target) in enumerate(queue):
+                for step, (input, target) in enumerate(self.prefetch(queue)):
                     startTime = time()
 
-                    input = Variable(input).cuda()
-                    target = Variable(target).cuda(async=True)
+                    input = Variable(input).to(self.args.device)
+                    target = Variable(target).to(self.args.device, non_blocking=True)
 
                     logits = modelParallel(input)
                     loss, crossEntropyLoss, bopsLoss = model.loss(logits, target)
@@ -0,0 +1,159 @@
+from copy import deepcopy
+from os import makedirs, path
+
+from torch import zeros, int32
+from torch.optim import SGD
+from torch.optim.lr_scheduler import CosineAnnealingLR
+
+from .regime import TrainRegime, save_checkpoint
+from cnn.HtmlLogger import HtmlLogger
+from cnn.partition_evaluator import PartitionEvaluator
+
+
+# weight-sharing supernet, replaces training each candidate partition from scratch
+# weights are trained by sandwich rule, i.e. each step accumulates gradients of cheapest, most expensive & random partitions
+# candidate partitions are evaluated directly on supernet weights with BN recalibration, top candidates are optionally fine-tuned
+class Supernet(TrainRegime):
+    candidatesTableTitle = 'Supernet candidates'
+
+    def __init__(self, args, logger):
+        # supernet samples partitions, it can't train a fixed partition
+        assert (args.partition is None)
+        super(Supernet, self).__init__(args, logger)
+
+        model = self.model
+        self.minPartition = [self.extremePartition(layer, min) for layer in model.layersList]
+        self.maxPartition = [self.extremePartition(layer, max) for layer in model.layersList]
+
+        self.evaluator = PartitionEvaluator(model, self.statistics_queue, self.valid_queue, args.bn_batches)
+
+        logger.addInfoTable('Supernet', [['Stages epochs', self.epochsSwitchStage], ['Epochs after stages', args.supernet_epochs],
+                                         ['Random partitions per step', args.supernet_random_paths], ['Candidates', args.supernet_candidates],
+                                         ['Fine-tuned candidates', args.finetune_top], ['Fine-tune epochs', args.finetune_epochs],
+                                         ['Fine-tune learning rate', args.finetune_lr]])
+
+    # partition where all layer filters use the cheapest (selectFunc=min) or most expensive (selectFunc=max) op
+    @staticmethod
+    def extremePartition(layer, selectFunc):
+        # op cost is its weights bitwidth * activation bitwidth, full precision is 32-bit
+        costs = [(b or 32) * (a or 32) for b, a in layer.getAllBitwidths()]
+        opIdx = selectFunc(range(len(costs)), key=lambda i: costs[i])
+        partition = zeros(layer.numOfOps(), dtype=int32)
+        partition[opIdx] = layer.nFilters()
+
+        return partition
+
+    def setMaxPartition(self, loggerFuncs=[]):
+        self.model.setFiltersByPartition(self.maxPartition, loggerFuncs)
+
+    # sandwich rule, returns most expensive partition logits & loss
+    def weightsForwardBackward(self, input, target):
+        # fine-tuning a fixed partition
+        if self.args.partition is not None:
+            return super(Supernet, self).weightsForwardBackward(input, target)
+
+        model = self.model
+        partitionFuncs = [lambda: model.setFiltersByPartition(self.maxPartition), lambda: model.setFiltersByPartition(self.minPartition)]
+        partitionFuncs.extend([model.choosePathByAlphas] * self.args.supernet_random_paths)
+
+        result = None
+        for setPartition in partitionFuncs:
+            setPartition()
+            logits = self.modelParallel(input)
+            loss = self.cross_entropy(logits, target)
+            # gradients are accumulated over partitions, each partition graph is released by its own backward
+            loss.backward()
+            # keep only most expensive partition values, without graph
+            if result is None:
+                result = logits.detach(), loss.detach()
+
+        return result
+
+    def train(self):
+        model = self.model
+        modelParallel = self.modelParallel
+        args = self.args
+        logger = self.logger
+        # quantization stages epochs, like initial weights training, then supernet_epochs with all layers staged
+        nEpochs = self.epochsSwitchStage[-1] + args.supernet_epochs
+
+        # alphas are not trained, random partitions are drawn from their (uniform) distribution
+        model.turnOffAlphas()
+        # restarts quantization staging
+        model.turnOnWeights()
+        optimizer = SGD(modelParallel.parameters(), args.learning_rate, momentum=args.momentum, weight_decay=args.weight_decay)
+        scheduler = CosineAnnealingLR(optimizer, nEpochs, eta_min=args.learning_rate_min)
+
+        for epoch in range(1, nEpochs + 1):
+            print('========== Epoch:[{}] =============='.format(epoch))
+            trainLogger = HtmlLogger(self.trainFolderPath, str(epoch))
+            loggersDict = dict(train=trainLogger)
+
+            dataRow = self.trainWeights(optimizer, epoch, loggersDict)
+            scheduler.step()
+
+            # switch stage, i.e. quantize one more layer
+            if epoch in self.epochsSwitchStage:
+                model.switch_stage(loggerFuncs=[lambda msg: trainLogger.addInfoTable(title='Switching stage', rows=[[msg]])])
+
+            # validation on most expensive partition
+            _, _, validData = self.infer(self.setMaxPartition, epoch, loggersDict)
+            for k, v in validData.items():
+                dataRow[k] = v
+            dataRow[self.epochNumKey] = '{}/{}'.format(epoch, nEpochs)
+            logger.addDataRow(dataRow)
+
+            save_checkpoint(self.trainFolderPath, model, args, epoch, 0.0)
+
+        # candidates are evaluated & fine-tuned with all layers staged
+        assert (model.switch_stage() is False)
+        self.evaluateCandidates()
+
+    # evaluate candidate partitions on supernet weights, fine-tune top candidates
+    def evaluateCandidates(self):
+        model = self.model
+        args = self.args
+        logger = self.logger
+        loggerFuncs = [lambda msg: logger.addInfoToDataTable(msg)]
+
+        candidates = [self.minPartition, self.maxPartition]
+        for _ in range(args.supernet_candidates):
+            model.choosePathByAlphas()
+            candidates.append(model.getCurrentPartitionTensors())
+
+        results = self.evaluator.evaluate(candidates, loggerFuncs=loggerFuncs)
+
+        # fine-tune top candidates by accuracy, each from supernet weights
+        finetuned = {}
+        if args.finetune_top > 0:
+            supernetState = deepcopy(model.state_dict())
+            topCandidates = sorted(range(len(candidates)), key=lambda i: results[i]['accuracy'], reverse=True)[:args.finetune_top]
+            for i in topCandidates:
+                finetuned[i] = self.finetune(candidates[i], i)
+                model.load_state_dict(supernetState)
+
+        rows = [['#', self.validBopsRatioKey, self.validAccKey, self.validLossKey, 'Fine-tuned {}'.format(self.validAccKey)]]
+        for i, result in enumerate(results):
+            finetunedAcc = self.formats[self.validAccKey].format(finetuned[i]['accuracy']) if i in finetuned else ''
+            rows.append([i, self.formats[self.validBopsRatioKey].format(result['bopsRatio']), self.formats[self.validAccKey].format(result['accuracy']),
+                         self.formats[self.validLossKey].format(result['loss']), finetunedAcc])
+        logger.addInfoTable(self.candidatesTableTitle, rows)
+
+        return results, finetuned
+
+    # short fine-tune of a fixed partition, returns its evaluation
+    def finetune(self, partition, id):
+        model = self.model
+        args = self.args
+        folderPath = '{}/finetune_{}'.format(self.trainFolderPath, id)
+        if not path.exists(folderPath):
+            makedirs(folderPath)
+
+        args.partition = partition
+        model.setFiltersByPartition(partition)
+        optimizer = SGD(self.modelParallel.parameters(), args.finetune_lr, momentum=args.momentum, weight_decay=args.weight_decay)
+        for epoch in range(1, args.finetune_epochs + 1):
+            self.trainWeights(optimizer, epoch, dict(train=HtmlLogger(folderPath, str(epoch))))
+        args.partition = None
+
+        return self.evaluator.evaluate([partition])[0]
@@ -16,6 +16,7 @@ from torch.cuda import manual_seed as cuda_manual_seed
 from torch import manual_seed as torch_manual_seed
 
 import cnn.trainRegime as trainRegimes
+from cnn.gradEstimators.distributed_same_path import serve as serveDistributed
 from cnn.HtmlLogger import HtmlLogger
 from cnn.utils import create_exp_dir, saveArgsToJSON, loadGradEstimatorsNames, loadModelNames, models, loadDatasets
 
@@ -34,6 +35,9 @@ def parseArgs(lossFuncsLambda):
     parser = argparse.ArgumentParser("F-BANNAS")
     parser.add_argument('--data', type=str, required=True, help='location of the data corpus')
     parser.add_argument('--dataset', metavar='DATASET', default='cifar100', choices=datasets.keys(), help='dataset name')
+    parser.add_argument('--synthetic_size', type=int, default=10000, help='number of train samples in synthetic dataset, validation is 1/5')
+    parser.add_argument('--synthetic_resolution', type=int, default=32, help='images resolution in synthetic dataset, models global pooling is adaptive to it')
+    parser.add_argument('--synthetic_classes', type=int, default=10, help='number of classes in synthetic dataset')
     parser.add_argument('--model', '-a', metavar='MODEL', default='tinynet', choices=modelNames,
                         help='model architecture: ' + ' | '.join(modelNames) + ' (default: alexnet)')
     parser.add_argument('--batch_size', type=int, default=256, help='batch size')
@@ -43,7 +47,7 @@ def parseArgs(lossFuncsLambda):
     parser.add_argument('--weight_decay', type=float, default=4e-5, help='weight decay')
     parser.add_argument('--report_freq', type=float, default=1, help='report frequency')
     parser.add_argument('--gpu', type=str, default='0', help='gpu device id, e.g. 0,1,3')
-    parser.add_argument('--nCopies', type=int, default=1, help='number of model copies per GPU')
+    parser.add_argument('--nCopies', type=int, default=1, help='number of model copies per GPU, or number of CPU worker processes')
     parser.add_argument('--epochs', type=str, default='5', help='num of training epochs per layer, as list, e.g. 5,4,3,8,6.'
                                                                 'If len(epochs)<len(layers) then last value is used for rest of the layers')
     # parser.add_argument('--infer_epochs', type=int, default=10, help='number of epochs for training & inference after model is quantized')
@@ -52,6 +56,29 @@ def parseArgs(lossFuncsLambda):
     parser.add_argument('--save', type=str, default='EXP', help='experiment name')
     parser.add_argument('--seed', type=int, default=2, help='random seed')
     parser.add_argument('--grad_clip', type=float, default=5, help='gradient clipping')
+    parser.add_argument('--tensor_data', action='store_true', default=False,
+                        help='keep CIFAR in memory as uint8 tensor, augment & normalize whole batches. '
+                             'for imagenet, --data is the cache folder built by UNIQ/imagenet_cache.py')
+    parser.add_argument('--loader_service', action='store_true', default=False,
+                        help='serve all data queues by a single pool of --workers persistent workers')
+    parser.add_argument('--prefetch', type=int, default=2, help='number of batches in flight per data queue, in --loader_service')
+    parser.add_argument('--device_prefetch', action='store_true', default=False,
+                        help='copy next batch to GPU on a side stream while current step runs')
+    parser.add_argument('--alphas_cache', type=str, default='none', choices=['none', 'memory', 'disk'],
+                        help='materialize search parts batches once with fixed augmentation seed, as pinned tensors or memory-mapped files on disk')
+    parser.add_argument('--fast_valid', action='store_true', default=False,
+                        help='class-stratified validation, which stops once accuracy confidence interval is narrow enough')
+    parser.add_argument('--valid_tolerance', type=float, default=0.02, help='accuracy confidence interval width to stop at, in --fast_valid')
+    parser.add_argument('--eval_partitions', action='store_true', default=False,
+                        help='evaluate epoch jobs partitions locally, all partitions in a single pass over validation set')
+    parser.add_argument('--bn_batches', type=int, default=10, help='number of batches for BN recalibration per partition, in --eval_partitions')
+    parser.add_argument('--supernet_epochs', type=int, default=30, help='number of supernet weights training epochs after quantization stages epochs, in supernet regime')
+    parser.add_argument('--supernet_random_paths', type=int, default=2,
+                        help='number of random partitions per step, in addition to cheapest & most expensive partitions')
+    parser.add_argument('--supernet_candidates', type=int, default=20, help='number of candidate partitions to evaluate on supernet weights')
+    parser.add_argument('--finetune_top', type=int, default=0, help='number of top candidates to fine-tune from supernet weights')
+    parser.add_argument('--finetune_epochs', type=int, default=1, help='number of fine-tune epochs per candidate')
+    parser.add_argument('--finetune_lr', type=float, default=1E-3, help='fine-tune learning rate, lower than training learning rate')
     parser.add_argument('--train_portion', type=float, default=0.5, help='portion of training data')
     parser.add_argument('--propagate', action='store_true', default=False, help='print to stdout')
     parser.add_argument('--arch_learning_rate', type=float, default=0.01, help='learning rate for arch encoding')
@@ -64,17 +91,55 @@ def parseArgs(lossFuncsLambda):
     parser.add_argument('--nBitsMin', type=int, default=1, choices=range(1, 32 + 1), help='min number of bits')
     parser.add_argument('--nBitsMax', type=int, default=3, choices=range(1, 32 + 1), help='max number of bits')
     parser.add_argument('--bitwidth', type=str, default=None, help='list of bitwidth values, e.g. 1,4,16')
+    parser.add_argument('--act_lut', action='store_true', default=False,
+                        help='UNIQ activations quantization by cached lookup tables of running activations range')
     parser.add_argument('--kernel', type=str, default='3', help='list of conv kernel sizes, e.g. 1,3,5')
 
     parser.add_argument('--alphas', default=None, help='list of alphas tensors to update model layers alphas values')
     parser.add_argument('--alphas_regime', default='alphas_weights_loop', choices=alphasRegimeNames, help='alphas optimization method')
     parser.add_argument('--grad_estimator', default='layer_same_path', choices=gradEstimatorsNames, help='gradient estimation method')
     parser.add_argument('--nSamples', type=int, default=20, help='How many paths to sample in order to estimate gradient')
+    parser.add_argument('--adaptive_rse', type=float, default=0.1,
+                        help='adaptive_same_path target relative standard error of alphas gradient, stops sampling below it')
+    parser.add_argument('--adaptive_chunk', type=int, default=4,
+                        help='adaptive_same_path number of samples per chunk, step stops after any chunk, min 2')
+    parser.add_argument('--max_samples', type=int, default=0, help='adaptive_same_path max samples per step, 0 means 4 * nSamples')
+    parser.add_argument('--baseline_decay', type=float, default=0.9, help='layer_same_path_ema loss baseline decay')
+    parser.add_argument('--variance_estimators', type=str, default='layer_same_path,layer_same_path_ema,layer_same_path_loo,layer_same_path_antithetic',
+                        help='grad_variance regime list of gradient estimators, e.g. layer_same_path,layer_same_path_loo')
+    parser.add_argument('--variance_samples', type=str, default='2,4,8,16', help='grad_variance regime list of number of samples')
+    parser.add_argument('--variance_reps', type=int, default=20, help='grad_variance regime number of steps per variance estimation')
+    parser.add_argument('--gumbel_tau', type=float, default=5.0, help='gumbel_softmax initial temperature')
+    parser.add_argument('--gumbel_tau_min', type=float, default=0.5, help='gumbel_softmax temperature at the last relaxed epoch')
+    parser.add_argument('--gumbel_epochs', type=int, default=0,
+                        help='gumbel_softmax number of relaxed epochs, then fall back to discrete estimation. 0 means all epochs')
     parser.add_argument('--alphas_data_parts', type=int, default=4, help='split alphas training data to parts. each loop uses single part')
     parser.add_argument('--alpha_limit', type=float, default=0.8, help='if a layer opt alpha reached alpha_limit, then stop optimize layer alphas')
     parser.add_argument('--alpha_limit_counter', type=int, default=10,
                         help='how many consecutive steps the optimal alpha has to be over limit in order to stop layer alphas optimization')
 
+    parser.add_argument('--calibrate_batches', type=int, default=0,
+                        help='number of statistics batches to recalibrate activations statistics after each weights training epoch, 0 to disable')
+    parser.add_argument('--calibrate_ratio', type=float, default=0.1,
+                        help='ratio of feature maps elements used for activations statistics recalibration')
+
+    parser.add_argument('--replicator_device', type=str, default='cuda', choices=['cuda', 'cpu'],
+                        help='device of model replications for alphas gradient estimation')
+    parser.add_argument('--replica_threads', type=int, default=0,
+                        help='number of threads per CPU model replication, 0 splits all cores between replications')
+
+    parser.add_argument('--pipeline_alphas', action='store_true', default=False,
+                        help='replications run next alphas step while main process updates alphas and logs, i.e. alphas are one step stale')
+    parser.add_argument('--prefix_cache_mb', type=int, default=256,
+                        help='memory budget [MB] per replication for caching the output of model deterministic prefix, 0 disables the cache')
+
+    parser.add_argument('--dist_url', type=str, default='tcp://127.0.0.1:23456', help='distributed gradient estimation init method')
+    parser.add_argument('--world_size', type=int, default=1, help='number of distributed gradient estimation ranks')
+    parser.add_argument('--rank', type=int, default=0, help='distributed gradient estimation rank, rank 0 runs training')
+
+    parser.add_argument('--noise_seed', type=int, default=None, help='seed for reproducible weights noise, None uses global RNG. '
+                             'seeded noise is drawn on CPU & copied to GPU on every noisy forward, i.e. slower')
+
     parser.add_argument('--partition', default=None, help='list of model layers partition')
 
     parser.add_argument('--loss', type=str, default='UniqLoss', choices=[key for key in lossFuncsLambda.keys()])
@@ -93,6 +158,10 @@ def parseArgs(lossFuncsLambda):
     # convert epochs to list
     args.epochs = [int(i) for i in args.epochs.split(',')]
 
+    # convert grad_variance regime lists
+    args.variance_estimators = args.variance_estimators.split(',')
+    args.variance_samples = [int(i) for i in args.variance_samples.split(',')]
+
     # convert bitwidth to list
     if args.bitwidth:
         args.bitwidth = [(int(x[0]), int(x[-1])) for x in [y.split(',') for y in args.bitwidth.split('#')]]
@@ -114,7 +183,7 @@ def parseArgs(lossFuncsLambda):
     args.device = 'cuda:' + str(args.gpu[0])
 
     # set number of model output classes
-    args.nClasses = datasets[args.dataset]
+    args.nClasses = args.synthetic_classes if args.dataset == 'synthetic' else datasets[args.dataset]
 
     # set train folder name
     args.trainFolder = 'train'
@@ -154,22 +223,33 @@ if __name__ == '__main__':
     args = parseArgs(lossFuncsLambda)
     logger = HtmlLogger(args.save, 'log')
 
-    if not is_available():
-        print('no gpu device available')
-        exit(1)
+    # replications workers of all ranks are spawned, start method has to be set before any worker is created
+    try:
+        set_start_method('spawn', force=True)
+    except RuntimeError:
+        raise ValueError('spawn failed')
 
     args.seed = datetime.now().microsecond
     np.random.seed(args.seed)
-    set_device(args.gpu[0])
-    cudnn.benchmark = True
     torch_manual_seed(args.seed)
-    cudnn.enabled = True
-    cuda_manual_seed(args.seed)
 
-    try:
-        set_start_method('spawn', force=True)
-    except RuntimeError:
-        raise ValueError('spawn failed')
+    if is_available():
+        set_device(args.gpu[0])
+        cudnn.benchmark = True
+        cudnn.enabled = True
+        cuda_manual_seed(args.seed)
+    elif args.world_size > 1:
+        # distributed gradient estimation runs over gloo, i.e. CPU only ranks, including rank 0
+        args.device = 'cpu'
+        args.replicator_device = 'cpu'
+    else:
+        print('no gpu device available')
+        exit(1)
+
+    # ranks > 0 only serve distributed gradient estimation steps of rank 0
+    if args.rank > 0:
+        serveDistributed(models.__dict__[args.model], args, logger)
+        exit(0)
 
     try:
         # log command line
@@ -1,4 +1,4 @@
-from torch import tensor, float32
+from torch import tensor, float32, Tensor
 from torch.nn import CrossEntropyLoss, Module
 from numpy import linspace
 import matplotlib
@@ -14,14 +14,15 @@ class BopsLoss:
 
     def calcLoss(self, modelBops):
         v = (modelBops / self.minBops) ** 2
-        return tensor(v, dtype=float32).cuda()
+        # relaxed bops are a differentiable tensor
+        return v if isinstance(v, Tensor) else tensor(v, dtype=float32)
 
 
 class UniqLoss(Module):
     def __init__(self, args):
         super(UniqLoss, self).__init__()
         self.lmbda = args.lmbda
-        self.crossEntropyLoss = CrossEntropyLoss().cuda()
+        self.crossEntropyLoss = CrossEntropyLoss()
 
         self.baselineBops = args.baselineBops
 
@@ -41,7 +42,7 @@ class UniqLoss(Module):
 
     def forward(self, input, target, modelBops):
         crossEntropyLoss = self.crossEntropyLoss(input, target)
-        bopsLoss = self.lmbda * self.bopsLoss(modelBops)
+        bopsLoss = self.lmbda * self.bopsLoss(modelBops).to(crossEntropyLoss.device)
         totalLoss = crossEntropyLoss + bopsLoss
         return totalLoss, crossEntropyLoss, bopsLoss
 
@@ -1,4 +1,5 @@
 import os
+import random
 import numpy as np
 import torch
 from shutil import copyfile
@@ -13,6 +14,8 @@ from email.mime.base import MIMEBase
 from base64 import b64decode
 from zipfile import ZipFile, ZIP_DEFLATED
 from json import dump
+from threading import Thread, Event
+from queue import Queue, Empty
 
 from torch.autograd import Variable
 from torch import save as saveModel
@@ -20,8 +23,10 @@ from torch import load as loadModel
 from torch.utils.data.dataloader import DataLoader
 from torch.utils.data.sampler import SubsetRandomSampler
 
-from UNIQ.preprocess import get_transform
+from UNIQ.preprocess import get_transform, get_transform_padding, get_normalize_stats
 from UNIQ.data import get_dataset
+from UNIQ.loader_service import LoaderService
+from UNIQ.tensor_data import UInt8ImageDataset, MemmapImageDataset, TensorDataLoader
 
 from cnn.HtmlLogger import HtmlLogger
 import cnn.gradEstimators as gradEstimators
@@ -38,7 +43,7 @@ def loadCheckpoint(dataset, model, bitwidth, filename='model_opt.pth.tar'):
     # load checkpoint
     checkpoint = None
     if path.exists(checkpointPath):
-        checkpoint = loadModel(checkpointPath, map_location=lambda storage, loc: storage.cuda())
+        checkpoint = loadModel(checkpointPath, map_location=lambda storage, loc: storage.cuda() if torch.cuda.is_available() else storage)
 
     return checkpoint, checkpointKey
 
@@ -102,6 +107,138 @@ class AvgrageMeter(object):
         self.avg = self.sum / self.cnt
 
 
+# materializes data queue batches once, with fixed augmentation seed, later epochs iterate the same batches with zero loader cost
+# batches are kept as pinned tensors in memory, or saved to path (as inputs & targets .npy files) and memory-mapped once
+class FixedBatchCache:
+    def __init__(self, queue, seed, path=None):
+        self.queue = queue
+        self.seed = seed
+        self.path = path
+        self.batches = None
+        self.nBatches = len(queue)
+        # pinned memory requires CUDA
+        self.pin = torch.cuda.is_available()
+
+    def __len__(self):
+        return self.nBatches
+
+    def filePath(self, key):
+        return '{}_{}.npy'.format(self.path, key)
+
+    def build(self):
+        # fixed augmentation seed, without changing training random state
+        torchState, pyState = torch.get_rng_state(), random.getstate()
+        torch.manual_seed(self.seed)
+        random.seed(self.seed)
+        # memory-mapped batches are pinned on iteration
+        pin = self.pin and (self.path is None)
+        batches = [(input.pin_memory(), target.pin_memory()) if pin else (input, target) for input, target in self.queue]
+        torch.set_rng_state(torchState)
+        random.setstate(pyState)
+
+        self.nBatches = len(batches)
+        if self.path is None:
+            self.batches = batches
+        else:
+            batchSizes = [input.size(0) for input, _ in batches]
+            for key, idx in [('input', 0), ('target', 1)]:
+                np.save(self.filePath(key), torch.cat([batch[idx] for batch in batches]).numpy())
+            batches = None
+            # batches are views on memory-mapped files, i.e. pages are read by OS on demand & file is never reloaded
+            inputs, targets = [torch.from_numpy(np.load(self.filePath(key), mmap_mode='c')) for key in ['input', 'target']]
+            self.batches = list(zip(inputs.split(batchSizes), targets.split(batchSizes)))
+        # queue is not needed anymore
+        self.queue = None
+
+    def __iter__(self):
+        if self.batches is None:
+            self.build()
+
+        # memory-mapped batches are staged in pinned memory, like DataLoader pin_memory
+        pin = self.pin and (self.path is not None)
+        for input, target in self.batches:
+            yield (input.pin_memory(), target.pin_memory()) if pin else (input, target)
+
+
+# wraps data queue, stages next batch on device while current batch is processed
+# CUDA copies are issued on a side stream, other devices use a background thread
+class DevicePrefetcher:
+    def __init__(self, queue, device=None, depth=2):
+        self.queue = queue
+        self.device = torch.device(device if device is not None else ('cuda' if torch.cuda.is_available() else 'cpu'))
+        # number of batches staged ahead, in background thread mode
+        self.depth = depth
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __iter__(self):
+        if self.device.type == 'cuda':
+            return self.__streamIter()
+
+        return self.__threadIter()
+
+    def __streamIter(self):
+        stream = torch.cuda.Stream(self.device)
+
+        def stage(batch):
+            with torch.cuda.stream(stream):
+                return [t.to(self.device, non_blocking=True) for t in batch]
+
+        batches = iter(self.queue)
+        nextBatch = next(batches, None)
+        nextBatch = stage(nextBatch) if nextBatch is not None else None
+        while nextBatch is not None:
+            # wait for batch copy, tensors are used by current stream from now on
+            currentStream = torch.cuda.current_stream(self.device)
+            currentStream.wait_stream(stream)
+            batch = nextBatch
+            for t in batch:
+                t.record_stream(currentStream)
+
+            nextBatch = next(batches, None)
+            nextBatch = stage(nextBatch) if nextBatch is not None else None
+
+            yield tuple(batch)
+
+    def __threadIter(self):
+        staged = Queue(maxsize=self.depth)
+        # end of queue marker
+        endMarker = object()
+        # set when consumer stops iterating, before the end of queue
+        stop = Event()
+
+        def worker():
+            try:
+                for batch in self.queue:
+                    if stop.is_set():
+                        return
+                    staged.put(tuple(t.to(self.device) for t in batch))
+                staged.put(endMarker)
+            except Exception as e:
+                staged.put(e)
+
+        thread = Thread(target=worker, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = staged.get()
+                if batch is endMarker:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+
+                yield batch
+        finally:
+            # stop worker & drain staged batches, so worker is never blocked on put() and releases queue iterator
+            stop.set()
+            while thread.is_alive():
+                try:
+                    staged.get(timeout=0.1)
+                except Empty:
+                    pass
+
+
 def accuracy(output, target, topk=(1,)):
     maxk = max(topk)
     batch_size = target.size(0)
@@ -117,6 +254,51 @@ def accuracy(output, target, topk=(1,)):
     return res
 
 
+# Wilson score interval of accuracy, returns (lower, upper) ratios
+def wilsonInterval(nCorrect, nSamples, z=1.96):
+    if nSamples == 0:
+        return 0.0, 1.0
+
+    p = nCorrect / nSamples
+    denominator = 1 + (z * z / nSamples)
+    center = (p + (z * z / (2 * nSamples))) / denominator
+    margin = (z / denominator) * np.sqrt((p * (1 - p) / nSamples) + (z * z / (4 * nSamples * nSamples)))
+
+    return max(center - margin, 0.0), min(center + margin, 1.0)
+
+
+# dataset targets as list, torchvision datasets have changed their attributes names between versions
+def datasetTargets(dataset):
+    for attr in ['targets', 'train_labels' if getattr(dataset, 'train', False) else 'test_labels']:
+        targets = getattr(dataset, attr, None)
+        if targets is not None:
+            return torch.as_tensor(targets).tolist()
+
+    # ImageFolder
+    return [target for _, target in dataset.samples]
+
+
+# dataset indices order, where each prefix is stratified by classes, i.e. class ratios in each prefix are as in the whole dataset
+def stratifiedOrder(targets, seed=0):
+    rand = np.random.RandomState(seed)
+    classIndices = {}
+    for i, t in enumerate(targets):
+        classIndices.setdefault(t, []).append(i)
+
+    # sample position is its relative rank in its (shuffled) class
+    positions = []
+    for indices in classIndices.values():
+        rand.shuffle(indices)
+        positions.extend([((rank + rand.uniform()) / len(indices), i) for rank, i in enumerate(indices)])
+
+    return [i for _, i in sorted(positions)]
+
+
+# validation queue indices order, stratified in fast validation mode. None keeps dataset order
+def validIndices(args, valid_data):
+    return stratifiedOrder(datasetTargets(valid_data), args.seed) if args.fast_valid else None
+
+
 def count_parameters_in_MB(model):
     return np.sum(np.prod(v.size()) for v in model.parameters()) / 1e6
 
@@ -368,18 +550,103 @@ def initTrainLogger(logger_file_name, folder_path, propagate=False):
 
 
 def loadDatasets():
-    return dict(cifar10=10, cifar100=100, imagenet=1000)
+    return dict(cifar10=10, cifar100=100, imagenet=1000, synthetic=10)
+
+
+# get_dataset() extra params, synthetic dataset is generated by args
+def datasetParams(args):
+    if args.dataset == 'synthetic':
+        return dict(synthetic_size=args.synthetic_size, synthetic_resolution=args.synthetic_resolution, synthetic_classes=args.nClasses)
+
+    return {}
+
+
+# get_transform() input size, None means dataset default
+def transformInputSize(args):
+    return args.synthetic_resolution if args.dataset == 'synthetic' else None
+
+
+# load_data() queues as TensorDataLoader over uint8 dataset, augmentation is applied on whole batches
+# CIFAR is kept in memory, ImageNet is read from a memory-mapped cache built by UNIQ/imagenet_cache.py (args.data is the cache folder)
+def load_tensor_data(args):
+    # use same normalization as get_transform()
+    normalize = get_normalize_stats(args.dataset)
+
+    if args.dataset == 'imagenet':
+        train_data = MemmapImageDataset(args.data, 'train')
+        valid_data = MemmapImageDataset(args.data, 'val')
+        # cached images are scaled to 256, crop 224 like scale_crop()
+        padding, cropSize = 0, 224
+    else:
+        assert (('cifar' in args.dataset) or (args.dataset == 'synthetic'))
+        train_data = UInt8ImageDataset.fromCIFAR(get_dataset(args.dataset, train=True, transform=None, datasets_path=args.data, **datasetParams(args)))
+        valid_data = UInt8ImageDataset.fromCIFAR(get_dataset(args.dataset, train=False, transform=None, datasets_path=args.data, **datasetParams(args)))
+        # pad & random crop like get_transform()
+        padding, cropSize = get_transform_padding(args.dataset, input_size=transformInputSize(args)), None
+
+    def loader(dataset, batch_size, indices=None, shuffle=True, augment=True):
+        return TensorDataLoader(dataset, batch_size, normalize['mean'], normalize['std'], indices=indices, shuffle=shuffle,
+                                padding=padding if augment else 0, flip=augment, crop_size=cropSize, random_crop=augment, pin_memory=True)
+
+    num_train = len(train_data)
+    indices = list(range(num_train))
+    split = int(np.floor(args.train_portion * num_train))
+
+    train_queue = loader(train_data, args.batch_size, indices=indices[:split])
+    statistics_queue = loader(train_data, 64)
+    valid_queue = loader(valid_data, args.batch_size, indices=validIndices(args, valid_data), shuffle=False, augment=False)
+
+    # split search_queue to parts, last part takes what left
+    nParts = args.alphas_data_parts
+    nSamplesPerPart = int((num_train - split) / nParts)
+    search_queue = []
+    for i in range(nParts):
+        startIdx = split + (i * nSamplesPerPart)
+        endIdx = (startIdx + nSamplesPerPart) if i < (nParts - 1) else num_train
+        search_queue.append(loader(train_data, args.batch_size, indices=indices[startIdx:endIdx]))
+
+    return train_queue, search_queue, valid_queue, statistics_queue
+
+
+# load_data() queues served by a single LoaderService, i.e. args.workers persistent workers shared by all queues
+def load_service_data(args, train_data, valid_data):
+    service = LoaderService(dict(train=train_data, valid=valid_data), args.workers, prefetch=args.prefetch, seed=args.seed)
+
+    num_train = len(train_data)
+    indices = list(range(num_train))
+    split = int(np.floor(args.train_portion * num_train))
+
+    train_queue = service.queue('train', args.batch_size, indices=indices[:split])
+    statistics_queue = service.queue('train', 64)
+    valid_queue = service.queue('valid', args.batch_size, indices=validIndices(args, valid_data), shuffle=False)
+
+    # split search_queue to parts, last part takes what left
+    nParts = args.alphas_data_parts
+    nSamplesPerPart = int((num_train - split) / nParts)
+    search_queue = []
+    for i in range(nParts):
+        startIdx = split + (i * nSamplesPerPart)
+        endIdx = (startIdx + nSamplesPerPart) if i < (nParts - 1) else num_train
+        search_queue.append(service.queue('train', args.batch_size, indices=indices[startIdx:endIdx]))
+
+    return train_queue, search_queue, valid_queue, statistics_queue
 
 
 def load_data(args):
+    if args.tensor_data:
+        return load_tensor_data(args)
+
     # init transforms
     transform = {
-        'train': get_transform(args.dataset, augment=True),
-        'eval': get_transform(args.dataset, augment=False)
+        'train': get_transform(args.dataset, input_size=transformInputSize(args), augment=True),
+        'eval': get_transform(args.dataset, input_size=transformInputSize(args), augment=False)
     }
 
-    train_data = get_dataset(args.dataset, train=True, transform=transform['train'], datasets_path=args.data)
-    valid_data = get_dataset(args.dataset, train=False, transform=transform['eval'], datasets_path=args.data)
+    train_data = get_dataset(args.dataset, train=True, transform=transform['train'], datasets_path=args.data, **datasetParams(args))
+    valid_data = get_dataset(args.dataset, train=False, transform=transform['eval'], datasets_path=args.data, **datasetParams(args))
+
+    if args.loader_service:
+        return load_service_data(args, train_data, valid_data)
 
     num_train = len(train_data)
     indices = list(range(num_train))
@@ -394,7 +661,8 @@ def load_data(args):
     #                           sampler=SubsetRandomSampler(indices[split:num_train]),
     #                           pin_memory=True, num_workers=args.workers)
 
-    valid_queue = DataLoader(valid_data, batch_size=args.batch_size, shuffle=False, pin_memory=True, num_workers=args.workers)
+    valid_queue = DataLoader(valid_data, batch_size=args.batch_size, sampler=validIndices(args, valid_data), shuffle=False, pin_memory=True,
+                             num_workers=args.workers)
 
     # split search_queue to parts
     nParts = args.alphas_data_parts
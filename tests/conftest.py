@@ -0,0 +1,33 @@
+from argparse import Namespace
+from os import path
+from sys import path as sysPath
+
+import pytest
+
+# tests run from repository root, i.e. cnn, UNIQ & NICE packages
+sysPath.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+torch = pytest.importorskip('torch')
+
+
+# tiny CPU ResNet args, cifar10 has a pre-trained baseline for bops ratio
+def modelArgs(save, bitwidth=((2, 2), (4, 4))):
+    return Namespace(dataset='cifar10', model='resnet', bitwidth=list(bitwidth), kernel=[3], nClasses=10, save=str(save),
+                     bopsCounter='discrete', baselineBits=[(2, 2)], lmbda=1.0)
+
+
+# random batches, used both as statistics & validation queue
+@pytest.fixture
+def data_queue():
+    torch.manual_seed(0)
+    return [(torch.randn(8, 3, 32, 32), torch.randint(0, 10, (8,))) for _ in range(2)]
+
+
+# model with calibrated activations statistics, like after loading pre-trained checkpoint
+@pytest.fixture
+def model(tmp_path, data_queue):
+    from cnn.models import resnet
+
+    model = resnet(modelArgs(tmp_path))
+    model.calcStatistics(data_queue)
+    return model
@@ -0,0 +1,110 @@
+from torch import no_grad, cat, randn
+from torch.nn import Conv2d, Parameter
+
+from cnn.calibration import recalibrate_bn, partitionBatchNorms, ActStatisticsCalibration
+
+
+def predictions(model, data_queue):
+    model.quantizeUnstagedLayers()
+    model.eval()
+    with no_grad():
+        preds = cat([model(input).argmax(dim=1) for input, _ in data_queue])
+    model.unQuantizeUnstagedLayers()
+
+    return preds
+
+
+def test_recalibrate_bn_accepts_list_partition(model, data_queue):
+    model.choosePathByAlphas()
+    partition = model.getCurrentFiltersPartition()
+    recalibrate_bn(model, partition, data_queue, len(data_queue))
+    assert (model.getCurrentFiltersPartition() == partition)
+
+
+def test_recalibrate_bn_updates_statistics(model, data_queue):
+    model.choosePathByAlphas()
+    bnModules = partitionBatchNorms(model)
+    before = [bn.running_mean.clone() for bn in bnModules]
+
+    # BN inputs of calibration data, on quantized model
+    bnInputs = {bn: [] for bn in bnModules}
+    handlers = [bn.register_forward_hook(lambda m, input, _: bnInputs[m].append(input[0].detach())) for bn in bnModules]
+    recalibrate_bn(model, None, data_queue, len(data_queue))
+    for handler in handlers:
+        handler.remove()
+
+    for bn, runningMean in zip(bnModules, before):
+        assert (not bn.running_mean.equal(runningMean))
+        # running mean is the cumulative average of calibration batches means
+        batchesMean = sum(x.mean(dim=(0, 2, 3)) for x in bnInputs[bn]) / len(bnInputs[bn])
+        assert (bn.running_mean.sub(batchesMean).abs().max().item() < 1E-4)
+
+
+def test_recalibrate_bn_recovers_accuracy(model, data_queue):
+    model.choosePathByAlphas()
+    recalibrate_bn(model, None, data_queue, len(data_queue))
+    # recalibrated model predictions as targets
+    targets = predictions(model, data_queue)
+
+    # corrupt BN statistics
+    for bn in partitionBatchNorms(model):
+        bn.running_mean.add_(10.0)
+        bn.running_var.mul_(100.0)
+    corruptedAcc = predictions(model, data_queue).eq(targets).float().mean().item()
+
+    recalibrate_bn(model, None, data_queue, len(data_queue))
+    recalibratedAcc = predictions(model, data_queue).eq(targets).float().mean().item()
+
+    assert (recalibratedAcc >= corruptedAcc)
+    assert (recalibratedAcc == 1.0)
+
+
+# ActQuantBuffers input of model current partition vs. calibration pre-activation of the same ops
+def preActivationError(model, data_queue):
+    from NICE.actquant import ActQuantBuffers
+
+    calibration = ActStatisticsCalibration(model)
+    layersInputs, actInputs = {}, {}
+
+    # hooks have to return None, otherwise they replace module output
+    def saveInput(inputs, m, input):
+        inputs[m] = input[0]
+
+    handlers = [layer.register_forward_hook(lambda m, input, _: saveInput(layersInputs, m, input)) for layer in calibration.layers]
+    for layer in calibration.layers:
+        for f in layer.filters:
+            actQuant = f.ops[f.prev_alpha_idx][f.curr_alpha_idx].getModule(ActQuantBuffers)
+            handlers.append(actQuant.register_forward_hook(lambda m, input, _: saveInput(actInputs, m, input)))
+
+    model.eval()
+    with no_grad():
+        model(data_queue[0][0])
+        for handler in handlers:
+            handler.remove()
+
+        maxError = 0.0
+        for layer in calibration.layers:
+            input = layersInputs[layer]
+            x, residual = input if isinstance(input, tuple) else (input, None)
+            for filterIdx, f in enumerate(layer.filters):
+                out = calibration.opPreActivation(layer, f.curr_alpha_idx, x, residual)
+                actQuant = f.ops[f.prev_alpha_idx][f.curr_alpha_idx].getModule(ActQuantBuffers)
+                maxError = max(maxError, (out[:, filterIdx:filterIdx + 1] - actInputs[actQuant]).abs().max().item())
+
+    return maxError
+
+
+def test_pre_activation_matches_forward(model, data_queue):
+    model.choosePathByAlphas()
+    assert (preActivationError(model, data_queue) < 1E-4)
+
+
+def test_pre_activation_conv_bias_dilation(model, data_queue):
+    # 1st layer convs with bias & dilation, output size is kept by padding
+    for op in model.layersList[0].opsList():
+        conv = op.getModule(Conv2d)
+        conv.dilation, conv.padding = (2, 2), (2, 2)
+        conv.bias = Parameter(randn(conv.out_channels))
+
+    model.choosePathByAlphas()
+    assert (preActivationError(model, data_queue) < 1E-4)
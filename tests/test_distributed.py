@@ -0,0 +1,78 @@
+from argparse import Namespace
+from socket import socket
+
+import torch.multiprocessing as mp
+from torch import manual_seed, randn, randint, allclose
+
+from conftest import modelArgs
+
+
+def estimatorArgs(save, port, rank, worldSize, nSamples=4):
+    args = modelArgs(save)
+    args = Namespace(gpu=[0], nCopies=1, nSamples=nSamples, alpha_limit=0.9, alpha_limit_counter=10, prefix_cache_mb=0, replicator_device='cpu',
+                     replica_threads=1, dist_url='tcp://127.0.0.1:{}'.format(port), world_size=worldSize, rank=rank, **vars(args))
+    args.save = '{}/rank_{}'.format(save, rank)
+    return args
+
+
+# CPU rank process, rank 0 sends a single distributed step & compares alphas gradients to a local estimator with the same seeds
+def runRank(save, port, rank, worldSize, results):
+    try:
+        from cnn.models import resnet
+        from cnn.HtmlLogger import HtmlLogger
+        from cnn.model_replicator import ModelReplicator
+        from cnn.gradEstimators import layer_same_path
+        from cnn.gradEstimators.distributed_same_path import DistributedSamePath, serve
+
+        args = estimatorArgs(save, port, rank, worldSize)
+        logger = HtmlLogger(args.save, 'log')
+        if rank > 0:
+            serve(resnet, args, logger)
+            results.put((rank, True, None))
+            return
+
+        manual_seed(0)
+        model = resnet(args)
+        model.calcStatistics([(randn(8, 3, 32, 32), randint(0, 10, (8,)))])
+        ModelReplicator.switchStage(model)
+        model.eval()
+        input, target = randn(8, 3, 32, 32), randint(0, 10, (8,))
+
+        grads = []
+        for estimatorClass in [DistributedSamePath, layer_same_path]:
+            estimator = estimatorClass(model, resnet, args, logger)
+            estimator.updateModelWeights(model)
+            # same seeds, i.e. same samples
+            manual_seed(1)
+            estimator.loss(model, input, target)
+            grads.append([layer.alphas.grad.clone() for layer in model.layersList])
+            if estimatorClass is DistributedSamePath:
+                estimator.stopRanks()
+            estimator.stopWorkers()
+
+        # rank 1 samples are part of the gradient, i.e. it is equal to local gradient of all samples
+        success = all(allclose(g1, g2, atol=1E-5) for g1, g2 in zip(*grads)) and any(g.abs().sum().item() > 0 for g in grads[0])
+        results.put((rank, success, None))
+    except Exception as e:
+        results.put((rank, False, repr(e)))
+
+
+def test_distributed_same_path_cpu(tmp_path):
+    # free port for gloo rendezvous
+    with socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    worldSize = 2
+    ctx = mp.get_context('spawn')
+    results = ctx.Queue()
+    processes = [ctx.Process(target=runRank, args=(str(tmp_path), port, rank, worldSize, results)) for rank in range(worldSize)]
+    for p in processes:
+        p.start()
+
+    ranksResults = sorted(results.get(timeout=600) for _ in range(worldSize))
+    for p in processes:
+        p.join()
+
+    for rank, success, error in ranksResults:
+        assert success, 'rank [{}] failed: {}'.format(rank, error)
@@ -0,0 +1,35 @@
+from random import random
+
+from torch import rand, tensor, equal
+
+from UNIQ.loader_service import LoaderService
+
+
+# dataset with random augmentation, torch & python RNG
+class RandomDataset:
+    def __len__(self):
+        return 24
+
+    def __getitem__(self, idx):
+        return rand(2) + random(), tensor(idx)
+
+
+def epochs(seed, nWorkers, nEpochs=2):
+    service = LoaderService(dict(train=RandomDataset()), nWorkers, prefetch=3, seed=seed)
+    queue = service.queue('train', 4, shuffle=False, pin_memory=False)
+    batches = [list(queue) for _ in range(nEpochs)]
+    service.close()
+
+    return batches
+
+
+def test_batches_reproducible_by_seed():
+    batches = epochs(seed=1, nWorkers=3)
+    # batches do not depend on the worker which loads them
+    for otherBatches in [epochs(seed=1, nWorkers=3), epochs(seed=1, nWorkers=1)]:
+        for epoch, otherEpoch in zip(batches, otherBatches):
+            assert (all(equal(x, y) for (x, _), (y, _) in zip(epoch, otherEpoch)))
+
+    # augmentations differ between epochs & seeds
+    assert (not equal(batches[0][0][0], batches[1][0][0]))
+    assert (not equal(batches[0][0][0], epochs(seed=2, nWorkers=3)[0][0][0]))
@@ -0,0 +1,40 @@
+from argparse import Namespace
+
+from torch import randn, allclose, no_grad
+
+from cnn.HtmlLogger import HtmlLogger
+from cnn.model_replicator import ModelReplicator
+from cnn.gradEstimators import layer_same_path
+from conftest import modelArgs
+
+
+# replicator without replica workers, i.e. the state each worker holds
+def replicatorArgs(save, prefixCacheMB):
+    return Namespace(gpu=[0], nCopies=0, nSamples=2, alpha_limit=0.9, alpha_limit_counter=10, prefix_cache_mb=prefixCacheMB,
+                     replicator_device='cpu', replica_threads=1, **vars(modelArgs(save)))
+
+
+def test_prefix_depths_are_replicator_state(tmp_path, model):
+    from cnn.models import resnet
+
+    ModelReplicator.switchStage(model)
+    model.eval()
+    # 1st block path is pinned, i.e. model has a deterministic prefix
+    model.layersList[0].freezeAlphas(0)
+    replicators = [layer_same_path(model, resnet, replicatorArgs(tmp_path, prefixCacheMB), HtmlLogger(str(tmp_path), 'log_{}'.format(i)))
+                   for i, prefixCacheMB in enumerate([64, 0])]
+    input = randn(4, 3, 32, 32)
+
+    with no_grad():
+        model.choosePathByAlphas()
+        expected = model(input)
+        nBlocks, prefixOut = replicators[0].prefixForward(model, input)
+        assert (nBlocks > 0)
+        assert (len(replicators[0].prefixDepths) == 1)
+        # 2nd batch of the same size uses the cached depth
+        assert (replicators[0].prefixForward(model, input)[0] == nBlocks)
+        assert (allclose(replicators[0].sampleForward(model, nBlocks, prefixOut), expected, atol=1E-5))
+
+        # depths are not shared between replicators, disabled cache forwards from input
+        assert (replicators[1].prefixForward(model, input)[0] == 0)
+        assert (len(replicators[1].prefixDepths) == 0)
@@ -0,0 +1,33 @@
+from math import isfinite
+
+from torch import Tensor
+
+from cnn.partition_evaluator import PartitionEvaluator
+
+
+def test_evaluate_restores_model_partition(model, data_queue):
+    model.choosePathByAlphas()
+    currentPartition = model.getCurrentFiltersPartition()
+    candidates = [model.getCurrentPartitionTensors()]
+    model.choosePathByAlphas()
+    candidates.append(model.getCurrentPartitionTensors())
+    model.setFiltersByPartition(candidates[0])
+
+    evaluator = PartitionEvaluator(model, data_queue, data_queue, nBatchesBN=2)
+    results = evaluator.evaluate(candidates)
+
+    assert (len(results) == len(candidates))
+    for result in results:
+        assert (0.0 <= result['accuracy'] <= 100.0)
+        assert (isfinite(result['loss']))
+    # model partition is restored after evaluation
+    assert (model.getCurrentFiltersPartition() == currentPartition)
+
+
+def test_current_partition_tensors(model):
+    model.choosePathByAlphas()
+    partition = model.getCurrentPartitionTensors()
+    assert (all(isinstance(p, Tensor) for p in partition))
+    assert ([p.tolist() for p in partition] == model.getCurrentFiltersPartition())
+    # can be set back
+    model.setFiltersByPartition(partition)
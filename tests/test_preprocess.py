@@ -0,0 +1,12 @@
+import pytest
+from torchvision.transforms import RandomCrop
+
+from UNIQ.preprocess import get_transform, get_transform_padding
+
+
+@pytest.mark.parametrize('name, input_size, scale_size', [('cifar10', None, None), ('cifar100', 64, None), ('synthetic', 16, 28)])
+def test_transform_padding(name, input_size, scale_size):
+    # tensor loaders padding is the padding of get_transform() random crop
+    transform = get_transform(name, input_size=input_size, scale_size=scale_size)
+    crop = next(t for t in transform.transforms if isinstance(t, RandomCrop))
+    assert (get_transform_padding(name, input_size=input_size, scale_size=scale_size) == crop.padding)
@@ -0,0 +1,66 @@
+import pytest
+import torch
+
+from UNIQ import quantize as uniqQuantize
+from NICE import quantize as niceQuantize
+
+
+@pytest.mark.parametrize('module', [uniqQuantize, niceQuantize])
+def test_mean_std_tensors(module):
+    torch.manual_seed(0)
+    x = torch.randn(4, 8, 6, 6) * 3 + 1
+    mean, std = module.mean_std(x)
+    # statistics stay on device, i.e. no host syncs
+    assert (isinstance(mean, torch.Tensor) and (mean.dim() == 0) and (mean.dtype == x.dtype))
+    assert (abs(mean.item() - x.mean().item()) < 1E-5)
+    assert (abs(std.item() - x.std().item()) < 1E-5)
+
+
+@pytest.mark.parametrize('bitwidth', [2, 4, 8])
+def test_act_lut_matches_act_quantize(bitwidth):
+    from UNIQ.actquant import ActQuant
+
+    torch.manual_seed(0)
+    x = torch.randn(4, 8, 6, 6)
+    expected = uniqQuantize.act_quantize.apply(x.clone(), bitwidth)
+
+    act = ActQuant(quatize_during_training=True, quant=True, bitwidth=bitwidth, lut=True, momentum=1.0)
+    # training quantizes by batch range
+    act.train()
+    out = act(x)
+    # elements on tables thresholds might round differently
+    assert ((out - expected).abs().gt(1E-4).float().mean().item() < 1E-3)
+
+    # evaluation quantizes by running range, i.e. batch range with momentum 1
+    act.eval()
+    assert ((act(x) - expected).abs().gt(1E-4).float().mean().item() < 1E-3)
+
+
+def test_act_lut_tables_cached():
+    from UNIQ.actquant import ActQuant
+
+    torch.manual_seed(0)
+    act = ActQuant(quant=True, bitwidth=4, lut=True)
+    act.train()
+    act(torch.randn(4, 8, 6, 6))
+
+    act.eval()
+    act(torch.randn(4, 8, 6, 6))
+    thresholds = act.lut_thresholds
+    act(torch.randn(4, 8, 6, 6))
+    # tables are not rebuilt while bitwidth & running range are unchanged
+    assert (act.lut_thresholds is thresholds)
+    assert ('lut_levels' in act.state_dict())
+
+    act.bitwidth = 2
+    act(torch.randn(4, 8, 6, 6))
+    assert (act.lut_thresholds.numel() == (2 ** 2) - 1)
+
+
+def test_fused_uni_noise_empty_mask():
+    q = niceQuantize.quantize(4, 4, 1, noise_mask=0.)
+    torch.manual_seed(0)
+    x = torch.randn(64)
+    # empty mask is quantization only, like the unfused noise
+    out = q.fused_uni_noise_(x.clone(), -1., 1., 0.1, lambda t: t.clamp_(-1., 1.).mul_(2).round_().div_(2))
+    assert (out.equal(x.clamp(-1., 1.).mul(2).round().div(2)))
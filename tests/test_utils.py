@@ -0,0 +1,27 @@
+from random import random
+
+from torch import rand, randint, equal
+import numpy as np
+
+from cnn.utils import FixedBatchCache
+
+
+# data queue with random augmentation, torch & python RNG
+class RandomQueue:
+    def __len__(self):
+        return 3
+
+    def __iter__(self):
+        return iter([(rand(4, 3, 2, 2) + random(), randint(0, 10, (4,))) for _ in range(len(self))])
+
+
+def test_fixed_batch_cache_disk(tmp_path):
+    memory = FixedBatchCache(RandomQueue(), seed=3)
+    disk = FixedBatchCache(RandomQueue(), seed=3, path=str(tmp_path / 'cache'))
+
+    epochs = [list(disk) for _ in range(2)]
+    # file is memory-mapped once, batches are views on it
+    assert (isinstance(np.load(disk.filePath('input'), mmap_mode='c'), np.memmap))
+    assert (all(equal(x, y) and equal(t, u) for (x, t), (y, u) in zip(*epochs)))
+    assert (all(equal(x, y) and equal(t, u) for (x, t), (y, u) in zip(epochs[0], memory)))
+    assert (len(disk) == len(memory) == 3)